@@ -1,5 +1,7 @@
 import json
+import re
 
+from codegen_scripts.render_cache import render_response
 from generate_qa_pairs.tasks.data_structures import LongResponseQASample
 
 
@@ -15,7 +17,7 @@ def get_prompt(qa_sample: LongResponseQASample) -> str:
     )
 
     prompt = prompt_template.format(
-        api_response=json.dumps(qa_sample.api_response, indent=4),
+        api_response=render_response(qa_sample.api_response, "json_indent", qa_sample.response_ref),
         question=qa_sample.question,
     )
 
@@ -36,7 +38,7 @@ def get_prompt_schema(qa_sample: LongResponseQASample) -> str:
     )
 
     prompt = prompt_template.format(
-        api_response=json.dumps(qa_sample.api_response, indent=4),
+        api_response=render_response(qa_sample.api_response, "json_indent", qa_sample.response_ref),
         question=qa_sample.question,
         json_schema=qa_sample.schema
     )
@@ -64,9 +66,53 @@ def cot_get_prompt_schema(qa_sample: LongResponseQASample) -> str:
     )
 
     prompt = prompt_template.format(
-        api_response=json.dumps(qa_sample.api_response, indent=4),
+        api_response=render_response(qa_sample.api_response, "json_indent", qa_sample.response_ref),
         question=qa_sample.question,
         json_schema=qa_sample.schema
     )
 
-    return prompt
\ No newline at end of file
+    return prompt
+
+def get_prompt_batched(qa_samples: list[LongResponseQASample]) -> str:
+    """
+    One prompt asking all the questions of qa_samples, which are about the same API response
+    """
+
+    prompt_template = (
+        "You are given a response from an API call (in JSON format). "
+        "Answer each of the questions below based on the information provided in the API response.\n\n"
+        "```json\n{api_response}\n```\n\n"
+        "Questions:\n{questions}\n\n"
+        "Respond with a JSON object mapping the number of each question to its answer, "
+        "e.g. {{\"1\": \"answer to question 1\", \"2\": \"answer to question 2\"}}. "
+        "Only include the answers. Do not include any other text in the response.\n\n"
+        "Answers:"
+    )
+
+    prompt = prompt_template.format(
+        api_response=render_response(qa_samples[0].api_response, "json_indent", qa_samples[0].response_ref),
+        questions="\n".join(f"{i}. {qa_sample.question}" for i, qa_sample in enumerate(qa_samples, start=1)),
+    )
+
+    return prompt
+
+
+def parse_batched_answers(model_output: str, num_questions: int) -> dict[int, str]:
+    """
+    Answers of a get_prompt_batched prompt by question number (1-based). Reads the JSON object of the
+    output, or "<number>. <answer>" lines when it is not valid JSON. Unanswered questions are left out.
+    """
+    answers = {}
+    start, end = model_output.find("{"), model_output.rfind("}")
+    try:
+        parsed = json.loads(model_output[start:end + 1]) if start != -1 else None
+    except json.JSONDecodeError:
+        parsed = None
+    if isinstance(parsed, dict):
+        for key, answer in parsed.items():
+            if str(key).strip().isdigit() and answer is not None:
+                answers[int(str(key).strip())] = ", ".join(map(str, answer)) if isinstance(answer, list) else str(answer)
+    else:
+        for match in re.finditer(r"^\s*(\d+)\s*[.):]\s*(.+?)\s*$", model_output, re.MULTILINE):
+            answers[int(match.group(1))] = match.group(2)
+    return {number: answer for number, answer in answers.items() if 1 <= number <= num_questions}
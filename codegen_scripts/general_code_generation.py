@@ -6,6 +6,8 @@ import ast
 import inspect
 from dotenv import load_dotenv
 
+from codegen_scripts.render_cache import register_render_style, render_response
+from generate_qa_pairs.tasks.tracing import span
 from generate_qa_pairs.tasks.utils import get_lm, invoke_llm
 
 
@@ -176,53 +178,154 @@ Python Function:
 
 """
 
+# Variants of ZERO_SHOT_TEMPLATE and ZERO_SHOT_TEMPLATE_WITH_RESPONSE_SCHEMA with the question last: the
+# instructions, schema and data form a prefix shared by all the questions about a response, which
+# providers with prompt (KV) caching can reuse
+ZERO_SHOT_TEMPLATE_QUESTION_LAST = """
+You will be given a JSON object as data which is a response from a REST API containing information returned from the API call.
+You will then be given a task, which is to extract and return some information from the data.
 
-def extract_code_and_get_output(model_response: str, response_arr: Any) -> Any:
-    try:
-        start_idx = model_response.find("```python")
+Write a Python function that:
+    Starts the function with "def ".
+    Takes only the entire api response as input and doesn't have any other input.
+    Identifies the structure of the input data, ensuring it checks for relevant keys and data types.
+    When comparing strings, it should always convert both sides of the comparison to lowercase.
+    Processes the provided data.
+    Iterates through the data to extract relevant information.
+    Cleans numeric strings by removing non-numeric characters before converting them to integers.
+    Performs proper checks to ensure a key exists and is not None before querying its value.
+    Returns only the requested data as a string and no other extra information or words.
+    Do not add any extra keys or terms to the output.
+
+Final Check:
+    The function must be formatted in Python markdown for direct execution.
+    No explanations, comments, or additional text should be included.
+    Do not include any example usage.
+
+data = <<json_obj>>
+
+Your task is to extract and return <<task_prefix>>
+
+Python Function:
+
+"""
+
+
+ZERO_SHOT_TEMPLATE_WITH_RESPONSE_SCHEMA_QUESTION_LAST = """
+You will be given a JSON object as data which is a response from a REST API containing information returned from the API call.
+You will be given a JSON schema of the response from the REST API returned from the API call.
+You will then be given a user query, and your task is to extract and return the information from the JSON object which answers it.
+
+You need to write a Python function that:
+    Starts the function with "def ".
+    Takes only the entire api response as input and doesn't have any other input.
+    Identifies the structure of the input data, ensuring it checks for relevant keys and data types.
+    When comparing strings, it should always convert both sides of the comparison to lowercase.
+    Processes the provided data.
+    Iterates through the data to extract relevant information.
+    Cleans numeric strings by removing non-numeric characters before converting them to integers.
+    Performs proper checks to ensure a key exists and is not None before querying its value.
+    Returns only the requested data as a string and no other extra information or words.
+    Do not add any extra keys or terms to the output.
+
+Final Check:
+    The function must be formatted in Python markdown for direct execution.
+    No explanations, comments, or additional text should be included.
+    Do not include any example usage data.
+
+The JSON schema of the object given as data is as follows: <<json_schema>>
+
+data = <<json_obj>>
+
+The user query is: <<task_prefix>>
+
+Python Function:
+
+"""
+
+# One program per question template: the varying values of the question are parameters of the
+# function, so that it can be run for every question of the template and every response
+PARAMETERIZED_TEMPLATE = """
+Your task is to work with an already-loaded JSON object as a dictionary from a REST API response.
+Using the provided JSON schema, you need to write a Python function which answers any user query of the form: <<question_template>>
+where the values in braces change from query to query, for example: <<example_question>>
+
+You need to write a Python function that:
+    Starts the function with "def <<function_name>>(".
+    Takes the entire api response as first input, followed by <<parameters>> as strings, in this order, and doesn't have any other input.
+    Identifies the structure of the input data, ensuring it checks for relevant keys and data types.
+    When comparing strings, it should always convert both sides of the comparison to lowercase.
+    Processes the provided data.
+    Iterates through the data to extract relevant information.
+    Cleans numeric strings by removing non-numeric characters before converting them to integers.
+    Performs proper checks to ensure a key exists and is not None before querying its value.
+    Returns only the requested data as a string and no other extra information or words.
+    Do not add any extra keys or terms to the output.
+
+Final Check:
+    The function must be formatted in Python markdown for direct execution.
+    No explanations, comments, or additional text should be included.
+    Do not include any example usage data.
+
+The JSON schema of the object given as data is as follows: <<json_schema>>
+
+Python Function:
+
+"""
+
+def extract_code(model_response: str) -> str:
+    start_idx = model_response.find("```python")
+    if start_idx == -1:
+        start_idx = model_response.find("def ")
         if start_idx == -1:
-            start_idx = model_response.find("def ")
-            if start_idx == -1:
-                raise ValueError("Python code block not found in response.")
-            else:
-                model_response_first_part = model_response
+            raise ValueError("Python code block not found in response.")
         else:
-            model_response_first_part = model_response[start_idx + 9 :]
+            model_response_first_part = model_response
+    else:
+        model_response_first_part = model_response[start_idx + 9 :]
+
+    end_idx = model_response_first_part.find("```")
+    if end_idx != -1:
+        code = model_response_first_part[:end_idx].strip()
+    else:
+        code = model_response_first_part.strip()
+
+    if "# Example usage:" in code:
+        logger.debug("Removing example usage section from code.")
+        code = code.split("# Example usage:")[0]
+    return code
 
-        end_idx = model_response_first_part.find("```")
-        if end_idx != -1:
-            code = model_response_first_part[:end_idx].strip()
-        else:
-            code = model_response_first_part.strip()
-
-        if "# Example usage:" in code:
-            logger.debug("Removing example usage section from code.")
-            code = code.split("# Example usage:")[0]
-
-        def_find = code.find("def")
-        first_open_parenthesis = code.find("(")
-        function_name = code[def_find +4:first_open_parenthesis].strip()
-
-        tree = ast.parse(code)
-        for node in tree.body:
-            if isinstance(node, (ast.Import, ast.ImportFrom)):
-                compiled = compile(ast.Module(body=[node], type_ignores=[]), filename="<ast>", mode="exec")
-                exec(compiled, globals())
-
-        exec(
-            code, globals()
-        )  # Executes the function definition and adds in the globals namespace
-
-        if function_name in globals():
-            code_result = eval(
-                f"{function_name}({response_arr})"
-            )  # actual function call
-            del globals()[function_name]  # Clean up global namespace
-            return code_result
-        else:
-            raise ValueError(
-                f"Function {function_name} not found after execution, code: {code}"
-            )
+
+def extract_code_and_get_output(model_response: str, response_arr: Any) -> Any:
+    try:
+        with span("extract_code"):
+            code = extract_code(model_response)
+
+        with span("execute_code"):
+            def_find = code.find("def")
+            first_open_parenthesis = code.find("(")
+            function_name = code[def_find +4:first_open_parenthesis].strip()
+
+            tree = ast.parse(code)
+            for node in tree.body:
+                if isinstance(node, (ast.Import, ast.ImportFrom)):
+                    compiled = compile(ast.Module(body=[node], type_ignores=[]), filename="<ast>", mode="exec")
+                    exec(compiled, globals())
+
+            exec(
+                code, globals()
+            )  # Executes the function definition and adds in the globals namespace
+
+            if function_name in globals():
+                code_result = eval(
+                    f"{function_name}({response_arr})"
+                )  # actual function call
+                del globals()[function_name]  # Clean up global namespace
+                return code_result
+            else:
+                raise ValueError(
+                    f"Function {function_name} not found after execution, code: {code}"
+                )
 
     except Exception as e:
         logger.error(f"Error during code execution: {e}")
@@ -236,82 +339,103 @@ class PromptStyle(Enum):
     ZERO_SHOT_WITH_NO_RESPONSE = ZERO_SHOT_TEMPLATE_WITH_NO_RESPONSE
     ZERO_SHOT_WITH_COMPACT_RESPONSE = ZERO_SHOT_TEMPLATE_WITH_COMPACT_RESPONSE
     ZERO_SHOT_WITH_COT_RESPONSE_SCHEMA=ZERO_SHOT_TEMPLATE_WITH_COT_RESPONSE_SCHEMA
+    ZERO_SHOT_QUESTION_LAST = ZERO_SHOT_TEMPLATE_QUESTION_LAST
+    ZERO_SHOT_WITH_RESPONSE_SCHEMA_QUESTION_LAST = ZERO_SHOT_TEMPLATE_WITH_RESPONSE_SCHEMA_QUESTION_LAST
+
+def get_all_keys(obj, parent_keys=None):
+    """
+    Recursively gather all unique keys in a JSON structure.
+    """
+    if parent_keys is None:
+        parent_keys = set()
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            parent_keys.add(k)
+            get_all_keys(v, parent_keys)
+    elif isinstance(obj, list):
+        for item in obj:
+            get_all_keys(item, parent_keys)
+    return parent_keys
+
+
+def reduce_json_by_unique_keys(obj, known_keys=None):
+    """
+    Reduce JSON structure but keep items in lists that add new keys.
+    """
+    if known_keys is None:
+        known_keys = set()
+
+    if isinstance(obj, dict):
+        new_obj = {}
+        for k, v in obj.items():
+            reduced_value = reduce_json_by_unique_keys(v, known_keys)
+            new_obj[k] = reduced_value
+        return new_obj
+
+    elif isinstance(obj, list):
+        reduced_list = []
+        for item in obj:
+            item_keys = get_all_keys(item)
+            if not item_keys.issubset(known_keys):
+                known_keys.update(item_keys)
+                reduced_list.append(reduce_json_by_unique_keys(item, known_keys))
+        return reduced_list
 
-def get_answer_from_json(
+    else:
+        return obj
+
+
+@register_render_style("reduced_repr")
+def render_reduced_repr(api_response: Any) -> str:
+    return str(reduce_json_by_unique_keys(api_response))
+
+
+def build_prompt(
     api_response: dict[str, Any],
     query: str,
-    llm_object: Any,
-    model_name: str,
     prompt_style: Enum = PromptStyle.ZERO_SHOT,
     few_shots: str = "",
-    json_schema: str = ""
-) -> Any:
-
-    print(f"Question: {query}")
+    json_schema: str = "",
+    response_ref: str | None = None,
+) -> str:
     template = str(prompt_style.value)
     if "<<example>>" in template:
         template = template.replace("<<example>>", few_shots)
 
-    if prompt_style == PromptStyle.ZERO_SHOT_WITH_RESPONSE_SCHEMA or prompt_style== PromptStyle.ZERO_SHOT_WITH_NO_RESPONSE or prompt_style==PromptStyle.ZERO_SHOT_WITH_COMPACT_RESPONSE or prompt_style==PromptStyle.ZERO_SHOT_WITH_COT_RESPONSE_SCHEMA:
+    if prompt_style == PromptStyle.ZERO_SHOT_WITH_RESPONSE_SCHEMA or prompt_style== PromptStyle.ZERO_SHOT_WITH_NO_RESPONSE or prompt_style==PromptStyle.ZERO_SHOT_WITH_COMPACT_RESPONSE or prompt_style==PromptStyle.ZERO_SHOT_WITH_COT_RESPONSE_SCHEMA or prompt_style==PromptStyle.ZERO_SHOT_WITH_RESPONSE_SCHEMA_QUESTION_LAST:
         if json_schema is None or json_schema == "":
             raise ValueError("Json schema can not be None or empty for prompt style PromptStyle.ZERO_SHOT_WITH_RESPONSE_SCHEMA")
         template = template.replace("<<json_schema>>", json_schema)
 
+    # the serialized response is shared by all the questions about it, see render_cache
     if prompt_style != PromptStyle.ZERO_SHOT_WITH_NO_RESPONSE:
         if prompt_style == PromptStyle.ZERO_SHOT_WITH_COMPACT_RESPONSE:
-            def get_all_keys(obj, parent_keys=None):
-                """
-                Recursively gather all unique keys in a JSON structure.
-                """
-                if parent_keys is None:
-                    parent_keys = set()
-                if isinstance(obj, dict):
-                    for k, v in obj.items():
-                        parent_keys.add(k)
-                        get_all_keys(v, parent_keys)
-                elif isinstance(obj, list):
-                    for item in obj:
-                        get_all_keys(item, parent_keys)
-                return parent_keys
-
-            def reduce_json_by_unique_keys(obj, known_keys=None):
-                """
-                Reduce JSON structure but keep items in lists that add new keys.
-                """
-                if known_keys is None:
-                    known_keys = set()
-
-                if isinstance(obj, dict):
-                    new_obj = {}
-                    for k, v in obj.items():
-                        reduced_value = reduce_json_by_unique_keys(v, known_keys)
-                        new_obj[k] = reduced_value
-                    return new_obj
-
-                elif isinstance(obj, list):
-                    reduced_list = []
-                    for item in obj:
-                        item_keys = get_all_keys(item)
-                        if not item_keys.issubset(known_keys):
-                            known_keys.update(item_keys)
-                            reduced_list.append(reduce_json_by_unique_keys(item, known_keys))
-                    return reduced_list
-
-                else:
-                    return obj
-
-            reduced_data = reduce_json_by_unique_keys(api_response)
-
-
             prompt = template.replace("<<task_prefix>>", query.lower()).replace(
-                "<<json_obj>>", str(reduced_data)
+                "<<json_obj>>", render_response(api_response, "reduced_repr", response_ref)
             )
         else:
             prompt = template.replace("<<task_prefix>>", query.lower()).replace(
-                "<<json_obj>>", str(api_response)
+                "<<json_obj>>", render_response(api_response, "repr", response_ref)
             )
     else:
         prompt = template.replace("<<task_prefix>>", query.lower())
+    return prompt
+
+
+def get_answer_from_json(
+    api_response: dict[str, Any],
+    query: str,
+    llm_object: Any,
+    model_name: str,
+    prompt_style: Enum = PromptStyle.ZERO_SHOT,
+    few_shots: str = "",
+    json_schema: str = "",
+    response_ref: str | None = None,
+) -> Any:
+
+    print(f"Question: {query}")
+    with span("build_prompt"):
+        prompt = build_prompt(api_response, query, prompt_style, few_shots, json_schema, response_ref)
 
     logger.info(f"Model used: {model_name}")
 
@@ -0,0 +1,189 @@
+import copy
+import hashlib
+import inspect
+import re
+import types
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Callable, Type
+
+from codegen_scripts.general_code_generation import PARAMETERIZED_TEMPLATE, extract_code, logger
+from generate_qa_pairs.tasks import (
+    base,
+    booking_get_seat_map,
+    booking_rooms_with_availability,
+    booking_search_car_rentals,
+    booking_search_hotel_by_coordinates,
+    product_details_shoes,
+    SEC_filings,
+)
+from generate_qa_pairs.tasks.tracing import span
+from generate_qa_pairs.tasks.utils import invoke_llm
+
+TASK_MODULES = [
+    booking_get_seat_map,
+    booking_rooms_with_availability,
+    booking_search_car_rentals,
+    booking_search_hotel_by_coordinates,
+    product_details_shoes,
+    SEC_filings,
+]
+
+# name the prompt asks the generated function to have
+PROGRAM_FUNCTION_NAME = "answer_query"
+
+# programs generated and questions answered by an already generated program, in this process
+program_stats: Counter = Counter()
+
+
+@dataclass(frozen=True)
+class QuestionTemplate:
+    template: str  # question with "{parameter}" in place of each varying value
+    parameters: tuple[str, ...]
+    pattern: re.Pattern
+
+    def match(self, question: str) -> tuple[str, ...] | None:
+        match = self.pattern.fullmatch(question)
+        return match.groups() if match else None
+
+
+@lru_cache(maxsize=None)
+def get_task_class(task_name: str) -> Type[base.Task] | None:
+    # task names of the QA pairs are the class names, which are unique across the task modules
+    for module in TASK_MODULES:
+        task_cls = getattr(module, task_name, None)
+        if isinstance(task_cls, type) and issubclass(task_cls, base.Task):
+            return task_cls
+    return None
+
+
+@lru_cache(maxsize=None)
+def get_question_template(task_cls: Type[base.Task]) -> QuestionTemplate | None:
+    """
+    Template of the questions of a task, found by calling its get_question with a marker for every
+    parameter. None when get_question does more than format its parameters into the question.
+    """
+    parameters = tuple(inspect.signature(task_cls.get_question).parameters)[1:]
+    markers = {name: f"\x00{name}\x00" for name in parameters}
+    try:
+        question = task_cls().get_question(**markers)
+    except Exception:
+        return None
+    if not all(question.count(marker) == 1 for marker in markers.values()):
+        return None
+    parts = re.split("\x00(\\w+)\x00", question)
+    # parts alternates literal text and parameter names
+    template = "".join("{" + part + "}" if i % 2 else part for i, part in enumerate(parts))
+    pattern = "".join("(.+?)" if i % 2 else re.escape(part) for i, part in enumerate(parts))
+    return QuestionTemplate(template, tuple(parts[1::2]), re.compile(pattern, re.DOTALL))
+
+
+def get_sample_template(qa_sample: Any) -> QuestionTemplate | None:
+    # template of the task of a sample, when its question follows it
+    task_cls = get_task_class(qa_sample.task) if qa_sample.task else None
+    question_template = get_question_template(task_cls) if task_cls else None
+    if question_template is None or question_template.match(qa_sample.question) is None:
+        return None
+    return question_template
+
+
+def compile_program(model_response: str) -> Callable:
+    """
+    Function defined by the code of a model response, in a namespace of its own: the one named
+    PROGRAM_FUNCTION_NAME, else the last one defined
+    """
+    namespace: dict[str, Any] = {}
+    with span("extract_code"):
+        code = extract_code(model_response)
+    exec(code, namespace)
+    if isinstance(namespace.get(PROGRAM_FUNCTION_NAME), types.FunctionType):
+        return namespace[PROGRAM_FUNCTION_NAME]
+    functions = [value for value in namespace.values() if isinstance(value, types.FunctionType)]
+    if not functions:
+        raise ValueError(f"No function found in code: {code}")
+    # the model did not follow the name, helpers usually come first
+    return functions[-1]
+
+
+class ProgramCache:
+    """
+    One generated program per (model, schema, question template), reused for every question of the
+    template about any response with that schema: the values of the question are passed as parameters.
+    """
+
+    def __init__(self) -> None:
+        self._programs: dict[tuple[str, str, str], tuple[str, Callable | None]] = {}
+
+    def get_program(self, llm: Any, model_name: str, schema: str, question_template: QuestionTemplate,
+                    example_question: str) -> tuple[str, Callable | None]:
+        key = (model_name, hashlib.sha1(schema.encode("utf-8")).hexdigest(), question_template.template)
+        if key in self._programs:
+            program_stats["program_reuses"] += 1
+            return self._programs[key]
+        with span("build_prompt"):
+            prompt = (PARAMETERIZED_TEMPLATE.replace("<<question_template>>", question_template.template)
+                      .replace("<<example_question>>", example_question)
+                      .replace("<<function_name>>", PROGRAM_FUNCTION_NAME)
+                      .replace("<<parameters>>", ", ".join(question_template.parameters) or "no other parameter")
+                      .replace("<<json_schema>>", schema))
+        try:
+            model_response = invoke_llm(llm, prompt, model_name)
+        except Exception as e:
+            # not cached, the next question of the template asks again
+            logger.error(f"Error during program generation: {e}")
+            return None, None
+        program_stats["programs_generated"] += 1
+        try:
+            program = compile_program(model_response)
+        except Exception as e:
+            logger.error(f"Error during code compilation: {e}")
+            program = None
+        self._programs[key] = (model_response, program)
+        return self._programs[key]
+
+
+program_cache = ProgramCache()
+
+# copies of the last responses the programs ran on, by object (the original is kept so that its id is not reused)
+RESPONSE_COPIES_SIZE = 4
+_response_copies: OrderedDict[int, tuple[Any, Any]] = OrderedDict()
+
+
+def get_response_copy(api_response: Any) -> Any:
+    """
+    Copy of the response for the programs, made once per response rather than once per question, as
+    a copy per question costs about as much as reusing the programs saves on large responses. The
+    tradeoff: a program modifying its input can affect the later questions about that response run
+    by the programs of this process, but never the shared response the other samples read.
+    """
+    key = id(api_response)
+    if key in _response_copies:
+        _response_copies.move_to_end(key)
+        return _response_copies[key][1]
+    response_copy = copy.deepcopy(api_response)
+    _response_copies[key] = (api_response, response_copy)
+    if len(_response_copies) > RESPONSE_COPIES_SIZE:
+        _response_copies.popitem(last=False)
+    return response_copy
+
+
+def answer_with_program(api_response: Any, question: str, question_template: QuestionTemplate, llm: Any,
+                        model_name: str, schema: str) -> tuple[str, Any, Any] | None:
+    """
+    Answer a question by running the cached program of its template, generated on first use.
+    Returns (model_response, code_output, eval_output) like get_answer_from_json, or None like it
+    when the model could not be called.
+    """
+    model_response, program = program_cache.get_program(llm, model_name, schema, question_template, question)
+    if model_response is None:
+        return None
+    if program is None:
+        return model_response, None, "Code execution error"
+    try:
+        with span("execute_code"):
+            eval_output = program(get_response_copy(api_response), *question_template.match(question))
+    except Exception as e:
+        logger.error(f"Error during code execution: {e}")
+        return model_response, None, "Code execution error"
+    return model_response, eval_output, eval_output
@@ -0,0 +1,63 @@
+import json
+from collections import Counter, OrderedDict
+from typing import Any, Callable
+
+# Number of rendered responses kept per process; 0 disables the cache
+RENDER_CACHE_SIZE = 32
+
+RENDER_STYLES: dict[str, Callable[[Any], str]] = {}
+
+_RENDERED: OrderedDict = OrderedDict()
+render_cache_stats: Counter = Counter()
+
+
+def register_render_style(name: str) -> Callable:
+    """
+    Decorator registering a function serializing an api_response for the prompts
+    """
+    def decorator(func: Callable[[Any], str]) -> Callable[[Any], str]:
+        RENDER_STYLES[name] = func
+        return func
+    return decorator
+
+
+@register_render_style("json_indent")
+def render_json_indent(api_response: Any) -> str:
+    return json.dumps(api_response, indent=4)
+
+
+@register_render_style("json_compact")
+def render_json_compact(api_response: Any) -> str:
+    return json.dumps(api_response, separators=(",", ":"))
+
+
+@register_render_style("repr")
+def render_repr(api_response: Any) -> str:
+    return str(api_response)
+
+
+def render_response(api_response: Any, style: str, response_ref: str | None = None) -> str:
+    """
+    Serialize an api_response in the given style, once per response and style for all the questions about it.
+    Responses are keyed by response_ref (content hash) when known, otherwise by object identity.
+    """
+    if RENDER_CACHE_SIZE <= 0:
+        return RENDER_STYLES[style](api_response)
+    key = (response_ref or id(api_response), style)
+    cached = _RENDERED.get(key)
+    # the object is kept with its rendering so that an id can not be reused by another response
+    if cached is not None and (response_ref is not None or cached[0] is api_response):
+        _RENDERED.move_to_end(key)
+        render_cache_stats["hits"] += 1
+        return cached[1]
+    render_cache_stats["misses"] += 1
+    rendered = RENDER_STYLES[style](api_response)
+    _RENDERED[key] = (api_response, rendered)
+    if len(_RENDERED) > RENDER_CACHE_SIZE:
+        _RENDERED.popitem(last=False)
+    return rendered
+
+
+def clear_render_cache() -> None:
+    _RENDERED.clear()
+    render_cache_stats.clear()
@@ -0,0 +1,83 @@
+import json
+import os
+import pickle
+import time
+from multiprocessing import Pool, resource_tracker
+from typing import Any
+
+from generate_qa_pairs.tasks.data_structures import LongResponseQASample
+from qa_inference import group_samples_by_response, imap_chunksize, load_qa_samples
+from response_arena import restore_responses, share_responses, strip_responses
+
+
+def resolve_task(args: tuple) -> int:
+    # the worker side of run_inference_task without the inference: get the responses and touch them
+    qa_pairs, arena_name = args
+    if arena_name:
+        restore_responses(qa_pairs, arena_name)
+    return sum(len(sample.api_response) for sample in qa_pairs)
+
+
+def dispatch(args: list[tuple], num_processes: int) -> float:
+    with Pool(processes=num_processes) as pool:
+        start = time.perf_counter()
+        for _ in pool.imap_unordered(resolve_task, args, chunksize=imap_chunksize(len(args), num_processes)):
+            pass
+        return time.perf_counter() - start
+
+
+def benchmark_ipc(qa_samples: list[LongResponseQASample], num_processes: int, max_questions_per_task: int,
+                  repeat: int) -> dict[str, Any]:
+    """
+    Bytes pickled for the task arguments and time to get every response to the workers, with the
+    responses pickled in every task or placed once in a response arena
+    """
+    batches = group_samples_by_response(qa_samples, max_questions_per_task)
+    inline_args = [(batch, None) for batch in batches]
+    inline_bytes = sum(len(pickle.dumps(arg, protocol=pickle.HIGHEST_PROTOCOL)) for arg in inline_args)
+    inline_seconds = min(dispatch(inline_args, num_processes) for _ in range(repeat))
+
+    start = time.perf_counter()
+    arena = share_responses(qa_samples)
+    arena_args = [(strip_responses(batch), arena.name) for batch in batches]
+    setup_seconds = time.perf_counter() - start
+    arena_bytes = sum(len(pickle.dumps(arg, protocol=pickle.HIGHEST_PROTOCOL)) for arg in arena_args)
+    arena_seconds = min(dispatch(arena_args, num_processes) for _ in range(repeat))
+    result = {
+        "samples": len(qa_samples),
+        "tasks": len(batches),
+        "responses": len({sample.response_ref for sample in qa_samples}),
+        "inline_ipc_mb": inline_bytes / 2 ** 20,
+        "arena_ipc_mb": arena_bytes / 2 ** 20,
+        "arena_mb": arena.nbytes / 2 ** 20,
+        "inline_seconds": inline_seconds,
+        "arena_seconds": arena_seconds,
+        "arena_setup_seconds": setup_seconds,
+    }
+    arena.close()
+    arena.unlink()
+    return result
+
+
+if __name__ == "__main__":
+    # the largest endpoint of data_dir, e.g. a synthetic copy from synthetic_responses.py for larger responses
+    data_dir = os.path.join(os.path.dirname(__file__), "../generate_qa_pairs/data/")
+    num_processes = 8
+    max_questions_per_task = 8
+    repeat = 3
+
+    resource_tracker.ensure_running()
+    task_sizes = {}
+    for fname in os.listdir(os.path.join(data_dir, "qa_pairs")):
+        task = fname.removesuffix("_qa_pairs.json")
+        with open(os.path.join(data_dir, "qa_pairs", fname)) as f:
+            paths = {sample["api_response_path"] for sample in json.load(f)}
+        task_sizes[task] = sum(os.path.getsize(os.path.join(data_dir, path)) for path in paths)
+    task = max(task_sizes, key=task_sizes.get)
+    qa_samples = load_qa_samples(task, simplify_json=False, data_dir=data_dir)
+
+    result = benchmark_ipc(qa_samples, num_processes, max_questions_per_task, repeat)
+    print(f"{task}: {result['samples']} samples in {result['tasks']} tasks about {result['responses']} responses")
+    print(f"    pickled with the tasks: {result['inline_ipc_mb']:8.1f} MB sent {result['inline_seconds'] * 1000:8.1f} ms")
+    print(f"    response arena:         {result['arena_ipc_mb']:8.1f} MB sent {result['arena_seconds'] * 1000:8.1f} ms "
+          f"(+ {result['arena_mb']:.1f} MB arena written in {result['arena_setup_seconds'] * 1000:.1f} ms)")
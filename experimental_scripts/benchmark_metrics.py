@@ -0,0 +1,65 @@
+import glob
+import json
+import os
+import random
+import re
+import timeit
+
+from generate_qa_pairs.tasks import evals
+from generate_qa_pairs.tasks.data_structures import LongResponseQASample
+
+
+def legacy_approx_number_match(task: LongResponseQASample, rounding: bool = True) -> bool:
+    # previous implementation, kept as the baseline of the benchmark
+    if not isinstance(task.gold_answer, str) or not isinstance(task.pred_answer, str):
+        return False
+
+    pred_answers = re.findall(
+        r"[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?", task.pred_answer
+    )
+    for pred_ans_matches in pred_answers:
+        pred_ans: str = pred_ans_matches[0]
+        gold_ans = (re.findall(
+            r"[-+]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?", task.gold_answer
+        ))[0]
+        if rounding:
+            if abs(float(pred_ans) - float(gold_ans)) < 1:
+                return True
+        else:
+            return (pred_ans == gold_ans)
+
+    return False
+
+
+def load_aggregation_samples(qa_pairs_dir: str, list_length: int, seed: int = 1) -> list[LongResponseQASample]:
+    """
+    All AGGREGATION samples of the dataset, with a long predicted answer listing list_length prices
+    that do not match the gold answer followed by the gold answer itself (worst case for the matcher)
+    """
+    rng = random.Random(seed)
+    samples = []
+    for task_file in sorted(glob.glob(os.path.join(qa_pairs_dir, "*_qa_pairs.json"))):
+        with open(task_file, 'r') as f:
+            qa_pairs = json.load(f)
+        for sample in qa_pairs:
+            if sample['task_type'] != 'AGGREGATION':
+                continue
+            prices = ", ".join(f"${rng.uniform(1000, 5000):,.2f}" for _ in range(list_length))
+            samples.append(LongResponseQASample(
+                api_response={},
+                question=sample['question'],
+                gold_answer=sample['gold_answer'],
+                pred_answer=f"The prices are {prices} and the answer is {sample['gold_answer']}.",
+            ))
+    return samples
+
+
+if __name__ == "__main__":
+    qa_pairs_dir = os.path.join(os.path.dirname(__file__), "../generate_qa_pairs/data/qa_pairs")
+    for list_length in [1, 10, 100]:
+        samples = load_aggregation_samples(qa_pairs_dir, list_length)
+        for name, metric in [("legacy", legacy_approx_number_match), ("approx_number_match", evals.approx_number_match)]:
+            runs = timeit.repeat(lambda: [metric(sample) for sample in samples], number=5, repeat=3)
+            matches = sum(metric(sample) for sample in samples)
+            print(f"{len(samples)} AGGREGATION samples, {list_length} numbers per prediction, {name}: "
+                  f"{min(runs) / 5 * 1000:.2f} ms per pass, {matches} matches")
@@ -0,0 +1,311 @@
+import hashlib
+import json
+import os
+import random
+import re
+import resource
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Pool
+from typing import Any
+
+import numpy as np
+
+from generate_qa_pairs.tasks import utils
+from generate_qa_pairs.tasks.data_structures import LongResponseQASample
+from qa_inference import group_samples_by_response, group_samples_by_task, load_qa_samples, run_inference_task
+
+# Returned for every prompt in "canned" mode: parsed and executed by the code generation setups,
+# taken as the predicted answer by the direct prompting ones
+CANNED_COMPLETION = """```python
+def get_answer(api_response, *parameters):
+    return len(str(api_response)) + len(parameters)
+```"""
+
+# granularity of the simulated prompt cache, in characters
+PREFIX_BLOCK_CHARS = 256
+
+
+class MockLLMServer:
+    """
+    Local OpenAI-compatible server answering /chat/completions and /completions (any path prefix,
+    so Azure deployment URLs work too) and Ollama's streamed /api/generate, after a configurable
+    latency. A fraction of the requests fail with a 500 or a 429 carrying a retry-after-ms header.
+    Completions are canned (a JSON object of canned answers for the numbered questions of
+    direct_prompting_batched prompts) or echo the prompt. With prefix_cache set, the usage reports as
+    cached_tokens the leading blocks of the prompt already seen in an earlier prompt, like providers
+    with prompt caching.
+    """
+
+    def __init__(self, latency: float = 0.05, latency_jitter: float = 0.0, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, retry_after_ms: int = 10, mode: str = "canned", seed: int = 1,
+                 prefix_cache: bool = True) -> None:
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after_ms = retry_after_ms
+        self.mode = mode
+        self.prefix_cache = prefix_cache
+        self.stats: Counter = Counter()
+        self._prefix_blocks: set[str] = set()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd: ThreadingHTTPServer | None = None
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stats.clear()
+            self._prefix_blocks.clear()
+
+    def completion_text(self, prompt: str) -> str:
+        if self.mode == "echo":
+            return prompt
+        if "\nQuestions:\n" in prompt:
+            # batched prompt: one canned answer per numbered question
+            questions = re.findall(r"^(\d+)\. ", prompt.rsplit("\nQuestions:\n", 1)[1], re.MULTILINE)
+            return json.dumps({number: CANNED_COMPLETION for number in questions})
+        return CANNED_COMPLETION
+
+    def cached_prefix_chars(self, prompt: str) -> int:
+        # each block is keyed by the hash of the whole prefix ending with it, as in paged KV caches
+        digest = hashlib.sha1()
+        cached = 0
+        with self._lock:
+            for start in range(0, len(prompt) - PREFIX_BLOCK_CHARS + 1, PREFIX_BLOCK_CHARS):
+                digest.update(prompt[start:start + PREFIX_BLOCK_CHARS].encode("utf-8"))
+                key = digest.hexdigest()
+                if cached == start and key in self._prefix_blocks:
+                    cached += PREFIX_BLOCK_CHARS
+                self._prefix_blocks.add(key)
+        return cached
+
+    def handle(self, handler: BaseHTTPRequestHandler) -> None:
+        body = json.loads(handler.rfile.read(int(handler.headers.get("Content-Length", 0))) or b"{}")
+        with self._lock:
+            self.stats["requests"] += 1
+            draw = self._rng.random()
+            delay = max(0.0, self.latency + self._rng.uniform(-self.latency_jitter, self.latency_jitter))
+        time.sleep(delay)
+
+        if draw < self.rate_limit_rate:
+            with self._lock:
+                self.stats["rate_limited"] += 1
+            self.send_json(handler, 429, {"error": {"message": "Rate limit exceeded", "type": "rate_limit"}},
+                           {"retry-after-ms": str(self.retry_after_ms)})
+            return
+        if draw < self.rate_limit_rate + self.error_rate:
+            with self._lock:
+                self.stats["server_errors"] += 1
+            self.send_json(handler, 500, {"error": {"message": "Injected server error", "type": "server_error"}})
+            return
+
+        model = body.get("model", "mock")
+        if handler.path.split("?")[0].endswith("/api/generate"):
+            self.send_ollama_stream(handler, model, body["prompt"])
+            return
+        if handler.path.split("?")[0].endswith("/chat/completions"):
+            prompt = body["messages"][-1]["content"]
+            text = self.completion_text(prompt)
+            choices = [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}]
+            prompts = [prompt]
+            obj = "chat.completion"
+        else:
+            prompts = body["prompt"] if isinstance(body["prompt"], list) else [body["prompt"]]
+            choices = [{"index": i, "text": self.completion_text(prompt), "finish_reason": "stop", "logprobs": None}
+                       for i, prompt in enumerate(prompts)]
+            obj = "text_completion"
+        prompt_tokens = sum(len(prompt) for prompt in prompts) // 4
+        completion_tokens = sum(len(choice.get("text") or choice["message"]["content"]) for choice in choices) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        if self.prefix_cache:
+            usage["prompt_tokens_details"] = {
+                "cached_tokens": sum(self.cached_prefix_chars(prompt) for prompt in prompts) // 4}
+        with self._lock:
+            self.stats["completed"] += 1
+        self.send_json(handler, 200, {
+            "id": "mock-" + str(self.stats["requests"]),
+            "object": obj,
+            "created": int(time.time()),
+            "model": model,
+            "choices": choices,
+            "usage": usage,
+        })
+
+    def send_ollama_stream(self, handler: BaseHTTPRequestHandler, model: str, prompt: str) -> None:
+        # newline-delimited JSON chunks of ~4 characters ("tokens"), in chunked transfer encoding
+        text = self.completion_text(prompt)
+        chunks = [{"model": model, "response": text[i:i + 4], "done": False} for i in range(0, len(text), 4)]
+        chunks.append({"model": model, "response": "", "done": True, "done_reason": "stop",
+                       "prompt_eval_count": len(prompt) // 4, "eval_count": len(chunks)})
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/x-ndjson")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+        try:
+            for chunk in chunks:
+                data = (json.dumps(chunk) + "\n").encode("utf-8")
+                handler.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            handler.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # the client stopped reading (early stop)
+            with self._lock:
+                self.stats["aborted"] += 1
+            return
+        with self._lock:
+            self.stats["completed"] += 1
+
+    @staticmethod
+    def send_json(handler: BaseHTTPRequestHandler, status: int, payload: dict[str, Any],
+                  headers: dict[str, str] | None = None) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self) -> None:
+                server.handle(self)
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return f"http://{host}:{self._httpd.server_address[1]}"
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def timed_inference_task(args: tuple) -> tuple[float, list[LongResponseQASample], dict[str, int]]:
+    start = time.perf_counter()
+    output_list, usage = run_inference_task(args)
+    return time.perf_counter() - start, output_list, usage
+
+
+def benchmark_setup(server: MockLLMServer, qa_samples: list[LongResponseQASample], setup_type: str,
+                    model_name: str, num_processes: int, group_by_response: bool = False,
+                    max_questions_per_task: int = 0) -> dict[str, Any]:
+    """
+    Run the inference of every sample against the mock server, dispatched as in qa_inference
+    (one task per sample, or tasks of questions about the same response). The latency of a sample is
+    the time of its task divided by the number of samples in it.
+    """
+    server.reset()
+    if setup_type == "direct_prompting_batched":
+        batches = group_samples_by_response(qa_samples)
+    elif setup_type == "code_generation_parameterized":
+        batches = group_samples_by_task(qa_samples)
+    elif group_by_response:
+        batches = group_samples_by_response(qa_samples, max_questions_per_task)
+    else:
+        batches = [[sample] for sample in qa_samples]
+    args = [(batch, setup_type, model_name, {}) for batch in batches]
+    start = time.perf_counter()
+    if num_processes == 0:
+        timings = [timed_inference_task(arg) for arg in args]
+    else:
+        with Pool(processes=num_processes) as pool:
+            timings = list(pool.imap_unordered(timed_inference_task, args))
+    elapsed = time.perf_counter() - start
+    latencies = np.array([latency / len(output_list) for latency, output_list, _ in timings
+                          for _ in output_list]) * 1000
+    usage = Counter()
+    for _, _, task_usage in timings:
+        usage.update(task_usage)
+    return {
+        "setup_type": setup_type,
+        "samples": len(qa_samples),
+        "samples_per_sec": len(qa_samples) / elapsed,
+        "p50_latency_ms": float(np.percentile(latencies, 50)),
+        "p95_latency_ms": float(np.percentile(latencies, 95)),
+        "requests": server.stats["requests"],
+        "retries": server.stats["requests"] - server.stats["completed"] - server.stats["aborted"],
+        "rate_limited": server.stats["rate_limited"],
+        "server_errors": server.stats["server_errors"],
+        "cached_token_ratio": usage["cached_tokens"] / max(usage["prompt_tokens"], 1),
+        "prompt_tokens": usage["prompt_tokens"],
+        "batching_fallback_questions": usage["batching_fallback_questions"],
+        "programs_generated": usage["program_programs_generated"],
+        "early_stops": usage["early_stops"],
+        "http_requests": usage["connection_http_requests"],
+        "connections_opened": usage["connection_connections_opened"],
+        # ru_maxrss is in KiB on Linux; the children figure is the largest pool worker so far
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_worker_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+if __name__ == "__main__":
+    setup_types = [
+        "direct_prompting",
+        "direct_prompting_schema",
+        "code_generation",
+        "code_generation_schema",
+        "code_generation_schema_no_resp",
+        "code_generation_schema_compact_response",
+        "cot_direct_prompting_schema",
+        "cot_code_generation_schema",
+        "direct_prompting_schema_cfx2",
+        "code_generation_schema_cfx2",
+        "code_generation_question_last",
+        "code_generation_schema_question_last",
+        "direct_prompting_batched",
+        "code_generation_parameterized",
+    ]
+    task_lists = [
+        "real-time-product-search.p.rapidapi.com_search?",
+        "last10k-company-v1.p.rapidapi.com_v1_company_filings",
+    ]
+    model_name = "Azure/gpt-4o"
+    provider = "azure"  # "local" for the Ollama client
+    num_processes = 8
+    group_by_response = True
+    max_questions_per_task = 8
+    max_samples = 200  # per setup, 0 for all the QA pairs of task_lists
+    server = MockLLMServer(latency=0.05, latency_jitter=0.02, error_rate=0.01, rate_limit_rate=0.02, mode="canned")
+
+    data_dir = os.path.join(os.path.dirname(__file__), "../generate_qa_pairs/data/")
+    base_url = server.start()
+    # route get_lm to the mock server; the pool workers are forked after this and inherit it
+    os.environ["LLM_PROVIDER"] = provider
+    os.environ["AZURE_ENDPOINT"] = base_url
+    os.environ["AZURE_OPENAI_API_KEY"] = "mock"
+    os.environ["OLLAMA_HOST"] = base_url
+    utils.RETRY_SLEEP_SECONDS = 0
+
+    report = []
+    for setup_type in setup_types:
+        qa_samples = []
+        for task in task_lists:
+            qa_samples += load_qa_samples(task, simplify_json='cf' in setup_type, data_dir=data_dir)
+        if max_samples:
+            qa_samples = qa_samples[:max_samples]
+        result = benchmark_setup(server, qa_samples, setup_type, model_name, num_processes,
+                                 group_by_response, max_questions_per_task)
+        report.append(result)
+        print(f"{setup_type:42s} {result['samples']:5d} samples {result['samples_per_sec']:8.1f}/s "
+              f"p50 {result['p50_latency_ms']:7.1f} ms p95 {result['p95_latency_ms']:7.1f} ms "
+              f"retries {result['retries']:4d} cached {result['cached_token_ratio']:6.1%} peak RSS {result['peak_rss_mb']:.0f} MB "
+              f"(workers {result['peak_worker_rss_mb']:.0f} MB)")
+    server.stop()
+
+    output_path = os.path.join(os.path.dirname(__file__), "results/benchmarks/pipeline.json")
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
@@ -0,0 +1,53 @@
+import os
+import time
+
+from codegen_scripts import render_cache
+from codegen_scripts.general_code_generation import build_prompt
+from generate_qa_pairs.tasks.data_structures import LongResponseQASample
+from qa_inference import get_prompt, get_prompt_style, load_qa_samples
+
+
+def build_prompts(qa_samples: list[LongResponseQASample], setup_type: str) -> list[str]:
+    # same prompts as run_inference builds for the setup
+    if "code_generation" in setup_type:
+        prompt_style = get_prompt_style(setup_type)
+        return [build_prompt(sample.api_response, sample.question, prompt_style, "", sample.schema, sample.response_ref)
+                for sample in qa_samples]
+    return [get_prompt(qa_sample=sample, setup_type=setup_type) for sample in qa_samples]
+
+
+def time_prompt_build(qa_samples: list[LongResponseQASample], setup_type: str, cache_size: int) -> tuple[float, list[str]]:
+    render_cache.RENDER_CACHE_SIZE = cache_size
+    render_cache.clear_render_cache()
+    start = time.perf_counter()
+    prompts = build_prompts(qa_samples, setup_type)
+    return time.perf_counter() - start, prompts
+
+
+if __name__ == "__main__":
+    setup_types = [
+        "direct_prompting",
+        "direct_prompting_schema",
+        "code_generation",
+        "code_generation_schema",
+        "code_generation_schema_compact_response",
+        "cot_direct_prompting_schema",
+        "cot_code_generation_schema",
+    ]
+    task_lists = [
+        "real-time-product-search.p.rapidapi.com_search?",
+        "last10k-company-v1.p.rapidapi.com_v1_company_filings",
+    ]
+    data_dir = os.path.join(os.path.dirname(__file__), "../generate_qa_pairs/data/")
+    cache_size = 32
+
+    for task in task_lists:
+        qa_samples = load_qa_samples(task, simplify_json=False, data_dir=data_dir)
+        num_responses = len({sample.response_ref for sample in qa_samples})
+        print(f"{task}: {len(qa_samples)} questions about {num_responses} responses")
+        for setup_type in setup_types:
+            before, prompts_before = time_prompt_build(qa_samples, setup_type, cache_size=0)
+            after, prompts_after = time_prompt_build(qa_samples, setup_type, cache_size=cache_size)
+            assert prompts_before == prompts_after
+            print(f"    {setup_type:42s} {before * 1000:9.1f} ms -> {after * 1000:8.1f} ms "
+                  f"({before / after:5.1f}x, {render_cache.render_cache_stats['hits']} cache hits)")
@@ -0,0 +1,106 @@
+import contextlib
+import io
+import json
+import math
+import os
+import time
+from typing import Any, Type
+
+from generate_qa_pairs.synthetic_responses import ENDPOINTS, SyntheticResponseGenerator, load_template
+from generate_qa_pairs.tasks import base
+
+
+def benchmark_task(task_cls: Type[base.Task], api_response: Any, repeat: int) -> dict[str, Any]:
+    """
+    Best of repeat runs of get_qa_samples on one response, with the time spent in the get_answer
+    calls it makes (timed by wrapping the bound method of the task instance).
+    Runs longer than a second are not repeated.
+    """
+    best: dict[str, Any] = {}
+    for _ in range(repeat):
+        task = task_cls()
+        get_answer = task.get_answer
+        answer_stats = {"calls": 0, "seconds": 0.0}
+
+        def timed_get_answer(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return get_answer(*args, **kwargs)
+            finally:
+                answer_stats["seconds"] += time.perf_counter() - start
+                answer_stats["calls"] += 1
+
+        task.get_answer = timed_get_answer
+        start = time.perf_counter()
+        try:
+            # the generators print their samples, keep the report readable
+            with contextlib.redirect_stdout(io.StringIO()):
+                qa_samples = task.get_qa_samples(api_response)
+            error = None
+        except Exception as e:
+            qa_samples, error = [], f"{type(e).__name__}: {e}"
+        seconds = time.perf_counter() - start
+        if not best or seconds < best["get_qa_samples_ms"] / 1000:
+            best = {
+                "get_qa_samples_ms": seconds * 1000,
+                "get_answer_ms": answer_stats["seconds"] * 1000,
+                "get_answer_calls": answer_stats["calls"],
+                "qa_samples": len(qa_samples),
+                "error": error,
+            }
+        if seconds > 1:
+            break
+    return best
+
+
+if __name__ == "__main__":
+    api_responses_dir = os.path.join(os.path.dirname(__file__), "../generate_qa_pairs/data/api_responses")
+    scales = [1, 10, 100]
+    repeat = 3
+    seed = 1
+    # a task slower than this at some scale is not run at the larger ones (quadratic generators)
+    time_budget_ms = 5_000
+
+    report = []
+    over_budget = set()
+    for task_list_cls, (app, endpoint) in ENDPOINTS.items():
+        # the real response of the endpoint (if present) is the template of the synthetic ones
+        api_response_fpath = os.path.join(api_responses_dir, f"{app}_{endpoint}.json")
+        template = load_template(api_response_fpath)
+        for scale in scales:
+            api_response = SyntheticResponseGenerator(task_list_cls.response_json_schema, seed=seed, scale=scale,
+                                                      template=template).generate()
+            response_bytes = len(json.dumps(api_response))
+            # the response file is only read lazily, so the task list can be built even if it is missing
+            for task_cls in task_list_cls(api_response_fpath).task_list:
+                if (task_list_cls.__name__, task_cls.__name__) in over_budget:
+                    continue
+                result = benchmark_task(task_cls, api_response, repeat)
+                if result["get_qa_samples_ms"] > time_budget_ms:
+                    over_budget.add((task_list_cls.__name__, task_cls.__name__))
+                result.update({"task_list": task_list_cls.__name__, "task": task_cls.__name__, "scale": scale,
+                               "response_bytes": response_bytes})
+                report.append(result)
+
+    # growth exponent between the two largest scales: ~1 for linear generators, ~2 for quadratic ones
+    by_task = {}
+    for result in report:
+        by_task.setdefault((result["task_list"], result["task"]), {})[result["scale"]] = result
+    print(f"{'task':60s} " + " ".join(f"{f'{scale}x ms':>10s}" for scale in scales) + "   growth  get_answer calls")
+    for (task_list_name, task_name), results in by_task.items():
+        run_scales = [scale for scale in scales if scale in results]
+        times = [results[scale]["get_qa_samples_ms"] for scale in run_scales]
+        growth = (math.log(max(times[-1], 1e-3) / max(times[-2], 1e-3)) / math.log(run_scales[-1] / run_scales[-2])
+                  if len(times) > 1 else float("nan"))
+        errors = {results[scale]["error"] for scale in run_scales} - {None}
+        print(f"{task_list_name + '.' + task_name:60s} "
+              + " ".join(f"{results[scale]['get_qa_samples_ms']:10.2f}" if scale in results else f"{'skipped':>10s}"
+                         for scale in scales)
+              + f"   {growth:6.2f}  {results[run_scales[-1]]['get_answer_calls']:>8d}"
+              + (f"  ERROR {errors.pop()}" if errors else ""))
+
+    # one line per run, so that timings can be tracked over time
+    output_path = os.path.join(os.path.dirname(__file__), "results/benchmarks/tasks.jsonl")
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "a") as f:
+        f.write(json.dumps({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "seed": seed, "results": report}) + "\n")
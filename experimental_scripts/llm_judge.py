@@ -0,0 +1,84 @@
+import asyncio
+import hashlib
+import json
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from generate_qa_pairs.tasks import evals
+from generate_qa_pairs.tasks.data_structures import LongResponseQASample
+
+
+def get_eval_prompt_template() -> str:
+    try:
+        from codegen_scripts.general_code_generation import EVAL_PROMPT_TEMPLATE
+    except ImportError as e:
+        raise ImportError("llm_as_a_judge needs the judge prompt EVAL_PROMPT_TEMPLATE (with {gold_answer} and "
+                          "{predicted_answer} fields) in codegen_scripts/general_code_generation.py, which does "
+                          "not define it; add the prompt or run the evaluation with wLLM = False") from e
+    return EVAL_PROMPT_TEMPLATE
+
+
+class JudgeService:
+    """
+    LLM-as-a-judge shared by the whole evaluation grid.
+    Every (gold_answer, pred_answer) pair, up to case and whitespace, is judged at most once: concurrent
+    requests for the same pair wait for the call in flight, and verdicts are cached in an append-only
+    JSONL file across runs, keyed by the judge prompt as well.
+    """
+
+    def __init__(self, judge_llm: Any, judge_model_name: str, cache_path: str, max_concurrency: int = 50) -> None:
+        self.judge_llm = judge_llm
+        self.judge_model_name = judge_model_name
+        self.cache_path = cache_path
+        self.stats: Counter = Counter()
+        self.prompt_hash = hashlib.sha1(get_eval_prompt_template().encode("utf-8")).hexdigest()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._in_flight: dict[str, asyncio.Future] = {}
+        self._verdicts: dict[str, bool] = {}
+        if os.path.exists(cache_path):
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # interrupted write
+                    self._verdicts[entry["key"]] = entry["verdict"]
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        self._cache_file = open(cache_path, 'a', encoding='utf-8')
+
+    def pair_key(self, gold_answer: Any, pred_answer: Any) -> str:
+        # only case and whitespace are normalized, any other difference may change the verdict; the
+        # prefix keeps the entries cached with the earlier normalize_text keys from matching, and the
+        # prompt hash the verdicts of another judge prompt
+        answers = [" ".join(str(answer).split()).casefold() for answer in (gold_answer, pred_answer)]
+        normalized = "\x00".join(["v2", self.prompt_hash] + answers)
+        return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+    async def judge(self, sample: LongResponseQASample) -> bool:
+        key = self.pair_key(sample.gold_answer, sample.pred_answer)
+        if key in self._verdicts:
+            self.stats["cached"] += 1
+            return self._verdicts[key]
+        if key in self._in_flight:
+            self.stats["deduplicated"] += 1
+            return await self._in_flight[key]
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, evals.llm_as_a_judge, sample, self.judge_llm,
+                                      self.judge_model_name)
+        self._in_flight[key] = future
+        try:
+            verdict = await future
+        finally:
+            del self._in_flight[key]
+        self.stats["judged"] += 1
+        self._verdicts[key] = verdict
+        self._cache_file.write(json.dumps({"key": key, "verdict": verdict}) + "\n")
+        self._cache_file.flush()
+        return verdict
+
+    def close(self) -> None:
+        self._executor.shutdown()
+        self._cache_file.close()
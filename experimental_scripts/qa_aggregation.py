@@ -1,89 +1,83 @@
 import json
 import os
+import time
+
 import pandas as pd
 
+METRICS = ['exact_match', 'contains', 'llm_as_a_judge', 'code_exec_status']
+SAMPLE_COLUMNS = ['model', 'setup_type', 'task', 'task_name', 'task_type', 'context_exceeded'] + METRICS
+
 
-def aggregate_metric(criterion: str, data: list[dict]) -> dict:
-    agg_metric = {
-        f'exact_match_accuracy_{criterion}': 0,
-        f'contains_accuracy_{criterion}': 0,
-        f'llm_as_a_judge_accuracy_{criterion}': 0,
-        f'code_exec_status_passed_{criterion}': 0
-    }
-    sample_count = 0
+def flatten_eval_records(data: list[dict], model_name: str, setup_type: str, task: str) -> list[tuple]:
+    """
+    Flatten the records of one evaluation file into SAMPLE_COLUMNS rows, one boolean per metric.
+    Records with neither a predicted answer nor a model output are dropped.
+    """
+    rows = []
     for item in data:
-        if 'task' in item:
-            if item['task_type'] == criterion or item['task'] == criterion:
-                sample_count += 1
-
-                if item['metrics']['exact_match'] == True:
-                    agg_metric[f'exact_match_accuracy_{criterion}'] += 1
-
-                if item['metrics']['contains'] == True or item['metrics']['exact_match'] == True:
-                    agg_metric[f'contains_accuracy_{criterion}'] += 1
-
-                if item['metrics']['llm_as_a_judge'] == True:
-                    agg_metric[f'llm_as_a_judge_accuracy_{criterion}'] += 1
-
-                if item['code_exec_status'] != "Code execution error":
-                    agg_metric[f'code_exec_status_passed_{criterion}'] += 1
-
-    agg_metric['criterion'] = criterion
-    agg_metric[f'total_samples_{criterion}'] = sample_count
-    return agg_metric
-
-
-def aggregate_endpoint(criteria: list[str], data: list[dict]) -> dict:
-    records = {}
-
-    count_context_exceeded = [1 if result['predicted_answer'] == "context length exceeded" else 0 for result in data]
-
-    records.update({
-        "task": task,
-        "model": model_name,
-        "setup_type": setup_type,
-        "count_context_exceeded": sum(count_context_exceeded),
-        "total_samples": 0,
-        "total_exact_match": 0,
-        "avg_exact_match": 0,
-        "total_contains": 0,
-        "avg_contains": 0,
-        "total_llm_as_a_judge": 0,
-        "avg_llm_as_a_judge": 0,
-    })
-    for criterion in criteria:
-        aggregate_records = aggregate_metric(criterion, data)
-        records['total_samples'] += aggregate_records[f'total_samples_{aggregate_records["criterion"]}']
-        records['total_exact_match'] += aggregate_records[f'exact_match_accuracy_{aggregate_records["criterion"]}']
-        records['total_contains'] += aggregate_records[f'contains_accuracy_{aggregate_records["criterion"]}']
-        records['total_llm_as_a_judge'] += aggregate_records[
-            f'llm_as_a_judge_accuracy_{aggregate_records["criterion"]}']
-        records.update(
-            {
-                f"{aggregate_records['criterion']}_total_samples": aggregate_records[
-                    f'total_samples_{aggregate_records["criterion"]}'],
-                f"total_{aggregate_records['criterion']}_exact_match_accuracy": aggregate_records[
-                    f'exact_match_accuracy_{aggregate_records["criterion"]}'],
-                f"avg_{aggregate_records['criterion']}_exact_match_accuracy": aggregate_records[
-                    f'exact_match_accuracy_{aggregate_records["criterion"]}'] / aggregate_records[f'total_samples_{aggregate_records["criterion"]}'],
-                f"total_{aggregate_records['criterion']}_contains_accuracy": aggregate_records[
-                    f'contains_accuracy_{aggregate_records["criterion"]}'],
-                f"avg_{aggregate_records['criterion']}_contains_accuracy": aggregate_records[
-                    f'contains_accuracy_{aggregate_records["criterion"]}'] / aggregate_records[f'total_samples_{aggregate_records["criterion"]}'],
-                f"total_{aggregate_records['criterion']}_llm_as_a_judge_accuracy": aggregate_records[
-                    f'llm_as_a_judge_accuracy_{aggregate_records["criterion"]}'],
-                f"avg_{aggregate_records['criterion']}_llm_as_a_judge_accuracy": aggregate_records[
-                    f'llm_as_a_judge_accuracy_{aggregate_records["criterion"]}'] / aggregate_records[f'total_samples_{aggregate_records["criterion"]}'],
-                f"total_{aggregate_records['criterion']}_code_exec_status_accuracy": aggregate_records[
-                    f'code_exec_status_passed_{aggregate_records["criterion"]}'],
-                f"avg_{aggregate_records['criterion']}_code_exec_status_accuracy": aggregate_records[
-                    f'code_exec_status_passed_{aggregate_records["criterion"]}'] / aggregate_records[f'total_samples_{aggregate_records["criterion"]}']
-            }
-        )
-    records['avg_exact_match'] = records['total_exact_match'] / records['total_samples']
-    records['avg_contains'] = records['total_contains'] / records['total_samples']
-    records['avg_llm_as_a_judge'] = records['total_llm_as_a_judge'] / records['total_samples']
-    return records
+        if item['predicted_answer'] is None and item['model_output'] is None:
+            continue
+        exact_match = item['metrics']['exact_match'] == True
+        rows.append((
+            model_name,
+            setup_type,
+            task,
+            item.get('task'),
+            item.get('task_type'),
+            item['predicted_answer'] == "context length exceeded",
+            exact_match,
+            item['metrics']['contains'] == True or exact_match,
+            item['metrics'].get('llm_as_a_judge') == True,
+            item['code_exec_status'] != "Code execution error",
+        ))
+    return rows
+
+
+def aggregate_endpoints(df: pd.DataFrame, task_types: list[str]) -> pd.DataFrame:
+    """
+    Per (model, setup, endpoint) totals and averages, overall and per task type, in one groupby.
+    """
+    keys = ['model', 'setup_type', 'task']
+    if df.empty:
+        # no evaluation file yet: the columns of the report without rows
+        columns = ['count_context_exceeded', 'total_samples'] + [
+            f'{kind}_{metric}' for metric in METRICS[:3] for kind in ('total', 'avg')]
+        for task_type in task_types:
+            columns += [f'{task_type}_total_samples'] + [
+                f'{kind}_{task_type}_{metric}_accuracy' for metric in METRICS for kind in ('total', 'avg')]
+        return pd.DataFrame(columns=['task', 'model', 'setup_type'] + columns)
+    by_task_type = df[df['task_type'].isin(task_types)].groupby(keys + ['task_type'], observed=True)
+    sums = by_task_type[METRICS].sum().unstack('task_type', fill_value=0)
+    sizes = by_task_type.size().unstack('task_type', fill_value=0).reindex(columns=task_types, fill_value=0)
+
+    records = df.groupby(keys, observed=True)['context_exceeded'].sum().rename('count_context_exceeded').to_frame()
+    records['total_samples'] = sizes.sum(axis=1)
+    for metric in METRICS[:3]:
+        records[f'total_{metric}'] = sums[metric].sum(axis=1)
+        records[f'avg_{metric}'] = records[f'total_{metric}'] / records['total_samples']
+    for task_type in task_types:
+        records[f'{task_type}_total_samples'] = sizes[task_type]
+        for metric in METRICS:
+            total = sums[metric][task_type] if task_type in sums[metric] else 0
+            records[f'total_{task_type}_{metric}_accuracy'] = total
+            records[f'avg_{task_type}_{metric}_accuracy'] = total / sizes[task_type]
+    records = records.fillna({column: 0 for column in records.columns if column.startswith('total')})
+    return records.reset_index()[['task', 'model', 'setup_type'] + list(records.columns)]
+
+
+def aggregate_model_setups(per_endpoint: pd.DataFrame, task_types: list[str]) -> pd.DataFrame:
+    """
+    Per (model, setup) totals and averages summed over the endpoints.
+    """
+    total_columns = ['total_samples'] + [f'{task_type}_total_samples' for task_type in task_types] + [
+        f'total_{task_type}_{metric}_accuracy' for task_type in task_types for metric in METRICS]
+    records = per_endpoint.groupby(['model', 'setup_type'], observed=True, sort=False)[total_columns].sum()
+    for metric in METRICS:
+        records[f'total_{metric}_accuracy'] = records[[f'total_{task_type}_{metric}_accuracy' for task_type in task_types]].sum(axis=1)
+        records[f'avg_{metric}_accuracy'] = records[f'total_{metric}_accuracy'] / records['total_samples']
+        for task_type in task_types:
+            records[f'avg_{task_type}_{metric}_accuracy'] = records[f'total_{task_type}_{metric}_accuracy'] / records[f'{task_type}_total_samples']
+    return records.reset_index()
 
 
 if __name__ == "__main__":
@@ -102,6 +96,10 @@ if __name__ == "__main__":
         "cot_code_generation_schema",
         "direct_prompting_schema_cfx2",
         "code_generation_schema_cfx2",
+        "direct_prompting_batched",
+        "code_generation_parameterized",
+        "code_generation_question_last",
+        "code_generation_schema_question_last",
     ]
 
     task_lists = [  # sorted by size
@@ -130,74 +128,54 @@ if __name__ == "__main__":
         "claude-4-sonnet",
     ]
 
-    all_results_per_endpoint = []
-    all_results_per_model_setup = []
+    # "json" reads the per-cell *_eval.json files, "columnar" reads the Parquet results store
+    results_format = "json"
+    if results_format == "columnar":
+        from results_store import ResultStore, cell_filter
+        result_store = ResultStore(results_base_dir + "store")
+
     task_types = ['EXTRACTIVE', 'FILTERING', 'AGGREGATION']
-    metrics = ['exact_match', 'contains', 'llm_as_a_judge', 'code_exec_status']
 
+    start_time = time.perf_counter()
+    rows = []
+    file_count = 0
     for model_name in models:
         for setup_type in setup_types:
-            tmp_results_per_task = []
             for task in task_lists:
                 file_name = f"{task}_{model_name}_{setup_type}_eval.json"
                 json_path = os.path.join(results_base_dir_evals, file_name)
                 try:
-                    with open(json_path, 'r') as file:
-                        data = json.load(file)
-                    none_count = 0
-                    for i in range(len(data) -1, -1, -1):
-                        if data[i]['predicted_answer'] is None and data[i]['model_output'] is None:
-                            data.pop(i)
-                            none_count += 1
+                    if results_format == "columnar":
+                        data = result_store.read_records("evaluations", filter=cell_filter(
+                            endpoint=task, model_short_name=model_name, setup_type=setup_type))
+                        if not data:
+                            raise FileNotFoundError(file_name)
+                    else:
+                        with open(json_path, 'r') as file:
+                            data = json.load(file)
                 except BaseException as e:
                     print(e)
                     print("FAILED:" + file_name)
                     continue
-
-                criteria = task_types
-                records = aggregate_endpoint(criteria, data)
-                tmp_results_per_task.append(records)
-                all_results_per_endpoint.append(records)
-            grouped_records = {}
-            grouped_records.update({
-                "model": model_name,
-                "setup_type": setup_type,
-                "total_samples": 0,
-            })
-            for metric in metrics:
-                grouped_records.update({
-                    f'total_{metric}_accuracy': 0,
-                    f'avg_{metric}_accuracy': 0
-                })
-            for task_type in task_types:
-                grouped_records.update({
-                    f'{task_type}_total_samples': 0
-                })
-                for metric in metrics:
-                    grouped_records.update({
-                        f'total_{task_type}_{metric}_accuracy': 0
-                    })
-            for row in tmp_results_per_task:
-                for task_type in task_types:
-                    grouped_records['total_samples'] += row[f'{task_type}_total_samples']
-                    grouped_records[f'{task_type}_total_samples'] += row[f'{task_type}_total_samples']
-                for metric in metrics:
-                    for task_type in task_types:
-                        grouped_records[f'total_{metric}_accuracy'] += row[f'total_{task_type}_{metric}_accuracy']
-                        grouped_records[f'total_{task_type}_{metric}_accuracy'] += row[f'total_{task_type}_{metric}_accuracy']
-                        grouped_records.update({
-                            f'avg_{task_type}_{metric}_accuracy': grouped_records[
-                                                                      f'total_{task_type}_{metric}_accuracy'] /
-                                                                  grouped_records[f'{task_type}_total_samples']
-                        })
-
-                    grouped_records[f'avg_{metric}_accuracy'] = grouped_records[f'total_{metric}_accuracy'] / grouped_records['total_samples']
-
-
-            all_results_per_model_setup.append(grouped_records)
-    df1 = pd.DataFrame.from_records(all_results_per_endpoint)
-    df2 = pd.DataFrame.from_records(all_results_per_model_setup)
-    with pd.ExcelWriter(os.path.join(os.path.dirname(__file__),
-                                     "results/metric_aggregation/all_results.xlsx"), engine='openpyxl') as writer:
+                rows.extend(flatten_eval_records(data, model_name, setup_type, task))
+                file_count += 1
+    # one typed table for the whole grid, string columns as categoricals in grid order
+    df = pd.DataFrame.from_records(rows, columns=SAMPLE_COLUMNS)
+    for column in ['model', 'setup_type', 'task', 'task_name', 'task_type']:
+        df[column] = pd.Categorical(df[column], categories=list(dict.fromkeys(df[column])))
+    load_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    df1 = aggregate_endpoints(df, task_types)
+    df2 = aggregate_model_setups(df1, task_types)
+    aggregation_time = time.perf_counter() - start_time
+    print(f"Aggregated {len(df)} samples from {file_count} files: "
+          f"loading {load_time:.2f}s, aggregation {aggregation_time:.2f}s")
+
+    output_dir = os.path.join(os.path.dirname(__file__), "results/metric_aggregation")
+    with pd.ExcelWriter(os.path.join(output_dir, "all_results.xlsx"), engine='openpyxl') as writer:
         df1.to_excel(writer, sheet_name='per_endpoint', index=False)
         df2.to_excel(writer, sheet_name='per_model_setup', index=False)
+    df1.to_csv(os.path.join(output_dir, "all_results_per_endpoint.csv"), index=False)
+    df2.to_csv(os.path.join(output_dir, "all_results_per_model_setup.csv"), index=False)
+    df.to_parquet(os.path.join(output_dir, "all_samples.parquet"), index=False)
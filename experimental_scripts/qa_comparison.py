@@ -1,43 +1,95 @@
+import hashlib
+import itertools
 import os
 
 import pandas as pd
 import json
-import numpy as np
 
 
 results_base_dir = os.path.join(os.path.dirname(__file__), "./results/comparisons")
 results_base_dir_out = os.path.join(os.path.dirname(__file__), "./results/evaluation")
 
-def compare_across_setups(file_prefix: str, setup1: str, setup2: str, model: str, metric: str, task_type: str):
-    file_name_setup1 = f"{file_prefix}_{model}_{setup1}_eval.json"
-    file_name_setup2 = f"{file_prefix}_{model}_{setup2}_eval.json"
-    print(file_name_setup1, file_name_setup2)
-    file_path_1 = os.path.join(results_base_dir_out, file_name_setup1)
+_EVAL_RECORDS_CACHE: dict[tuple[str, str, str], list[dict]] = {}
 
-    file_path_2 = os.path.join(results_base_dir_out, file_name_setup2)
 
-    with open(file_path_1, 'r') as file1:
-        data1 = json.load(file1)
-    with open(file_path_2, 'r') as file2:
-        data2 = json.load(file2)
+def load_eval_records(file_prefix: str, setup: str, model: str, result_store=None) -> list[dict]:
+    # every evaluation file is read once, whatever the number of metrics and task types compared
+    cache_key = (file_prefix, setup, model)
+    if cache_key not in _EVAL_RECORDS_CACHE:
+        if result_store is not None:
+            from results_store import cell_filter
+            data = result_store.read_records("evaluations", filter=cell_filter(
+                endpoint=file_prefix, model_short_name=model, setup_type=setup))
+        else:
+            file_path = os.path.join(results_base_dir_out, f"{file_prefix}_{model}_{setup}_eval.json")
+            with open(file_path, 'r') as file:
+                data = json.load(file)
+        _EVAL_RECORDS_CACHE[cache_key] = data
+    return _EVAL_RECORDS_CACHE[cache_key]
 
-    count_TT, count_TF, count_FT, count_FF = 0, 0, 0, 0
-    for items1 in data1:
-        for items2 in data2:
-            if items1['question'] == items2['question'] and items1['task_type'] == task_type and items2['task_type'] == task_type:
-                if items1["metrics"][metric] == True and items2["metrics"][metric] == True:
-                    count_TT += 1
-                elif items1["metrics"][metric] == True and items2["metrics"][metric] == False:
-                    count_TF += 1
-                elif items1["metrics"][metric] == False and items2["metrics"][metric] == True:
-                    count_FT += 1
-                elif items1["metrics"][metric] == False and items2["metrics"][metric] == False:
-                    count_FF += 1
 
-                break
+def index_eval_records(data: list[dict], metrics: list[str], key_by: str) -> pd.DataFrame:
+    """
+    Index evaluation records by uid (or by question hash when uids are missing), with one
+    column per metric holding "T", "F" or NaN when the metric was not computed
+    """
+    rows = []
+    for item in data:
+        if key_by == "uid":
+            key = item["uid"]
+        else:
+            key = hashlib.sha1(item["question"].encode("utf-8")).hexdigest()
+        row = {"key": key, "task_type": item["task_type"]}
+        for metric in metrics:
+            value = item["metrics"].get(metric)
+            row[metric] = "T" if value == True else "F" if value == False else None
+        rows.append(row)
+    df = pd.DataFrame.from_records(rows, columns=["key", "task_type"] + metrics)
+    return df.drop_duplicates("key").set_index("key")
 
-    return count_TT, count_TF, count_FT, count_FF
 
+def compare_setups(file_prefix: str, setups: list[str], model: str, metrics: list[str],
+                   task_types: list[str], result_store=None) -> pd.DataFrame:
+    """
+    N-way comparison of the given setups on one endpoint.
+    Returns one row per (metric, task type) with a count_<pattern> column for every T/F outcome
+    pattern across the setups, e.g. count_TF = correct with setups[0] and wrong with setups[1].
+    """
+    data = [load_eval_records(file_prefix, setup, model, result_store) for setup in setups]
+    key_by = "uid" if all("uid" in item for records in data for item in records) else "question"
+    indexed = [index_eval_records(records, metrics, key_by) for records in data]
+
+    joined = indexed[0]
+    for i, df in enumerate(indexed[1:], start=1):
+        joined = joined.join(df, how="inner", rsuffix=f"_{i}")
+    joined = joined[joined["task_type"].isin(task_types)]
+
+    patterns = ["".join(pattern) for pattern in itertools.product("TF", repeat=len(setups))]
+    rows = []
+    for metric in metrics:
+        metric_columns = [metric] + [f"{metric}_{i}" for i in range(1, len(setups))]
+        outcomes = joined[metric_columns].dropna()
+        if outcomes.empty:
+            # no common sample, or the metric was not computed (e.g. llm_as_a_judge of woLLM evaluations)
+            counts = pd.Series(dtype=int)
+        else:
+            counts = (
+                pd.DataFrame({"task_type": joined.loc[outcomes.index, "task_type"],
+                              "pattern": outcomes.agg("".join, axis=1)})
+                .groupby(["task_type", "pattern"]).size()
+            )
+        for task_type in task_types:
+            row = {"metric": metric, "task_type": task_type}
+            for pattern in patterns:
+                row[f"count_{pattern}"] = int(counts.get((task_type, pattern), 0))
+            rows.append(row)
+    return pd.DataFrame.from_records(rows)
+
+
+def compare_across_setups(file_prefix: str, setup1: str, setup2: str, model: str, metric: str, task_type: str,
+                          result_store=None):
+    counts = compare_setups(file_prefix, [setup1, setup2], model, [metric], [task_type], result_store).iloc[0]
+    return counts["count_TT"], counts["count_TF"], counts["count_FT"], counts["count_FF"]
 
 
 if __name__ == "__main__":
@@ -53,6 +105,7 @@ if __name__ == "__main__":
         # ["direct_prompting", "code_generation"],
         # ["cot_direct_prompting_schema", "cot_code_generation_schema"],
         ["direct_prompting_schema", "code_generation_schema"],
+        # setup groups can have any length, e.g. ["direct_prompting", "direct_prompting_schema", "code_generation_schema"]
         # ["direct_prompting_schema_cf", "code_generation_schema_cf"]
     ]
     models = [
@@ -76,27 +129,28 @@ if __name__ == "__main__":
         "FILTERING"
     ]
     results_records = []
+    # "json" reads the per-cell *_eval.json files, "columnar" reads the Parquet results store
+    results_format = "json"
+    result_store = None
+    if results_format == "columnar":
+        from results_store import ResultStore
+        result_store = ResultStore(os.path.join(os.path.dirname(__file__), "results/store"))
 
     for model in models:
         for setup_type in setup_types:
-            for metric in metrics:
-                for task_type in task_types:
-                    flow_values = [0, 0, 0, 0]
-                    for api_endpoint in api_endpoints:
-                        counts = compare_across_setups(api_endpoint, setup_type[0], setup_type[1], model, metric, task_type)
-                        flow_values = np.array(counts) + np.array(flow_values)
-                        results_records.append({
-                            "Endpoint": api_endpoint,
-                            "model_name": model,
-                            "metric": metric,
-                            "Task type": task_type,
-                            "Setup_1": setup_type[0],
-                            "Setup_2": setup_type[1],
-                            "count_TT": counts[0],
-                            "count_TF": counts[1],
-                            "count_FT": counts[2],
-                            "count_FF": counts[3]
-                        })
+            for api_endpoint in api_endpoints:
+                counts = compare_setups(api_endpoint, setup_type, model, metrics, task_types,
+                                        result_store=result_store)
+                for row in counts.to_dict("records"):
+                    record = {
+                        "Endpoint": api_endpoint,
+                        "model_name": model,
+                        "metric": row.pop("metric"),
+                        "Task type": row.pop("task_type"),
+                    }
+                    record.update({f"Setup_{i + 1}": setup for i, setup in enumerate(setup_type)})
+                    record.update(row)
+                    results_records.append(record)
     df = pd.DataFrame.from_records(results_records)
     df.to_csv(
         os.path.join(os.path.dirname(__file__), f"results/comparisons/comparisons_results_compilation.csv"),
@@ -1,10 +1,17 @@
 import os
 import json
-from multiprocessing import Pool
+import asyncio
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any
+
+from tqdm import tqdm
 
 from generate_qa_pairs.tasks import evals
-from generate_qa_pairs.tasks.data_structures import LongResponseQASample
-from generate_qa_pairs.tasks.utils import convert_dict_to_list_of_objects, get_lm
+from generate_qa_pairs.tasks.data_structures import LongResponseQASample, QABatch
+from generate_qa_pairs.tasks.tracing import enable_tracing, export_trace, flush_spans, span, trace_context
+from generate_qa_pairs.tasks.utils import get_lm
+from llm_judge import JudgeService
 
 try:
     from dotenv import load_dotenv
@@ -13,36 +20,244 @@ try:
 except ImportError:
     pass
 
-def calculate_exact_match(task: LongResponseQASample,normalize: bool = True,rounding: bool = True,deduplicate: bool = True) -> bool :
-    if 'accuracy_string' in task.metrics:
-        return evals.accuracy_string(task, normalize)
-    elif 'approx_number_match' in task.metrics:
-        return evals.approx_number_match(task, rounding)
-    elif 'unordered_list_str_match' in task.metrics:
-        return evals.unordered_list_str_match(task, normalize, deduplicate)
+LLM_AS_A_JUDGE_PARAMETERS = {
+    "max_new_tokens": 1000,
+    "min_new_tokens": 1,
+    "top_p": 0.1,
+    "temperature": 0.0,
+    "random_seed": 1,
+    "decoding_method": "greedy",
+    "stop_sequences": [],
+}
+
+# Metrics decided by an earlier, cheaper one: metric -> (deciding metric, value taken when the deciding metric is True).
+# An exact match is neither a hallucination nor needs the judge; set "metric_cascade" to {} in the config to
+# compute every metric of every sample.
+METRIC_CASCADE = {
+    "hallucination": ("exact_match", False),
+    "llm_as_a_judge": ("exact_match", True),
+}
+
+
+def calculate_exact_match_batch(tasks: list[LongResponseQASample]) -> list:
+    """
+    Exact match of every sample with the metric named in its exact_match_metric, one batch
+    evaluation per metric. Samples whose metric is not registered get None.
+    """
+    indices_per_metric = defaultdict(list)
+    for i, task in enumerate(tasks):
+        indices_per_metric[task.metrics].append(i)
+    results = [None] * len(tasks)
+    for metric_name, indices in indices_per_metric.items():
+        if metric_name not in evals.METRIC_REGISTRY:
+            continue
+        values = evals.get_metric(metric_name).evaluate_batch([tasks[i] for i in indices])
+        for i, value in zip(indices, values):
+            results[i] = bool(value)
+    return results
+
+
+def cascade_value(metrics: dict[str, Any], metric: str, cascade: dict[str, tuple[str, bool]]) -> bool | None:
+    """
+    Value of metric implied by the already computed metrics of a sample, None when it has to be computed
+    """
+    if metric in cascade:
+        deciding_metric, value = cascade[metric]
+        if metrics.get(deciding_metric) is True:
+            return value
+    return None
+
+
+def get_output_path(cell: tuple[str, str, str], config: dict[str, Any]) -> str:
+    model_name, setup_type, task = cell
+    suffix = "eval.json" if config["wLLM"] else "eval_woLLM.json"
+    return config["results_base_dir"] + "evaluation/" + f"{task}_{model_name.split('/')[1]}_{setup_type}_" + suffix
+
+
+def get_result_store(config: dict[str, Any]):
+    from results_store import ResultStore
+    return ResultStore(config["results_base_dir"] + "store")
+
+
+def get_cell_filter(cell: tuple[str, str, str]):
+    from results_store import cell_filter
+    model_name, setup_type, task = cell
+    return cell_filter(endpoint=task, model=model_name, setup_type=setup_type)
+
+
+def is_cell_pending(cell: tuple[str, str, str], config: dict[str, Any], result_store=None) -> bool:
+    if config["results_format"] == "columnar":
+        return result_store.read_table("evaluations", columns=["uid"], filter=get_cell_filter(cell)).num_rows == 0
+    return not os.path.exists(get_output_path(cell, config))
+
+
+def write_cell_output(cell: tuple[str, str, str], records: list[dict], config: dict[str, Any]) -> None:
+    # the evaluation file only appears once fully written, so an interrupted run never leaves a partial file
+    if config["results_format"] == "columnar":
+        get_result_store(config).append("evaluations", records)
     else:
-        return None
+        output_path = get_output_path(cell, config)
+        with open(output_path + ".tmp", 'w') as f:
+            json.dump(records, f, indent=2)
+        os.replace(output_path + ".tmp", output_path)
+
+
+def evaluate_cell(cell: tuple[str, str, str], config: dict[str, Any]) -> tuple[tuple[str, str, str], list[dict] | None, Counter]:
+    """
+    Compute the string and hallucination metrics of one (model, setup, endpoint) predictions file,
+    counting per metric how many values were computed and how many derived through the cascade.
+    Runs in a pool process; the records are written here unless they still need the LLM judge.
+    """
+    model_name, setup_type, task = cell
+    with trace_context(model=model_name, setup=setup_type, endpoint=task), span("cell"):
+        result = _evaluate_cell(cell, config)
+    flush_spans()
+    return result
+
+
+def _evaluate_cell(cell: tuple[str, str, str], config: dict[str, Any]) -> tuple[tuple[str, str, str], list[dict] | None, Counter]:
+    counters = Counter()
+    model_name, setup_type, task = cell
+    filename = task + "_" + model_name.split('/')[1] + "_" + setup_type + "_predictions.json"
+    try:
+        with span("load_predictions"):
+            if config["results_format"] == "columnar":
+                qa_samples_pred_dict = get_result_store(config).read_records(
+                    "predictions", filter=get_cell_filter(cell), resolve_refs=True)
+                if not qa_samples_pred_dict:
+                    raise FileNotFoundError(filename)
+            else:
+                with open(os.path.join(config["results_base_dir"] + "predictions", filename), 'r') as f:
+                    qa_samples_pred_dict = json.load(f)
+
+            # prediction files written with results_format = "json_ref" are resolved from the blob directory
+            qa_samples_obj = QABatch.from_records(qa_samples_pred_dict, blob_dir=config["results_base_dir"] + "responses")
+    except BaseException:
+        print("FAILED: " + filename)
+        return cell, None, counters
+
+    exact_match = calculate_exact_match_batch(qa_samples_obj)
+    contains = evals.get_metric("contains").evaluate_batch(qa_samples_obj)
+    counters["exact_match_computed"] += len(qa_samples_obj)
+    counters["contains_computed"] += len(qa_samples_obj)
+    for i in range(0, len(qa_samples_pred_dict)):
+        metrics = qa_samples_pred_dict[i]["metrics"]
+        metrics["exact_match"] = exact_match[i]
+        metrics["contains"] = bool(contains[i])
+        if config["hallucination_test"] and ('direct_prompting' in filename or 'code_generation' in filename):
+            hallucination = cascade_value(metrics, "hallucination", config["metric_cascade"])
+            if hallucination is not None:
+                counters["hallucination_derived"] += 1
+            elif 'direct_prompting' in filename:
+                with span("metric.hallucination"):
+                    hallucination = evals.check_direct_prompt_hallucination(qa_samples_obj[i])
+                counters["hallucination_computed"] += 1
+            else:
+                with span("metric.hallucination"):
+                    hallucination = evals.check_hallucinated_keys(qa_samples_obj[i]) or evals.check_codegen_hallucination(qa_samples_obj[i])
+                counters["hallucination_computed"] += 1
+            metrics["hallucination"] = hallucination
 
-def evaluate_sample(args):
-    i, sample, llm_as_a_judge_model = args
-    get_llm_as_a_judge = get_lm(llm_as_a_judge_model, parameters={
-        "max_new_tokens": 1000,
-        "min_new_tokens": 1,
-        "top_p": 0.1,
-        "temperature": 0.0,
-        "random_seed": 1,
-        "decoding_method": "greedy",
-        "stop_sequences": [],
-    })
-    result = evals.llm_as_a_judge(sample, get_llm_as_a_judge, llm_as_a_judge_model)
-    return i, result
+    if config["wLLM"]:
+        return cell, qa_samples_pred_dict, counters
+    write_cell_output(cell, qa_samples_pred_dict, config)
+    return cell, [], counters
 
 
+async def evaluate_grid(cells: list[tuple[str, str, str]], config: dict[str, Any], num_processes: int,
+                        num_judge_workers: int) -> None:
+    """
+    Evaluate all pending cells: string metrics run in a process pool, and the LLM-judge calls of every
+    finished cell are funneled into one queue served by num_judge_workers concurrent workers
+    sharing a single JudgeService. A cell is written as soon as all its judge calls are done.
+    """
+    loop = asyncio.get_running_loop()
+    counters = Counter()
+    cell_executor = ProcessPoolExecutor(max_workers=num_processes) if num_processes > 0 else ThreadPoolExecutor(max_workers=1)
+    cell_progress = tqdm(total=len(cells), desc="cells", unit="file")
+
+    judge_queue: asyncio.Queue = asyncio.Queue()
+    pending_judgements: dict[tuple[str, str, str], int] = {}
+    judge_workers = []
+    if config["wLLM"]:
+        judge_llm = get_lm(config["llm_as_a_judge_model"], parameters=LLM_AS_A_JUDGE_PARAMETERS)
+        judge_service = JudgeService(
+            judge_llm, config["llm_as_a_judge_model"],
+            cache_path=config["results_base_dir"] + f"llm_as_a_judge_cache/{config['llm_as_a_judge_model'].split('/')[-1]}.jsonl",
+            max_concurrency=num_judge_workers,
+        )
+        judge_progress = tqdm(total=0, desc="llm_as_a_judge", unit="sample")
+
+        async def judge_worker() -> None:
+            while True:
+                cell, records, i, sample = await judge_queue.get()
+                try:
+                    with span("metric.llm_as_a_judge", model=cell[0], setup=cell[1], endpoint=cell[2]):
+                        records[i]["metrics"]["llm_as_a_judge"] = await judge_service.judge(sample)
+                except BaseException as e:
+                    print(f"llm_as_a_judge failed for {records[i]['uid']}: {e}")
+                    records[i]["metrics"]["llm_as_a_judge"] = None
+                try:
+                    judge_progress.update(1)
+                    pending_judgements[cell] -= 1
+                    if pending_judgements[cell] == 0:
+                        await loop.run_in_executor(None, write_cell_output, cell, records, config)
+                        cell_progress.update(1)
+                except Exception as e:
+                    print(f"FAILED to write {cell}: {e}")
+                finally:
+                    # always, or judge_queue.join() would wait forever
+                    judge_queue.task_done()
+
+        judge_workers = [asyncio.create_task(judge_worker()) for _ in range(num_judge_workers)]
+
+    with cell_executor:
+        futures = [loop.run_in_executor(cell_executor, evaluate_cell, cell, config) for cell in cells]
+        for future in asyncio.as_completed(futures):
+            cell, records, cell_counters = await future
+            counters.update(cell_counters)
+            if not records:
+                # failed to load, or already written by the pool process
+                cell_progress.update(1)
+                continue
+            to_judge = []
+            for i, record in enumerate(records):
+                llm_as_a_judge = cascade_value(record["metrics"], "llm_as_a_judge", config["metric_cascade"])
+                if llm_as_a_judge is None:
+                    to_judge.append(i)
+                else:
+                    record["metrics"]["llm_as_a_judge"] = llm_as_a_judge
+            counters["llm_as_a_judge_derived"] += len(records) - len(to_judge)
+            counters["llm_as_a_judge_computed"] += len(to_judge)
+            if not to_judge:
+                await loop.run_in_executor(None, write_cell_output, cell, records, config)
+                cell_progress.update(1)
+                continue
+            pending_judgements[cell] = len(to_judge)
+            judge_progress.total += len(to_judge)
+            judge_progress.refresh()
+            qa_samples_obj = QABatch.from_records([records[i] for i in to_judge],
+                                                  blob_dir=config["results_base_dir"] + "responses")
+            for i, sample in zip(to_judge, qa_samples_obj):
+                judge_queue.put_nowait((cell, records, i, sample))
+
+    if config["wLLM"]:
+        await judge_queue.join()
+        for worker in judge_workers:
+            worker.cancel()
+        judge_service.close()
+        judge_progress.close()
+        print(f"llm_as_a_judge: {dict(judge_service.stats)}")
+    cell_progress.close()
+    for metric in ("exact_match", "contains", "hallucination", "llm_as_a_judge"):
+        computed, derived = counters[metric + "_computed"], counters[metric + "_derived"]
+        if computed or derived:
+            print(f"{metric}: {computed} computed, {derived} derived ({derived / (computed + derived):.1%} skipped)")
+
 
 if __name__=="__main__":
     hallucination_test = True
     results_base_dir = os.path.join(os.path.dirname(__file__), "./results/")
-    results_base_dir_pred = results_base_dir + "predictions"
 
     setup_types = [
         "direct_prompting",
@@ -55,6 +270,10 @@ if __name__=="__main__":
         "cot_code_generation_schema",
         "direct_prompting_schema_cfx2",
         "code_generation_schema_cfx2",
+        "direct_prompting_batched",
+        "code_generation_parameterized",
+        "code_generation_question_last",
+        "code_generation_schema_question_last",
     ]
     task_lists = [  # sorted by size
         "booking-com15.p.rapidapi.com_Search_Hotels_By_Coordinates",
@@ -84,64 +303,36 @@ if __name__=="__main__":
         "meta-llama/llama-3-405b-instruct",
     ]
     wLLM = False
-    if wLLM:
-        llm_as_a_judge_model = "meta-llama/llama-3-3-70b-instruct"
-        get_llm_as_a_judge = get_lm(llm_as_a_judge_model, parameters={
-            "max_new_tokens": 1000,
-            "min_new_tokens": 1,
-            "top_p": 0.1,
-            "temperature": 0.0,
-            "random_seed": 1,
-            "decoding_method": "greedy",
-            "stop_sequences": [],
-        })
-    num_processes = 50
+    llm_as_a_judge_model = "meta-llama/llama-3-3-70b-instruct"
+    # string metrics run in one process per core, judge calls are bounded by num_judge_workers
+    num_processes = os.cpu_count()
+    num_judge_workers = 50
+    # "json" reads/writes the per-cell json files, "columnar" uses the Parquet results store
+    results_format = "json"
+    # spans of the evaluation stages written to trace_dir (JSONL and Chrome trace) with a summary per cell, None to disable
+    trace_dir = None  # results_base_dir + "traces"
+    if trace_dir:
+        enable_tracing(trace_dir)
 
+    config = {
+        "results_base_dir": results_base_dir,
+        "results_format": results_format,
+        "hallucination_test": hallucination_test,
+        "wLLM": wLLM,
+        "llm_as_a_judge_model": llm_as_a_judge_model,
+        "metric_cascade": METRIC_CASCADE,
+    }
+    result_store = get_result_store(config) if results_format == "columnar" else None
+    cells = []
     for model_name in model_names:
         for setup_type in setup_types:
             for task in task_lists:
+                cell = (model_name, setup_type, task)
+                if is_cell_pending(cell, config, result_store):
+                    cells.append(cell)
+                else:
+                    print("SKIPPED: " + task + "_" + model_name.split('/')[1] + "_" + setup_type)
 
-                filename = task + "_" + model_name.split('/')[1] + "_" + setup_type + "_predictions.json"
-                if filename.endswith(".json"):
-                    if os.path.exists(os.path.join(results_base_dir + "evaluation",
-                                                   filename.replace("_predictions.json", "") + "_eval.json")):
-                        print("SKIPPED: " + filename)
-                        continue
-                    predictions_filepath = os.path.join(results_base_dir_pred, filename)
-                    try:
-                        with open(predictions_filepath, 'r') as f:
-                            qa_samples_pred_dict = json.load(f)
-
-                        qa_samples_obj = convert_dict_to_list_of_objects(qa_samples_pred_dict)
-                    except BaseException:
-                        print("FAILED: " + filename)
-                        continue
-
-                    for i in range(0, len(qa_samples_pred_dict)):
-                        qa_samples_pred_dict[i]["metrics"]["exact_match"] = calculate_exact_match(qa_samples_obj[i])
-                        qa_samples_pred_dict[i]["metrics"]["contains"] = evals.contains(qa_samples_obj[i])
-                        if hallucination_test:
-                            if 'direct_prompting' in filename:
-                                qa_samples_pred_dict[i]["metrics"]["hallucination"] = evals.check_direct_prompt_hallucination(qa_samples_obj[i])
-                            if 'code_generation' in filename:
-                                qa_samples_pred_dict[i]["metrics"]["hallucination"] = evals.check_hallucinated_keys(qa_samples_obj[i]) or evals.check_codegen_hallucination(qa_samples_obj[i])
-                        if num_processes == 0 and wLLM:
-                            qa_samples_pred_dict[i]["metrics"]["llm_as_a_judge"] = evals.llm_as_a_judge(qa_samples_obj[i], get_llm_as_a_judge, llm_as_a_judge_model)
-                    if wLLM:
-                        if num_processes > 0:
-                            with Pool(processes=num_processes) as pool:
-                                args = [(i, qa_samples_obj[i], llm_as_a_judge_model) for i in
-                                     range(len(qa_samples_obj))]
-                                results = pool.map(
-                                    evaluate_sample,
-                                    args
-                                )
-                            for i, result in results:
-                                qa_samples_pred_dict[i]["metrics"]["llm_as_a_judge"] = result
-                    if wLLM:
-                        suffix = "eval.json"
-                    else:
-                        suffix = "eval_woLLM.json"
-                    with open(results_base_dir + "evaluation/" + filename.replace("predictions.json", "") + suffix, 'w') as f:
-                        json.dump(qa_samples_pred_dict, f, indent=2)
-
+    asyncio.run(evaluate_grid(cells, config, num_processes, num_judge_workers))
+    if trace_dir:
+        print(export_trace(trace_dir))
@@ -1,18 +1,31 @@
 import json
 import os
 import types
+from collections import Counter
 from typing import Any
-from multiprocessing import Pool
+from multiprocessing import Pool, resource_tracker
 import inspect, textwrap
 
-from generate_qa_pairs.tasks.data_structures import LongResponseQASample
-from generate_qa_pairs.tasks.utils import generate, get_lm
+from generate_qa_pairs.response_reader import load_api_response, read_offset_index
+from generate_qa_pairs.tasks.data_structures import LongResponseQASample, QABatch
+from generate_qa_pairs.tasks.tracing import enable_tracing, export_trace, flush_spans, span, trace_context
+from generate_qa_pairs.tasks.utils import (
+    MODEL_NAME_HF_MAP,
+    connection_stats,
+    dedup_response_records,
+    generate,
+    get_lm,
+    get_tokenizer,
+    token_usage,
+)
 from codegen_scripts.general_code_generation import (
     PromptStyle,
     get_answer_from_json,
 )
 from codegen_scripts import direct_prompting_code
+from codegen_scripts.parameterized_programs import answer_with_program, get_sample_template, program_stats
 from counterfactuals import extract_json_paths, filter_data_by_keys,filter_schema_by_keys
+from response_arena import restore_responses, share_responses, strip_responses
 import importlib
 
 try:
@@ -22,6 +35,13 @@ try:
 except ImportError:
     pass
 
+# questions about the same response asked in one prompt by the direct_prompting_batched setup
+BATCHED_QUESTIONS_PER_PROMPT = 10
+
+# prompt sizes of the batched setup in this process: the batched prompts (and single-question fallbacks)
+# sent, against the direct_prompting prompts the same questions would have needed
+batching_stats: Counter = Counter()
+
 def get_prompt(qa_sample: LongResponseQASample, setup_type: str):
     prompt = ""
     if setup_type == "direct_prompting":
@@ -35,7 +55,7 @@ def get_prompt(qa_sample: LongResponseQASample, setup_type: str):
 def get_prompt_style(setup_type: str) -> PromptStyle:
     if setup_type == "code_generation":
         return PromptStyle.ZERO_SHOT
-    elif setup_type == "code_generation_schema" or setup_type == "code_generation_schema_cfx2":
+    elif setup_type == "code_generation_schema" or setup_type == "code_generation_schema_cfx2" or setup_type == "code_generation_parameterized":
         return PromptStyle.ZERO_SHOT_WITH_RESPONSE_SCHEMA
     elif setup_type == "code_generation_schema_no_resp":
         return PromptStyle.ZERO_SHOT_WITH_NO_RESPONSE
@@ -43,6 +63,10 @@ def get_prompt_style(setup_type: str) -> PromptStyle:
         return PromptStyle.ZERO_SHOT_WITH_COMPACT_RESPONSE
     elif setup_type == "cot_code_generation_schema":
         return PromptStyle.ZERO_SHOT_WITH_COT_RESPONSE_SCHEMA
+    elif setup_type == "code_generation_question_last":
+        return PromptStyle.ZERO_SHOT_QUESTION_LAST
+    elif setup_type == "code_generation_schema_question_last":
+        return PromptStyle.ZERO_SHOT_WITH_RESPONSE_SCHEMA_QUESTION_LAST
 
 def get_api_response_cf(api_response,schema,sample,task):
 
@@ -72,6 +96,50 @@ def get_api_response_cf(api_response,schema,sample,task):
     return (api_response, schema)
 
 
+def load_qa_samples(task: str, simplify_json: bool, data_dir: str = "../generate_qa_pairs/data/") -> QABatch:
+    # Load json file with QA pairs
+    task_file = data_dir + "qa_pairs/" + task + "_qa_pairs.json"
+    with open(task_file, 'r') as file:
+        qa_pairs = json.load(file)
+    # Build the QABatch, one row per LongSampleQA
+    qa_batch = QABatch()
+    api_responses = {}
+    schemas = {}
+    for sample in qa_pairs:
+        # questions about the same response share one object, referenced by the hash in the index sidecar
+        api_response_fpath = data_dir + sample['api_response_path']
+        response_key = (sample["app"], sample["endpoint"], sample["api_query"])
+        if (api_response_fpath, response_key) not in api_responses:
+            with span("load_response"):
+                api_responses[api_response_fpath, response_key] = load_api_response(api_response_fpath, *response_key)
+        api_response = api_responses[api_response_fpath, response_key]
+        response_ref = read_offset_index(api_response_fpath)[response_key][2]
+        if sample['api_response_schema'] not in schemas:
+            with open(data_dir + sample['api_response_schema'], 'r', encoding='utf-8') as f:
+                schemas[sample['api_response_schema']] = f.read()
+        schema = schemas[sample['api_response_schema']]
+        if simplify_json:
+            # Simplify the json response to only keep paths which are required by the get_answer method
+            schema = json.loads(schema)
+            api_response, schema = get_api_response_cf(api_response, schema, sample, task)
+            schema = str(schema)
+            response_ref = None
+
+        qa_batch.append(api_response,
+                        question=sample['question'],
+                        gold_answer=sample['gold_answer'],
+                        schema=schema,
+                        pred_answer=None,
+                        model_output=None,
+                        code_exec_status=None,
+                        metrics=sample['metrics'],
+                        task=sample['task'],
+                        task_type=sample['task_type'],
+                        uid=sample['uid'],
+                        response_ref=response_ref)
+    return qa_batch
+
+
 def run_inference(qa_pairs: list[LongResponseQASample], setup_type: str, model_name: str, llm_parameters: dict[str, Any]) -> list[LongResponseQASample]:
     output_list = []
     llm = get_lm(model_name, parameters=llm_parameters)
@@ -79,15 +147,24 @@ def run_inference(qa_pairs: list[LongResponseQASample], setup_type: str, model_n
     if "code_generation" in setup_type:
         prompt_style = get_prompt_style(setup_type)
         for qa_pair in qa_pairs:
-            answer = get_answer_from_json(
-                api_response=qa_pair.api_response,
-                query=qa_pair.question,
-                llm_object=llm,
-                model_name=model_name,
-                prompt_style=prompt_style,
-                few_shots="",
-                json_schema=qa_pair.schema
-            )
+            # one program per question template, the questions of other tasks are asked one by one
+            question_template = get_sample_template(qa_pair) if setup_type == "code_generation_parameterized" else None
+            if question_template is not None:
+                answer = answer_with_program(qa_pair.api_response, qa_pair.question, question_template, llm,
+                                             model_name, qa_pair.schema)
+            else:
+                if setup_type == "code_generation_parameterized":
+                    program_stats["fallback_questions"] += 1
+                answer = get_answer_from_json(
+                    api_response=qa_pair.api_response,
+                    query=qa_pair.question,
+                    llm_object=llm,
+                    model_name=model_name,
+                    prompt_style=prompt_style,
+                    few_shots="",
+                    json_schema=qa_pair.schema,
+                    response_ref=qa_pair.response_ref,
+                )
             try:
                 qa_pair.model_output = answer[0]
                 if isinstance(answer[1], types.GeneratorType):
@@ -113,11 +190,14 @@ def run_inference(qa_pairs: list[LongResponseQASample], setup_type: str, model_n
                     qa_pair.pred_answer = None
                     qa_pair.code_exec_status = None
             output_list.append(qa_pair)
+    elif setup_type == "direct_prompting_batched":
+        output_list = run_inference_batched(qa_pairs, llm, model_name)
     else:
         if len(qa_pairs) > 0:
-            prompts = [
-                get_prompt(qa_sample=qa_sample, setup_type=setup_type) for qa_sample in qa_pairs
-            ]
+            with span("build_prompt", prompts=len(qa_pairs)):
+                prompts = [
+                    get_prompt(qa_sample=qa_sample, setup_type=setup_type) for qa_sample in qa_pairs
+                ]
             try:
                 generations = generate(
                     llm=llm, model_name=model_name, prompts=prompts, temperature=0
@@ -127,13 +207,197 @@ def run_inference(qa_pairs: list[LongResponseQASample], setup_type: str, model_n
                     generations = ["context length exceeded" for i in range(len(prompts))]
                 else:
                     generations = [str(e) for i in range(len(prompts))]
+            if len(generations) != len(qa_pairs):
+                raise ValueError(f"{len(generations)} generations for {len(qa_pairs)} prompts")
 
-        for qa_sample, generation in zip(qa_pairs, generations):
-            qa_sample.pred_answer = generation
-            output_list.append(qa_sample)
+            for qa_sample, generation in zip(qa_pairs, generations):
+                if generation is None:
+                    # out of retries: left out of the checkpoint, so that the next run asks it again
+                    continue
+                qa_sample.pred_answer = generation
+                output_list.append(qa_sample)
     return output_list
 
 
+def generate_or_error(llm: Any, model_name: str, prompts: list[str]) -> list[str]:
+    try:
+        return generate(llm=llm, model_name=model_name, prompts=prompts, temperature=0)
+    except BaseException as e:
+        if "maximum context length" in str(e):
+            return ["context length exceeded" for i in range(len(prompts))]
+        return [str(e) for i in range(len(prompts))]
+
+
+def run_inference_batched(qa_pairs: list[LongResponseQASample], llm: Any, model_name: str) -> list[LongResponseQASample]:
+    """
+    Ask the questions about the same response BATCHED_QUESTIONS_PER_PROMPT at a time, with numbered
+    answers in a JSON object. Questions whose answer can not be parsed from the output are asked
+    again one by one with the direct_prompting prompt.
+    Questions without any output are left out of the returned samples.
+    """
+    singles = []
+    for batch in group_samples_by_response(qa_pairs, BATCHED_QUESTIONS_PER_PROMPT):
+        with span("build_prompt", prompts=len(batch) + 1):
+            single_prompts = [get_prompt(qa_sample=qa_sample, setup_type="direct_prompting") for qa_sample in batch]
+            prompt = direct_prompting_code.get_prompt_batched(batch) if len(batch) > 1 else None
+        batching_stats["single_prompt_chars"] += sum(len(prompt) for prompt in single_prompts)
+        if len(batch) == 1:
+            singles.append((batch[0], single_prompts[0]))
+            continue
+        batching_stats["batched_prompts"] += 1
+        batching_stats["batched_prompt_chars"] += len(prompt)
+        generations = generate_or_error(llm, model_name, [prompt])
+        if not generations or generations[0] is None:
+            # no output for the batched prompt: all its questions are asked one by one
+            batching_stats["fallback_questions"] += len(batch)
+            singles += zip(batch, single_prompts)
+            continue
+        generation = generations[0]
+        answers = direct_prompting_code.parse_batched_answers(generation, len(batch))
+        for number, (qa_sample, single_prompt) in enumerate(zip(batch, single_prompts), start=1):
+            qa_sample.model_output = generation
+            if number in answers:
+                qa_sample.pred_answer = answers[number]
+                batching_stats["batched_answers"] += 1
+            else:
+                batching_stats["fallback_questions"] += 1
+                singles.append((qa_sample, single_prompt))
+
+    if singles:
+        batching_stats["batched_prompt_chars"] += sum(len(prompt) for _, prompt in singles)
+        generations = generate_or_error(llm, model_name, [prompt for _, prompt in singles])
+        if len(generations) != len(singles):
+            raise ValueError(f"{len(generations)} generations for {len(singles)} prompts")
+        for (qa_sample, _), generation in zip(singles, generations):
+            qa_sample.pred_answer = generation
+        unanswered = {id(qa_sample) for (qa_sample, _), generation in zip(singles, generations) if generation is None}
+        return [qa_sample for qa_sample in qa_pairs if id(qa_sample) not in unanswered]
+    return qa_pairs
+
+
+def run_inference_task(args: tuple) -> tuple[list[LongResponseQASample], dict[str, int]]:
+    # single-argument wrapper so that results can be streamed back with imap_unordered,
+    # along with the token usage of the task. With the name of a response arena as last argument,
+    # the responses of the samples are read from it and are not sent back either
+    qa_pairs, setup_type, model_name, llm_parameters, *arena_name = args
+    with trace_context(model=model_name, setup=setup_type), span("task", questions=len(qa_pairs)):
+        if arena_name and arena_name[0]:
+            with span("restore_responses"):
+                restore_responses(qa_pairs, arena_name[0])
+        usage_before = process_usage()
+        output_list = run_inference(qa_pairs, setup_type, model_name, llm_parameters)
+        if arena_name and arena_name[0]:
+            output_list = strip_responses(output_list)
+    flush_spans()
+    return output_list, dict(process_usage() - usage_before)
+
+
+def init_worker(model_names: list[str], llm_parameters: dict[str, Any]) -> None:
+    """
+    Pool initializer building once per worker process the LLM clients of the models of the grid (kept
+    by get_lm for all the tasks of the process) and their tokenizers. Failures are left to the tasks,
+    as a raising initializer would make the pool restart its workers forever.
+    """
+    for model_name in model_names:
+        try:
+            get_lm(model_name, parameters=llm_parameters)
+            if model_name in MODEL_NAME_HF_MAP:
+                get_tokenizer(model_name)
+        except Exception as e:
+            print(f"Worker {os.getpid()} could not initialize {model_name}: {e}")
+
+
+def imap_chunksize(num_tasks: int, num_processes: int) -> int:
+    # about 4 chunks per worker: few enough IPC round trips, small enough for results to stream back
+    return max(1, num_tasks // (num_processes * 4))
+
+
+def process_usage() -> Counter:
+    return (token_usage + Counter({f"batching_{key}": value for key, value in batching_stats.items()})
+            + Counter({f"program_{key}": value for key, value in program_stats.items()})
+            + Counter({f"connection_{key}": value for key, value in connection_stats.items()}))
+
+
+def group_samples_by_response(qa_samples: list[LongResponseQASample], max_group_size: int = 0) -> list[list[LongResponseQASample]]:
+    """
+    Split samples into tasks of consecutive questions about the same response (at most max_group_size
+    per task when set), so that one worker sends them back to back and the provider's prompt cache
+    (and the render cache) can reuse the shared response prefix
+    """
+    groups: dict[Any, list[LongResponseQASample]] = {}
+    for sample in qa_samples:
+        groups.setdefault(sample.response_ref or id(sample.api_response), []).append(sample)
+    tasks = []
+    for group in groups.values():
+        size = max_group_size or len(group)
+        tasks += [group[i:i + size] for i in range(0, len(group), size)]
+    return tasks
+
+
+def group_samples_by_task(qa_samples: list[LongResponseQASample]) -> list[list[LongResponseQASample]]:
+    """
+    Split samples into one task per question template, so that the program generated for the first
+    question is reused by the same worker for all the others
+    """
+    groups: dict[str, list[LongResponseQASample]] = {}
+    for sample in qa_samples:
+        groups.setdefault(sample.task, []).append(sample)
+    return list(groups.values())
+
+
+def read_checkpoint(checkpoint_path: str) -> dict[str, dict[str, Any]]:
+    """
+    Read the per-sample checkpoint of a cell, keyed by uid.
+    A truncated line (interrupted write) is dropped from the file and that sample is re-run.
+    """
+    completed = {}
+    truncated = False
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    truncated = True
+                    continue
+                completed[entry["uid"]] = entry
+    if truncated:
+        with open(checkpoint_path + ".tmp", 'w', encoding='utf-8') as f:
+            for entry in completed.values():
+                f.write(json.dumps(entry) + "\n")
+        os.replace(checkpoint_path + ".tmp", checkpoint_path)
+    return completed
+
+
+def merge_checkpoint(qa_batch: QABatch, completed: dict[str, dict[str, Any]]) -> list[str]:
+    """
+    Compaction: merge the checkpointed outputs back into the columns in their original order.
+    Returns the uids missing from the checkpoint (a sample whose call failed or whose worker died),
+    which are left pending so that the next run asks them again.
+    """
+    missing = []
+    for i, uid in enumerate(qa_batch.uid):
+        entry = completed.get(uid)
+        if entry is None:
+            missing.append(uid)
+            continue
+        qa_batch.pred_answer[i] = entry["predicted_answer"]
+        qa_batch.code_exec_status[i] = entry["code_exec_status"]
+        qa_batch.model_output[i] = entry["model_output"]
+    return missing
+
+
+def append_checkpoint(checkpoint_file, sample: LongResponseQASample) -> None:
+    checkpoint_file.write(json.dumps({
+        "uid": sample.uid,
+        "predicted_answer": sample.pred_answer,
+        "code_exec_status": sample.code_exec_status,
+        "model_output": sample.model_output,
+    }, default=str) + "\n")
+    checkpoint_file.flush()
+    os.fsync(checkpoint_file.fileno())
+
+
 if __name__ == "__main__":
     setup_types = [
         "direct_prompting",
@@ -146,6 +410,13 @@ if __name__ == "__main__":
         "cot_code_generation_schema",
         "direct_prompting_schema_cfx2",
         "code_generation_schema_cfx2",
+        # several questions about the same response per prompt
+        # "direct_prompting_batched",
+        # one program per question template, run for all its questions
+        # "code_generation_parameterized",
+        # question after the response, for providers with prompt caching
+        # "code_generation_question_last",
+        # "code_generation_schema_question_last",
     ]
 
     task_lists = [ #sorted by size
@@ -191,6 +462,30 @@ if __name__ == "__main__":
     }
 
     num_processes = 40
+    # send the questions about the same response to one worker, back to back (prompt cache reuse)
+    group_by_response = True
+    max_questions_per_task = 8
+    # place the responses of a cell once in shared memory for the workers instead of pickling them with every task
+    share_responses_in_memory = True
+    # "json" writes one *_predictions.json per cell, "json_ref" does the same but stores each api_response
+    # and schema once under results/responses, "columnar" appends to the Parquet results store
+    results_format = "json"
+    # spans of the pipeline stages written to trace_dir (JSONL and Chrome trace) with a summary per cell, None to disable
+    trace_dir = None  # os.path.dirname(__file__) + "/results/traces"
+    if trace_dir:
+        enable_tracing(trace_dir)
+    if results_format == "columnar":
+        from results_store import ResultStore, cell_filter
+        result_store = ResultStore(os.path.dirname(__file__) + "/results/store")
+    # one pool for the whole grid, its workers keep their clients and caches from cell to cell
+    if num_processes:
+        # started before the fork so that the workers attaching to the response arenas share it (a
+        # tracker of their own would unlink the arenas when they exit)
+        resource_tracker.ensure_running()
+        pool = Pool(processes=num_processes, initializer=init_worker, initargs=(model_names, llm_parameters))
+    else:
+        pool = None
+        init_worker(model_names, llm_parameters)
     for model_name in model_names:
         for setup_type in setup_types:
             if 'cf' in setup_type: # for counterfactual analysis
@@ -198,74 +493,97 @@ if __name__ == "__main__":
             else:
                 simplify_json = False
             for task in task_lists:
-                if os.path.exists(os.path.dirname(__file__) + f"/results/predictions/{task}_{model_name.split('/')[1]}_{setup_type}_predictions.json"):
+                if results_format == "columnar":
+                    done = result_store.read_table("predictions", columns=["uid"], filter=cell_filter(
+                        endpoint=task, model=model_name, setup_type=setup_type)).num_rows > 0
+                else:
+                    done = os.path.exists(os.path.dirname(__file__) + f"/results/predictions/{task}_{model_name.split('/')[1]}_{setup_type}_predictions.json")
+                if done:
                     print("SKIPPING: " + f"{task}_{model_name.split('/')[1]}_{setup_type}")
                     continue
-                # Load json file with QA pairs
-                task_file = "../generate_qa_pairs/data/qa_pairs/" + task + "_qa_pairs.json"
-                with open(task_file, 'r') as file:
-                    qa_pairs = json.load(file)
-                # Build LongSampleQA
-                qa_pair_obj_list = []
-                updates_qa_pairs_obj_list = []
-                for sample in qa_pairs:
-                    with open("../generate_qa_pairs/data/" + sample['api_response_path'], 'r', encoding='utf-8') as f:
-                        tmp = json.load(f)
-                        api_response = tmp[sample["app"]][sample["endpoint"]][sample["api_query"]]
-                    with open("../generate_qa_pairs/data/" + sample['api_response_schema'], 'r', encoding='utf-8') as f:
-                        schema = f.read()
-                    if simplify_json:
-                        # Simplify the json response to only keep paths which are required by the get_answer method
-                        schema = json.loads(schema)
-                        api_response, schema = get_api_response_cf(api_response, schema, sample, task)
-                        schema = str(schema)
-
-                    qa_pair_obj = LongResponseQASample(api_response=api_response,
-                                                       question=sample['question'],
-                                                       gold_answer=sample['gold_answer'],
-                                                       schema=schema,
-                                                       pred_answer=None,
-                                                       model_output=None,
-                                                       code_exec_status=None,
-                                                       metrics=sample['metrics'],
-                                                       task=sample['task'],
-                                                       task_type=sample['task_type'],
-                                                       uid=sample['uid'])
-                    qa_pair_obj_list.append(qa_pair_obj)
-
-                # Call the model
-                if num_processes == 0:
-                    updates_qa_pairs_obj_list = run_inference(qa_pair_obj_list, setup_type, model_name, llm_parameters)
+                with trace_context(model=model_name, setup=setup_type, endpoint=task):
+                    qa_batch = load_qa_samples(task, simplify_json)
+
+                # Call the model, checkpointing every sample as soon as it completes so that an
+                # interrupted run only re-dispatches the uids missing from the checkpoint
+                cell_name = f"{task}_{model_name.split('/')[1]}_{setup_type}"
+                checkpoint_path = os.path.dirname(__file__) + f"/results/checkpoints/{cell_name}.jsonl"
+                os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+                completed = read_checkpoint(checkpoint_path)
+                pending = [sample for sample in qa_batch if sample.uid not in completed]
+                if completed:
+                    print(f"RESUMING: {cell_name}, {len(completed)} done, {len(pending)} pending")
+                if setup_type == "direct_prompting_batched":
+                    # the batched prompts need all the questions about a response in the same task
+                    batches = group_samples_by_response(pending)
+                elif setup_type == "code_generation_parameterized":
+                    batches = group_samples_by_task(pending)
+                elif group_by_response:
+                    batches = group_samples_by_response(pending, max_questions_per_task)
+                else:
+                    batches = [[sample] for sample in pending]
+                cell_usage = Counter()
+                arena = share_responses(pending) if pool and share_responses_in_memory else None
+                if arena:
+                    args = [(strip_responses(batch), str(setup_type), str(model_name), dict(llm_parameters), arena.name)
+                            for batch in batches]
                 else:
-                    args = []
-                    for sample in qa_pair_obj_list:
-                        args.append(([sample], str(setup_type), str(model_name), dict(llm_parameters)))
-                    with Pool(processes=num_processes) as pool:
-                        output_lists = pool.starmap(
-                            run_inference, args
-                        )
-                    for output_list in output_lists:
-                        updates_qa_pairs_obj_list.extend(output_list)  # _with_changed_prompt_again
+                    args = [(batch, str(setup_type), str(model_name), dict(llm_parameters)) for batch in batches]
+                try:
+                    with open(checkpoint_path, 'a', encoding='utf-8') as checkpoint_file, \
+                            span("cell", model=model_name, setup=setup_type, endpoint=task, questions=len(pending)):
+                        if pool:
+                            results_iter = pool.imap_unordered(run_inference_task, args,
+                                                               chunksize=imap_chunksize(len(args), num_processes))
+                        else:
+                            results_iter = map(run_inference_task, args)
+                        for output_list, usage in results_iter:
+                            cell_usage.update(usage)
+                            for sample in output_list:
+                                append_checkpoint(checkpoint_file, sample)
+                finally:
+                    # also when a task raises or on KeyboardInterrupt, so that the block does not stay in /dev/shm
+                    if arena:
+                        arena.close()
+                        arena.unlink()
+                if cell_usage["requests_with_cached_tokens"]:
+                    print(f"{cell_name}: {cell_usage['cached_tokens']} of {cell_usage['prompt_tokens']} prompt tokens "
+                          f"cached ({cell_usage['cached_tokens'] / max(cell_usage['prompt_tokens'], 1):.1%})")
+                if cell_usage["batching_single_prompt_chars"]:
+                    # ~4 characters per token, as the savings are estimated before tokenization
+                    print(f"{cell_name}: ~{cell_usage['batching_batched_prompt_chars'] // 4} input tokens instead of "
+                          f"~{cell_usage['batching_single_prompt_chars'] // 4} "
+                          f"({1 - cell_usage['batching_batched_prompt_chars'] / cell_usage['batching_single_prompt_chars']:.1%} saved), "
+                          f"{cell_usage['batching_fallback_questions']} questions asked again one by one")
+                if cell_usage["connection_http_requests"]:
+                    print(f"{cell_name}: {cell_usage['connection_http_requests']} HTTP requests over "
+                          f"{cell_usage['connection_connections_opened']} new connections "
+                          f"({cell_usage['connection_tls_handshakes']} TLS handshakes)")
+                if cell_usage["program_programs_generated"]:
+                    print(f"{cell_name}: {cell_usage['program_programs_generated'] + cell_usage['program_fallback_questions']} "
+                          f"LLM calls for {len(pending)} questions ({cell_usage['program_programs_generated']} programs "
+                          f"reused {cell_usage['program_program_reuses']} times, "
+                          f"{cell_usage['program_fallback_questions']} questions without a template)")
+
+                missing = merge_checkpoint(qa_batch, read_checkpoint(checkpoint_path))
+                if missing:
+                    print(f"INCOMPLETE: {cell_name}, {len(missing)} samples missing from the checkpoint, "
+                          f"left pending for the next run")
+                    continue
 
                 # Save the new json file with predicted answer and intermediary outputs
-                results = []
-                for sample in updates_qa_pairs_obj_list:
-                        results.append({
-                            "endpoint": task,
-                            "setup_type": setup_type,
-                            "model": model_name,
-                            "uid": sample.uid,
-                            "api_response": sample.api_response,
-                            "question": sample.question,
-                            "gold_answer": sample.gold_answer,
-                            "schema": sample.schema,
-                            "task": sample.task,
-                            "task_type": sample.task_type,
-                            "predicted_answer": sample.pred_answer,
-                            "code_exec_status": sample.code_exec_status,
-                            "model_output": sample.model_output,
-                            "metrics": sample.metrics
-                        })
-                with open(os.path.dirname(__file__) + f"/results/predictions/{task}_{model_name.split('/')[1]}_{setup_type}_predictions.json",
-                          "w") as file:
-                    json.dump(results, file)
\ No newline at end of file
+                results = qa_batch.to_records(endpoint=task, setup_type=setup_type, model=model_name)
+                if results_format == "columnar":
+                    result_store.append("predictions", results)
+                else:
+                    if results_format == "json_ref":
+                        results = dedup_response_records(results, os.path.dirname(__file__) + "/results/responses")
+                    with open(os.path.dirname(__file__) + f"/results/predictions/{task}_{model_name.split('/')[1]}_{setup_type}_predictions.json",
+                              "w") as file:
+                        json.dump(results, file)
+                os.remove(checkpoint_path)
+    if pool:
+        pool.close()
+        pool.join()
+    if trace_dir:
+        print(export_trace(trace_dir))
@@ -0,0 +1,119 @@
+import pickle
+import struct
+from collections import OrderedDict
+from dataclasses import replace
+from multiprocessing import shared_memory
+from typing import Any
+
+from generate_qa_pairs.tasks.data_structures import LongResponseQASample, QARow
+
+# length of the pickled offset table at the start of the block
+_HEADER = struct.Struct("<Q")
+# responses kept decoded per worker, tasks being grouped by response
+DECODED_CACHE_SIZE = 4
+
+
+class ResponseArena:
+    """
+    API responses written once to a shared memory block which the pool workers attach to by name,
+    instead of pickling a response with every task. The block holds the pickled offset table
+    {response_ref: (offset, length)} followed by the pickled responses; a worker only decodes the
+    responses of its samples, on first use.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, table: dict[str, tuple[int, int]], data_start: int) -> None:
+        self._shm = shm
+        self._table = table
+        self._data_start = data_start
+        self._decoded: OrderedDict = OrderedDict()
+
+    @classmethod
+    def create(cls, responses: dict[str, Any]) -> "ResponseArena":
+        payloads = {ref: pickle.dumps(response, protocol=pickle.HIGHEST_PROTOCOL) for ref, response in responses.items()}
+        table = {}
+        offset = 0
+        for ref, payload in payloads.items():
+            table[ref] = (offset, len(payload))
+            offset += len(payload)
+        header = pickle.dumps(table, protocol=pickle.HIGHEST_PROTOCOL)
+        data_start = _HEADER.size + len(header)
+        shm = shared_memory.SharedMemory(create=True, size=max(data_start + offset, 1))
+        _HEADER.pack_into(shm.buf, 0, len(header))
+        shm.buf[_HEADER.size:data_start] = header
+        for ref, payload in payloads.items():
+            start = data_start + table[ref][0]
+            shm.buf[start:start + len(payload)] = payload
+        return cls(shm, table, data_start)
+
+    @classmethod
+    def attach(cls, name: str) -> "ResponseArena":
+        shm = shared_memory.SharedMemory(name=name)
+        (header_length,) = _HEADER.unpack_from(shm.buf, 0)
+        with shm.buf[_HEADER.size:_HEADER.size + header_length] as header:
+            table = pickle.loads(header)
+        return cls(shm, table, _HEADER.size + header_length)
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def nbytes(self) -> int:
+        return self._shm.size
+
+    def get(self, response_ref: str) -> Any:
+        if response_ref in self._decoded:
+            self._decoded.move_to_end(response_ref)
+            return self._decoded[response_ref]
+        offset, length = self._table[response_ref]
+        start = self._data_start + offset
+        # the view is released before returning, so that the block can be closed
+        with self._shm.buf[start:start + length] as view:
+            response = pickle.loads(view)
+        self._decoded[response_ref] = response
+        if len(self._decoded) > DECODED_CACHE_SIZE:
+            self._decoded.popitem(last=False)
+        return response
+
+    def close(self) -> None:
+        self._decoded.clear()
+        self._shm.close()
+
+    def unlink(self) -> None:
+        self._shm.unlink()
+
+
+# arena of the current cell in a worker process
+_attached: dict[str, ResponseArena] = {}
+
+
+def get_arena(name: str) -> ResponseArena:
+    if name not in _attached:
+        # cells run one after the other, the arena of the previous one is no longer used
+        for arena in _attached.values():
+            arena.close()
+        _attached.clear()
+        _attached[name] = ResponseArena.attach(name)
+    return _attached[name]
+
+
+def share_responses(qa_samples: list[LongResponseQASample]) -> ResponseArena | None:
+    # samples without response_ref (simplified responses of the cf setups) keep their response inline
+    responses = {sample.response_ref: sample.api_response for sample in qa_samples if sample.response_ref is not None}
+    return ResponseArena.create(responses) if responses else None
+
+
+def strip_responses(qa_samples: list[LongResponseQASample]) -> list[LongResponseQASample]:
+    """
+    Copies of the samples without the responses that are in the arena, to be sent to or from workers
+    """
+    return [replace(sample.to_sample() if isinstance(sample, QARow) else sample, api_response=None)
+            if sample.response_ref is not None else sample
+            for sample in qa_samples]
+
+
+def restore_responses(qa_samples: list[LongResponseQASample], arena_name: str) -> None:
+    arena = get_arena(arena_name)
+    for sample in qa_samples:
+        if sample.api_response is None and sample.response_ref is not None:
+            sample.api_response = arena.get(sample.response_ref)
@@ -0,0 +1,166 @@
+import json
+import os
+import uuid
+from typing import Any
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from generate_qa_pairs.response_reader import get_response_ref
+
+# Columns holding arbitrary python values (code outputs can be lists, numbers, ...) are stored
+# as JSON text so that they round-trip with the same types as the *_predictions.json files.
+JSON_COLUMNS = ["gold_answer", "predicted_answer", "code_exec_status", "model_output"]
+METRIC_COLUMNS = ["exact_match", "contains", "hallucination", "llm_as_a_judge"]
+
+RECORD_SCHEMA = pa.schema([
+    ("endpoint", pa.string()),
+    ("setup_type", pa.string()),
+    ("model", pa.string()),
+    ("model_short_name", pa.string()),
+    ("uid", pa.string()),
+    ("question", pa.string()),
+    ("task", pa.string()),
+    ("task_type", pa.string()),
+    ("response_ref", pa.string()),
+    ("schema_ref", pa.string()),
+    ("gold_answer", pa.string()),
+    ("predicted_answer", pa.string()),
+    ("code_exec_status", pa.string()),
+    ("model_output", pa.string()),
+    ("exact_match_metric", pa.string()),
+] + [(metric, pa.bool_()) for metric in METRIC_COLUMNS])
+
+BLOB_SCHEMA = pa.schema([
+    ("ref", pa.string()),
+    ("payload", pa.string()),
+])
+
+
+class ResultStore:
+    """
+    Columnar (Parquet) store for predictions and evaluations.
+    Responses and schemas are kept once in a blob table and referenced by hash from the records;
+    each (endpoint, model, setup) cell is appended as its own Parquet file so that filters on
+    those columns skip whole files through the Parquet statistics.
+    """
+
+    def __init__(self, root_dir: str) -> None:
+        self.root_dir = root_dir
+        self._known_refs: set[str] | None = None
+        self._blobs: dict[str, Any] = {}
+        for table in ("blobs", "predictions", "evaluations"):
+            os.makedirs(os.path.join(root_dir, table), exist_ok=True)
+
+    def _dataset(self, table: str) -> ds.Dataset:
+        return ds.dataset(os.path.join(self.root_dir, table), format="parquet",
+                          schema=BLOB_SCHEMA if table == "blobs" else RECORD_SCHEMA)
+
+    def _write(self, table: str, arrow_table: pa.Table) -> None:
+        # unique part name: the evaluation pool processes append concurrently; the "." prefix keeps
+        # the temporary file out of the dataset until it is complete
+        table_dir = os.path.join(self.root_dir, table)
+        part = f"part-{os.getpid()}-{uuid.uuid4().hex}.parquet"
+        tmp_path = os.path.join(table_dir, f".{part}.tmp")
+        pq.write_table(arrow_table, tmp_path)
+        os.replace(tmp_path, os.path.join(table_dir, part))
+
+    def put_blobs(self, payloads: list[Any]) -> list[str]:
+        if self._known_refs is None:
+            self._known_refs = set(self._dataset("blobs").to_table(columns=["ref"])["ref"].to_pylist())
+        refs = []
+        new_refs, new_payloads = [], []
+        for payload in payloads:
+            ref = get_response_ref(payload)
+            refs.append(ref)
+            if ref not in self._known_refs:
+                self._known_refs.add(ref)
+                new_refs.append(ref)
+                new_payloads.append(json.dumps(payload))
+        if new_refs:
+            self._write("blobs", pa.table({"ref": new_refs, "payload": new_payloads}, schema=BLOB_SCHEMA))
+        return refs
+
+    def get_blobs(self, refs: list[str]) -> list[Any]:
+        # the refs not loaded yet are read with one scan of the blob table
+        missing = list({ref for ref in refs if ref not in self._blobs})
+        if missing:
+            table = self._dataset("blobs").to_table(filter=ds.field("ref").isin(missing))
+            for ref, payload in zip(table["ref"].to_pylist(), table["payload"].to_pylist()):
+                self._blobs.setdefault(ref, json.loads(payload))
+            for ref in missing:
+                if ref not in self._blobs:
+                    raise KeyError(f"Blob {ref} not found in {self.root_dir}")
+        return [self._blobs[ref] for ref in refs]
+
+    def get_blob(self, ref: str) -> Any:
+        return self.get_blobs([ref])[0]
+
+    def append(self, table: str, records: list[dict[str, Any]]) -> None:
+        """
+        Append records in the *_predictions.json / *_eval.json layout to the predictions or evaluations table
+        """
+        if not records:
+            return
+        response_refs = self.put_blobs([record["api_response"] for record in records])
+        schema_refs = self.put_blobs([record["schema"] for record in records])
+        columns: dict[str, list[Any]] = {field.name: [] for field in RECORD_SCHEMA}
+        for record, response_ref, schema_ref in zip(records, response_refs, schema_refs):
+            metrics = record.get("metrics") or {}
+            for name in columns:
+                if name == "response_ref":
+                    columns[name].append(response_ref)
+                elif name == "schema_ref":
+                    columns[name].append(schema_ref)
+                elif name == "model_short_name":
+                    columns[name].append(record["model"].split("/")[-1])
+                elif name in JSON_COLUMNS:
+                    columns[name].append(json.dumps(record.get(name), default=str))
+                elif name == "exact_match_metric" or name in METRIC_COLUMNS:
+                    value = metrics.get(name)
+                    columns[name].append(value if name == "exact_match_metric" or value is None else bool(value))
+                else:
+                    columns[name].append(record.get(name))
+        self._write(table, pa.table(columns, schema=RECORD_SCHEMA))
+
+    def read_table(self, table: str, filter: Any = None, columns: list[str] | None = None) -> pa.Table:
+        """
+        Read the predictions or evaluations table, pushing the filter expression down to the Parquet files.
+        e.g. store.read_table("evaluations", filter=cell_filter(model_short_name="gpt-4o", setup_type="code_generation"))
+        """
+        return self._dataset(table).to_table(filter=filter, columns=columns)
+
+    def read_records(self, table: str, filter: Any = None, resolve_refs: bool = False) -> list[dict[str, Any]]:
+        """
+        Read records back in the *_predictions.json / *_eval.json layout.
+        api_response and schema are only loaded from the blob table when resolve_refs is set.
+        """
+        records = []
+        rows = self.read_table(table, filter=filter).to_pylist()
+        if resolve_refs:
+            self.get_blobs([row[name] for row in rows for name in ("response_ref", "schema_ref")])
+        for row in rows:
+            record = {name: row[name] for name in ("endpoint", "setup_type", "model", "uid", "question", "task",
+                                                    "task_type", "response_ref", "schema_ref")}
+            for name in JSON_COLUMNS:
+                record[name] = json.loads(row[name])
+            record["metrics"] = {"exact_match_metric": row["exact_match_metric"]}
+            record["metrics"].update({metric: row[metric] for metric in METRIC_COLUMNS})
+            if resolve_refs:
+                record["api_response"] = self.get_blob(row["response_ref"])
+                record["schema"] = self.get_blob(row["schema_ref"])
+            records.append(record)
+        return records
+
+
+def cell_filter(**columns: str) -> Any:
+    """
+    Build an equality filter expression, e.g. cell_filter(endpoint=..., model_short_name=..., setup_type=...)
+    """
+    expression = None
+    for name, value in columns.items():
+        condition = pc.field(name) == value
+        expression = condition if expression is None else expression & condition
+    return expression
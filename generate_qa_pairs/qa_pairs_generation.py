@@ -1,6 +1,8 @@
 import os
 import re
 import json
+from itertools import groupby
+from operator import itemgetter
 
 from generate_qa_pairs.task_list import (
     BookingGetRoomListWithAvailability,
@@ -26,9 +28,10 @@ def generate_qa_pairs(task_lists, directory_path: str):
 
     for task_list in task_lists:
         i = 0
-        for app, endpoint_info in task_list.api_response.items():
+        # Stream the responses one query at a time, grouped the same way as the file layout
+        for app, app_responses in groupby(task_list.iter_api_responses(), key=itemgetter(0)):
             all_qa_pairs = []
-            for endpoint, query_info in endpoint_info.items():
+            for endpoint, query_info in groupby(app_responses, key=itemgetter(1)):
                 try:
                     if "/" in endpoint:
                         schema_path = "schemas/" + app + "_" + endpoint.replace("/", "_") + "_schema.txt"
@@ -38,7 +41,7 @@ def generate_qa_pairs(task_lists, directory_path: str):
                         file.write(task_list.response_json_schema)
                 except BaseException:
                     print("Schema does not exist for endpoint: " + app + " " + endpoint)
-                for query, api_response in query_info.items():
+                for _, _, query, api_response in query_info:
                     for task in task_list.task_list:
                         task_obj = task()  # type:ignore
                         qa_pairs = task_obj.get_qa_samples(api_response)
@@ -0,0 +1,268 @@
+import hashlib
+import json
+import mmap
+import os
+import re
+from typing import Any, BinaryIO, Iterator
+
+# The API response files are laid out as {app: {endpoint: {api_query: api_response}}}.
+# Responses live at nesting depth 3, everything above them is a plain JSON object.
+RESPONSE_DEPTH = 3
+CHUNK_SIZE = 1 << 20
+INDEX_SUFFIX = ".idx.json"
+# sidecars of another version are regenerated (2: hashes are get_response_ref of the decoded response)
+INDEX_VERSION = 2
+
+_STRUCTURAL = re.compile(rb'[{}\[\]":,]')
+_STRING_SPECIAL = re.compile(rb'["\\]')
+
+
+def get_response_ref(payload: Any) -> str:
+    """
+    Content hash of an api_response or schema (sha1 of its canonical JSON), the one response_ref of the
+    pipeline: index sidecars, blob directories and the results store
+    """
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def iter_response_spans(
+    f: BinaryIO, chunk_size: int = CHUNK_SIZE, capture: bool = False
+) -> Iterator[tuple[str, str, str, int, int, bytes | None]]:
+    """
+    Incrementally scan an API response file opened in binary mode and yield
+    (app, endpoint, api_query, offset, length, raw) for every response.
+    Only one chunk (plus the current response when capture is set) is held in memory.
+    """
+    keys: list[str] = []
+    depth = 0
+    state = "value"  # one of: key, colon, value, comma
+    in_string = False
+    skip_next = False
+    key_buf: bytearray | None = None
+    value_buf: bytearray | None = None
+    value_start = -1
+    value_is_scalar = False
+    base = 0
+
+    def emit(end: int) -> tuple[str, str, str, int, int, bytes | None]:
+        raw = bytes(value_buf[: end - value_start]) if capture else None
+        return keys[0], keys[1], keys[2], value_start, end - value_start, raw
+
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        n = len(chunk)
+        i = 0
+        if skip_next:
+            if key_buf is not None:
+                key_buf.extend(chunk[:1])
+            i = 1
+            skip_next = False
+        if value_buf is not None:
+            value_buf.extend(chunk)
+
+        while i < n:
+            if in_string:
+                m = _STRING_SPECIAL.search(chunk, i)
+                if m is None:
+                    if key_buf is not None:
+                        key_buf.extend(chunk[i:])
+                    break
+                j = m.start()
+                if chunk[j] == 0x5C:  # backslash, skip the escaped byte
+                    if key_buf is not None:
+                        key_buf.extend(chunk[i:j + 2])
+                    if j + 1 >= n:
+                        skip_next = True
+                    i = j + 2
+                    continue
+                in_string = False
+                if key_buf is not None:
+                    key_buf.extend(chunk[i:j])
+                    keys.append(json.loads(b'"' + bytes(key_buf) + b'"'))
+                    key_buf = None
+                    state = "colon"
+                elif depth == RESPONSE_DEPTH and state == "value":
+                    # the response itself is a string
+                    yield emit(base + j + 1)
+                    value_buf = None
+                    state = "comma"
+                i = j + 1
+                continue
+
+            m = _STRUCTURAL.search(chunk, i)
+            if m is None:
+                break
+            j = m.start()
+            c = chunk[j:j + 1]
+            i = j + 1
+
+            if depth > RESPONSE_DEPTH:
+                # inside a response: only track nesting and strings
+                if c == b'"':
+                    in_string = True
+                elif c in b"{[":
+                    depth += 1
+                elif c in b"}]":
+                    depth -= 1
+                    if depth == RESPONSE_DEPTH:
+                        yield emit(base + j + 1)
+                        value_buf = None
+                        state = "comma"
+                continue
+
+            if c == b'"':
+                in_string = True
+                if state == "key":
+                    key_buf = bytearray()
+                elif depth == RESPONSE_DEPTH and state == "value":
+                    value_start = base + j
+                    value_is_scalar = False
+                    value_buf = bytearray(chunk[j:]) if capture else None
+                else:
+                    raise ValueError(f"Unexpected string at byte {base + j}")
+            elif c == b":":
+                state = "value"
+                if depth == RESPONSE_DEPTH:
+                    # provisional start, overwritten for containers and strings
+                    value_start = base + j + 1
+                    value_is_scalar = True
+                    value_buf = bytearray(chunk[j + 1:]) if capture else None
+            elif c in b"{[":
+                if depth == RESPONSE_DEPTH and state == "value":
+                    value_start = base + j
+                    value_is_scalar = False
+                    value_buf = bytearray(chunk[j:]) if capture else None
+                elif c == b"[" or state != "value":
+                    raise ValueError(f"Expected an object at byte {base + j}")
+                else:
+                    state = "key"
+                depth += 1
+            elif c in b",}":
+                if depth == RESPONSE_DEPTH and state == "value" and value_is_scalar:
+                    # end of a number, boolean or null response
+                    yield emit(base + j)
+                    value_buf = None
+                    value_is_scalar = False
+                    state = "comma"
+                del keys[depth - 1:]
+                if c == b",":
+                    state = "key"
+                else:
+                    depth -= 1
+                    state = "comma"
+            else:
+                raise ValueError(f"Unexpected {c!r} at byte {base + j}")
+        base += n
+
+
+def iter_api_responses(api_response_fpath: str) -> Iterator[tuple[str, str, str, Any]]:
+    """
+    Stream (app, endpoint, api_query, api_response) tuples out of an API response file
+    without loading the whole document.
+    """
+    with open(api_response_fpath, "rb") as f:
+        for app, endpoint, api_query, _, _, raw in iter_response_spans(f, capture=True):
+            yield app, endpoint, api_query, json.loads(raw)
+
+
+def build_offset_index(api_response_fpath: str) -> dict[tuple[str, str, str], tuple[int, int]]:
+    """
+    Single pass over an API response file mapping (app, endpoint, api_query) to the
+    (offset, length) byte span of its response.
+    """
+    with open(api_response_fpath, "rb") as f:
+        return {
+            (app, endpoint, api_query): (offset, length)
+            for app, endpoint, api_query, offset, length, _ in iter_response_spans(f)
+        }
+
+
+_OFFSET_INDEXES: dict[str, tuple[int, int, dict[tuple[str, str, str], tuple[int, int, str]]]] = {}
+
+
+def index_path(api_response_fpath: str) -> str:
+    return api_response_fpath + INDEX_SUFFIX
+
+
+def write_index_sidecar(api_response_fpath: str) -> dict[tuple[str, str, str], tuple[int, int, str]]:
+    """
+    Build the offset index of an API response file and store it next to the file as
+    {app: {endpoint: {api_query: [offset, length, response_ref]}}} along with the source mtime and size.
+    """
+    stat = os.stat(api_response_fpath)
+    spans = build_offset_index(api_response_fpath)
+    index = {}
+    nested: dict[str, Any] = {}
+    with open(api_response_fpath, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for (app, endpoint, api_query), (offset, length) in spans.items():
+            digest = get_response_ref(json.loads(mm[offset:offset + length]))
+            index[(app, endpoint, api_query)] = (offset, length, digest)
+            nested.setdefault(app, {}).setdefault(endpoint, {})[api_query] = [offset, length, digest]
+
+    # written to a temporary file first, so that a reader (or a concurrent indexing of the same file)
+    # never sees a truncated sidecar
+    sidecar_path = index_path(api_response_fpath)
+    tmp_path = sidecar_path + f".{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": INDEX_VERSION, "source_mtime_ns": stat.st_mtime_ns, "source_size": stat.st_size,
+                   "responses": nested}, f)
+    os.replace(tmp_path, sidecar_path)
+    return index
+
+
+def read_offset_index(api_response_fpath: str) -> dict[tuple[str, str, str], tuple[int, int, str]]:
+    """
+    Return the (offset, length, response_ref) index of an API response file, (re)generating the
+    sidecar when it is missing, of another version, or the source file's mtime or size changed.
+    """
+    stat = os.stat(api_response_fpath)
+    cached = _OFFSET_INDEXES.get(api_response_fpath)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+
+    index = None
+    try:
+        with open(index_path(api_response_fpath), "r", encoding="utf-8") as f:
+            sidecar = json.load(f)
+        if (sidecar.get("version") == INDEX_VERSION and sidecar["source_mtime_ns"] == stat.st_mtime_ns
+                and sidecar["source_size"] == stat.st_size):
+            index = {
+                (app, endpoint, api_query): tuple(entry)
+                for app, endpoint_info in sidecar["responses"].items()
+                for endpoint, query_info in endpoint_info.items()
+                for api_query, entry in query_info.items()
+            }
+    except (OSError, ValueError, KeyError):
+        pass
+    if index is None:
+        index = write_index_sidecar(api_response_fpath)
+
+    _OFFSET_INDEXES[api_response_fpath] = (stat.st_mtime_ns, stat.st_size, index)
+    return index
+
+
+def load_api_response(
+    api_response_fpath: str, app: str, endpoint: str, api_query: str, verify: bool = False
+) -> Any:
+    """
+    Load a single response by slicing its byte span out of a memory map of the file
+    and decoding only that slice.
+    """
+    offset, length, digest = read_offset_index(api_response_fpath)[(app, endpoint, api_query)]
+    with open(api_response_fpath, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        raw = mm[offset:offset + length]
+    api_response = json.loads(raw)
+    if verify and get_response_ref(api_response) != digest:
+        raise ValueError(f"Stale index for {api_response_fpath}: hash mismatch for {api_query}")
+    return api_response
+
+
+if __name__ == "__main__":
+    # (Re)generate the index sidecars for every API response file
+    api_responses_dir = os.path.join(os.path.dirname(__file__), "data", "api_responses")
+    for file_name in sorted(os.listdir(api_responses_dir)):
+        if file_name.endswith(".json") and not file_name.endswith(INDEX_SUFFIX):
+            index = write_index_sidecar(os.path.join(api_responses_dir, file_name))
+            print(f"{file_name}: {len(index)} responses indexed")
@@ -0,0 +1,198 @@
+import json
+import os
+import random
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Type
+
+from generate_qa_pairs import task_list
+from generate_qa_pairs.response_reader import iter_api_responses, write_index_sidecar
+
+ITEM_PATH = "[]"
+DEFAULT_ITEMS = 3
+
+# (app, endpoint) of the responses each task list is built for, as laid out in data/api_responses
+ENDPOINTS: dict[Type[task_list.TaskList], tuple[str, str]] = {
+    task_list.BookingGetRoomListWithAvailability: ("booking-com15.p.rapidapi.com", "Get_Room_List_With_Availability"),
+    task_list.BookingSearchHotelByCoordinatesTaskList: ("booking-com15.p.rapidapi.com", "Search_Hotels_By_Coordinates"),
+    task_list.BookingSearchCarRentalsTaskList: ("booking-com15.p.rapidapi.com", "Search_Car_Rentals"),
+    task_list.BookingGetSeatMapTaskList: ("booking-com15.p.rapidapi.com", "Get_Seat_Map"),
+    task_list.SECFilingsTaskList: ("last10k-company-v1.p.rapidapi.com", "v1_company_filings"),
+    task_list.ProductDetailsShoesTaskList: ("real-time-product-search.p.rapidapi.com", "search?"),
+}
+
+_ID_KEY = re.compile(r"(^id$|_id$|[a-z]Id$|[Nn]umber$|^uid$)")
+_WORDS = ["alpha", "bravo", "delta", "echo", "lima", "nova", "orion", "pulse", "quartz", "sierra",
+          "terra", "ultra", "vega", "zen", "classic", "sport", "premium", "standard", "deluxe", "basic"]
+
+
+def collect_template_stats(template: Any) -> tuple[dict[tuple, list[Any]], dict[tuple, list[int]]]:
+    """
+    Leaf values and array lengths of a real response, keyed by path (dict keys, with "[]" for array items)
+    """
+    values: dict[tuple, list[Any]] = defaultdict(list)
+    lengths: dict[tuple, list[int]] = defaultdict(list)
+
+    def walk(obj: Any, path: tuple) -> None:
+        if isinstance(obj, dict):
+            for key, value in obj.items():
+                walk(value, path + (key,))
+        elif isinstance(obj, list):
+            lengths[path].append(len(obj))
+            for item in obj:
+                walk(item, path + (ITEM_PATH,))
+        else:
+            values[path].append(obj)
+
+    walk(template, ())
+    return values, lengths
+
+
+class SyntheticResponseGenerator:
+    """
+    Build API responses following a response_json_schema of task_list.py.
+    Every outermost array gets scale times as many items as the same array of the template response
+    (a real response of the endpoint), or DEFAULT_ITEMS when there is none; nested arrays are multiplied
+    by nested_scale instead. item_counts fixes the length of given arrays by path, e.g.
+    {"data.attributes.result": 5000}. Leaf values are drawn from the template values at the same path,
+    except id-like keys which are always unique; other generated free-text strings are string_length
+    characters long when it is set.
+    """
+
+    def __init__(self, schema: dict[str, Any] | str, seed: int = 1, scale: float = 1.0, template: Any = None,
+                 nested_scale: float = 1.0, item_counts: dict[str, int] | None = None,
+                 string_length: int | None = None) -> None:
+        self.schema = json.loads(schema) if isinstance(schema, str) else schema
+        self.scale = scale
+        self.nested_scale = nested_scale
+        self.item_counts = item_counts or {}
+        self.string_length = string_length
+        self.rng = random.Random(seed)
+        self.values, self.lengths = collect_template_stats(template) if template is not None else ({}, {})
+        self._counter = 0
+
+    def generate(self) -> Any:
+        return self.generate_value(self.schema, ())
+
+    def generate_value(self, schema: dict[str, Any], path: tuple) -> Any:
+        schema_type = schema.get("type")
+        if isinstance(schema_type, list):
+            schema_type = next((t for t in schema_type if t != "null"), "null")
+        if schema_type is None:
+            schema_type = "object" if "properties" in schema else "array" if "items" in schema else "string"
+        if "enum" in schema:
+            return self.rng.choice(schema["enum"])
+
+        if schema_type == "object":
+            return {key: self.generate_value(value, path + (key,))
+                    for key, value in schema.get("properties", {}).items()}
+        if schema_type == "array":
+            return [self.generate_value(schema.get("items", {}), path + (ITEM_PATH,))
+                    for _ in range(self.item_count(path))]
+        return self.generate_leaf(schema_type, path)
+
+    def item_count(self, path: tuple) -> int:
+        dotted_path = ".".join(path)
+        if dotted_path in self.item_counts:
+            return self.item_counts[dotted_path]
+        lengths = self.lengths.get(path)
+        base = sum(lengths) / len(lengths) if lengths else DEFAULT_ITEMS
+        if ITEM_PATH in path:
+            # scale only applies to the outermost arrays, so that the response size grows linearly with it
+            return max(1, round(base * self.nested_scale))
+        return max(1, round(base * self.scale))
+
+    def generate_leaf(self, schema_type: str, path: tuple) -> Any:
+        key = next((part for part in reversed(path) if part != ITEM_PATH), "")
+        if _ID_KEY.search(key):
+            self._counter += 1
+            return f"{key}-{self._counter:08d}" if schema_type == "string" else self._counter
+        pool = [value for value in self.values.get(path, []) if value is not None]
+        if pool:
+            return self.rng.choice(pool)
+        if schema_type == "boolean":
+            return self.rng.random() < 0.5
+        if schema_type in ("number", "integer"):
+            if schema_type == "integer" or re.search(r"count|nr_|num|total", key, re.IGNORECASE):
+                return self.rng.randint(0, 20)
+            return round(self.rng.uniform(0, 1000), 2)
+        if schema_type == "null":
+            return None
+        return self.generate_string(key)
+
+    def generate_string(self, key: str) -> str:
+        lower_key = key.lower()
+        if "date" in lower_key or lower_key.endswith("time"):
+            date = datetime(2000, 1, 1) + timedelta(seconds=self.rng.randrange(25 * 365 * 24 * 3600))
+            return date.strftime("%Y-%m-%dT%H:%M:%S")
+        if "url" in lower_key or "link" in lower_key:
+            return f"https://example.com/{key}/{self.rng.randrange(10 ** 6)}"
+        if "price" in lower_key or "cost" in lower_key or "amount" in lower_key:
+            return f"${self.rng.uniform(1, 5000):,.2f}"
+        if self.string_length is None:
+            return " ".join(self.rng.choice(_WORDS) for _ in range(self.rng.randint(1, 4)))
+        words = []
+        while sum(len(word) + 1 for word in words) < self.string_length:
+            words.append(self.rng.choice(_WORDS))
+        return " ".join(words)[:self.string_length]
+
+
+def load_template(api_response_fpath: str) -> Any:
+    # first real response of the endpoint, None when the file is not part of the checkout
+    if not os.path.exists(api_response_fpath):
+        return None
+    return next(iter_api_responses(api_response_fpath))[3]
+
+
+def write_synthetic_responses(output_dir: str, task_list_cls: Type[task_list.TaskList], num_queries: int = 1,
+                              seed: int = 1, template: Any = None, **generator_kwargs: Any) -> str:
+    """
+    Write num_queries synthetic responses of a task list endpoint to output_dir/api_responses in the
+    {app: {endpoint: {api_query: api_response}}} layout (one response in memory at a time), with the
+    schema under output_dir/schemas and the offset index sidecar, so that output_dir can be used as
+    the data directory of the pipeline. Returns the path of the response file.
+    """
+    app, endpoint = ENDPOINTS[task_list_cls]
+    generator = SyntheticResponseGenerator(task_list_cls.response_json_schema, seed=seed, template=template,
+                                           **generator_kwargs)
+    api_response_fpath = os.path.join(output_dir, "api_responses", f"{app}_{endpoint}.json")
+    schema_fpath = os.path.join(output_dir, "schemas", f"{app}_{endpoint.replace('/', '_')}_schema.txt")
+    os.makedirs(os.path.dirname(api_response_fpath), exist_ok=True)
+    os.makedirs(os.path.dirname(schema_fpath), exist_ok=True)
+    with open(schema_fpath, "w") as f:
+        f.write(task_list_cls.response_json_schema)
+
+    with open(api_response_fpath, "w", encoding="utf-8") as f:
+        f.write(f"{{{json.dumps(app)}: {{{json.dumps(endpoint)}: {{")
+        for i in range(num_queries):
+            api_query = json.dumps({"synthetic_seed": seed, "index": i})
+            f.write((", " if i else "") + f"{json.dumps(api_query)}: {json.dumps(generator.generate())}")
+        f.write("}}}")
+    write_index_sidecar(api_response_fpath)
+    return api_response_fpath
+
+
+if __name__ == "__main__":
+    # Synthetic copies of every endpoint at each scale, under data/synthetic/x<scale>/ with the same
+    # layout as data/ (api_responses, schemas, and qa_pairs when generate_qa is set)
+    data_dir = os.path.join(os.path.dirname(__file__), "data")
+    scales = [10, 100, 1000]
+    num_queries = 2
+    seed = 1
+    # QA generation of the SEC tasks is quadratic in the number of filings, expect hours at 1000x
+    generate_qa = False
+
+    for scale in scales:
+        output_dir = os.path.join(data_dir, "synthetic", f"x{scale}")
+        synthetic_task_lists = []
+        for task_list_cls, (app, endpoint) in ENDPOINTS.items():
+            template = load_template(os.path.join(data_dir, "api_responses", f"{app}_{endpoint}.json"))
+            api_response_fpath = write_synthetic_responses(output_dir, task_list_cls, num_queries=num_queries,
+                                                           seed=seed, template=template, scale=scale)
+            print(f"{api_response_fpath}: {os.path.getsize(api_response_fpath) / 2 ** 20:.1f} MB")
+            synthetic_task_lists.append(task_list_cls(api_response_fpath))
+        if generate_qa:
+            from generate_qa_pairs.qa_pairs_generation import generate_qa_pairs
+            os.makedirs(os.path.join(output_dir, "qa_pairs"), exist_ok=True)
+            generate_qa_pairs(synthetic_task_lists, f"data/synthetic/x{scale}/qa_pairs")
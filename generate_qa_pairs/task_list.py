@@ -1,6 +1,8 @@
 import json
-from typing import Any, Type
+from functools import cached_property
+from typing import Any, Iterator, Type
 
+from generate_qa_pairs.response_reader import iter_api_responses
 from generate_qa_pairs.tasks import (
     base,
     booking_get_seat_map,
@@ -16,16 +18,25 @@ class TaskList:
     def __init__(self, api_response_fpath: str) -> None:
         self._api_response_fpath = api_response_fpath
 
-        self.api_response = self.read_api_response()
         self.task_list = self.init_task_list()
 
     def init_task_list(self) -> list[Type[base.Task]]:
         raise NotImplementedError
 
+    @cached_property
+    def api_response(self) -> Any:
+        return self.read_api_response()
+
     def read_api_response(self) -> Any:
         with open(self._api_response_fpath, "r") as f:
             return json.load(f)
 
+    def iter_api_responses(self) -> Iterator[tuple[str, str, str, Any]]:
+        """
+        Stream (app, endpoint, api_query, api_response) tuples without loading the whole file
+        """
+        return iter_api_responses(self._api_response_fpath)
+
 
 
 class BookingGetRoomListWithAvailability(TaskList):
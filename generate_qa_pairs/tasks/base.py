@@ -7,11 +7,12 @@ from generate_qa_pairs.tasks import evals
 
 from generate_qa_pairs.tasks.data_structures import LongResponseQASample, TaskAttributes
 
+COMMON_EVALUATION_METRICS = ["contains", "code_exec_passed"]
+
 
 class Task(ABC):
 
     EVALUATION_CRITERIA: list[Any] = []
-    EVALUATION_METRICS: dict[Any] = {}
     TASK_ATTRIBUTES: list[TaskAttributes] = []
 
     @abstractmethod
@@ -24,27 +25,25 @@ class Task(ABC):
         raise NotImplementedError
 
 
+    def get_metric_names(self) -> list[str]:
+        """
+        Names of the registered metrics evaluated for this task: the first of the EVALUATION_CRITERIA,
+        followed by the metrics common to every task
+        """
+        assert len(self.EVALUATION_CRITERIA) > 0, "Evaluation criteria not set for task"
+        return [evals.get_metric(self.EVALUATION_CRITERIA[0]).name] + COMMON_EVALUATION_METRICS
+
     def evaluate_task(self, qa_task: LongResponseQASample) -> dict:
         """
         Evaluate the task results using the gold and predicted answers.
         The EVALUATION_CRITERIA variable defines the list of evaluation metrics
         """
-        assert len(self.EVALUATION_CRITERIA) > 0, "Evaluation criteria not set for task"
-        self.EVALUATION_METRICS = {}
-
-        if self.EVALUATION_CRITERIA[0] is evals.accuracy_string:
-            self.EVALUATION_METRICS["accuracy_string"] = evals.accuracy_string
-        if self.EVALUATION_CRITERIA[0] is evals.unordered_list_str_match:
-            self.EVALUATION_METRICS["unordered_list_str_match"] = evals.unordered_list_str_match
-        if self.EVALUATION_CRITERIA[0] is evals.approx_number_match:
-            self.EVALUATION_METRICS["approx_number_match"] = evals.approx_number_match
-
-        self.EVALUATION_METRICS["contains"] = evals.contains
-        self.EVALUATION_METRICS["code_exec_Passed"] = evals.code_exec_Passed
-
-        eval_metrics = {
-            eval_type: eval_criteria(qa_task) for eval_type,eval_criteria in self.EVALUATION_METRICS.items()
+        return {
+            name: evals.get_metric(name).func(qa_task) for name in self.get_metric_names()
         }
 
-        return eval_metrics
-
+    def evaluate_tasks(self, qa_tasks: list[LongResponseQASample]) -> dict[str, np.ndarray]:
+        """
+        Evaluate a list of samples of this task at once, one array of results per metric
+        """
+        return evals.evaluate_batch(self.get_metric_names(), qa_tasks)
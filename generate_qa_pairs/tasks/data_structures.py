@@ -22,3 +22,179 @@ class LongResponseQASample:
     task: str = None
     task_type: Union[list[TaskAttributes], None] = None
     uid: str = None
+    response_ref: str = None  # content hash of api_response, when known
+
+
+# fields of LongResponseQASample stored as one list each in a QABatch; api_response and schema are
+# stored once per distinct value and referenced by index
+QA_COLUMNS = ("question", "gold_answer", "pred_answer", "model_output", "code_exec_status", "metrics", "task",
+              "task_type", "uid", "response_ref")
+
+
+def _column_property(name: str) -> property:
+    def get(row: "QARow") -> Any:
+        return getattr(row.batch, name)[row.index]
+
+    def set_column(row: "QARow", value: Any) -> None:
+        getattr(row.batch, name)[row.index] = value
+
+    return property(get, set_column)
+
+
+class QARow:
+    """
+    View of one row of a QABatch, with the attributes of a LongResponseQASample read from and written
+    to the columns. Pickled as the LongResponseQASample of the row, so that a row sent to a pool worker
+    does not carry the whole batch.
+    """
+    __slots__ = ("batch", "index")
+
+    def __init__(self, batch: "QABatch", index: int) -> None:
+        self.batch = batch
+        self.index = index
+
+    @property
+    def api_response(self) -> Any:
+        return self.batch.responses[self.batch.response_idx[self.index]]
+
+    @api_response.setter
+    def api_response(self, value: Any) -> None:
+        self.batch.response_idx[self.index] = self.batch.add_response(value, None)
+
+    @property
+    def schema(self) -> str:
+        return self.batch.schemas[self.batch.schema_idx[self.index]]
+
+    @schema.setter
+    def schema(self, value: str) -> None:
+        self.batch.schema_idx[self.index] = self.batch.add_schema(value)
+
+    def to_sample(self) -> LongResponseQASample:
+        return LongResponseQASample(api_response=self.api_response, schema=self.schema,
+                                    **{name: getattr(self, name) for name in QA_COLUMNS})
+
+    def __reduce__(self):
+        return self.to_sample().__reduce__()
+
+    def __repr__(self) -> str:
+        return f"QARow(index={self.index}, uid={self.uid!r}, question={self.question!r})"
+
+
+for _name in QA_COLUMNS:
+    setattr(QARow, _name, _column_property(_name))
+
+
+class QABatch:
+    """
+    Struct-of-arrays counterpart of a list of LongResponseQASample: one list per field, and every
+    distinct api_response (by response_ref, or by object when there is none) and schema stored once.
+    Indexing and iterating give QARow views, usable wherever a LongResponseQASample is expected.
+    """
+
+    def __init__(self) -> None:
+        for name in QA_COLUMNS:
+            setattr(self, name, [])
+        self.response_idx: list[int] = []
+        self.schema_idx: list[int] = []
+        self.responses: list[Any] = []
+        self.schemas: list[str] = []
+        self._response_keys: dict[Any, int] = {}
+        self._schema_keys: dict[str, int] = {}
+
+    def add_response(self, api_response: Any, response_ref: str | None) -> int:
+        # the responses are kept in self.responses, so the id of an unreferenced one is not reused
+        key = response_ref if response_ref is not None else ("id", id(api_response))
+        if key not in self._response_keys:
+            self._response_keys[key] = len(self.responses)
+            self.responses.append(api_response)
+        return self._response_keys[key]
+
+    def add_schema(self, schema: str) -> int:
+        if schema not in self._schema_keys:
+            self._schema_keys[schema] = len(self.schemas)
+            self.schemas.append(schema)
+        return self._schema_keys[schema]
+
+    def append(self, api_response: Any, question: str, gold_answer: Any, schema: str = '',
+               response_ref: str = None, **fields: Any) -> QARow:
+        values = dict(fields, question=question, gold_answer=gold_answer, response_ref=response_ref)
+        for name in QA_COLUMNS:
+            getattr(self, name).append(values.get(name))
+        self.response_idx.append(self.add_response(api_response, response_ref))
+        self.schema_idx.append(self.add_schema(schema))
+        return QARow(self, len(self.uid) - 1)
+
+    @classmethod
+    def from_samples(cls, samples: list[LongResponseQASample]) -> "QABatch":
+        batch = cls()
+        for sample in samples:
+            batch.append(sample.api_response, schema=sample.schema,
+                         **{name: getattr(sample, name) for name in QA_COLUMNS})
+        return batch
+
+    @classmethod
+    def from_records(cls, records: list[dict], blob_dir: str | None = None) -> "QABatch":
+        """
+        Batch of prediction records, read like convert_dict_to_list_of_objects: metrics holds the
+        exact_match_metric name, and response_ref / schema_ref are resolved from blob_dir
+        """
+        from generate_qa_pairs.tasks.utils import read_response_blob
+
+        batch = cls()
+        for record in records:
+            response_ref = record.get("response_ref")
+            if "api_response" in record:
+                api_response = record["api_response"]
+            elif response_ref in batch._response_keys:
+                api_response = None
+            else:
+                api_response = read_response_blob(blob_dir, response_ref)
+            if "schema" in record:
+                schema = record["schema"]
+            else:
+                schema = read_response_blob(blob_dir, record["schema_ref"])
+            batch.append(api_response,
+                         question=record["question"],
+                         gold_answer=record["gold_answer"],
+                         schema=schema,
+                         response_ref=response_ref,
+                         pred_answer=record["predicted_answer"],
+                         model_output=record["model_output"],
+                         code_exec_status=record["code_exec_status"],
+                         metrics=record["metrics"]["exact_match_metric"],
+                         task=record["task"],
+                         task_type=record["task_type"],
+                         uid=record["uid"])
+        return batch
+
+    def to_records(self, **constants: Any) -> list[dict]:
+        """
+        Prediction records of the batch, each starting with the given constant fields
+        (endpoint, setup_type, model); the records of one response share its object
+        """
+        return [dict(constants,
+                     uid=self.uid[i],
+                     api_response=self.responses[self.response_idx[i]],
+                     question=self.question[i],
+                     gold_answer=self.gold_answer[i],
+                     schema=self.schemas[self.schema_idx[i]],
+                     task=self.task[i],
+                     task_type=self.task_type[i],
+                     predicted_answer=self.pred_answer[i],
+                     code_exec_status=self.code_exec_status[i],
+                     model_output=self.model_output[i],
+                     metrics=self.metrics[i])
+                for i in range(len(self))]
+
+    def __len__(self) -> int:
+        return len(self.uid)
+
+    def __getitem__(self, index: int) -> QARow:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return QARow(self, index)
+
+    def __iter__(self):
+        return (QARow(self, i) for i in range(len(self)))
@@ -1,13 +1,91 @@
 import re
-from typing import Any
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Callable
 
+import numpy as np
 from generate_qa_pairs.tasks.utils import generate
 from sentence_transformers import SentenceTransformer, util
 from pint import UnitRegistry
 
 from generate_qa_pairs.tasks.data_structures import LongResponseQASample
+from generate_qa_pairs.tasks.tracing import span
 
 
+@dataclass
+class Metric:
+    """
+    A metric evaluated per sample by func. batch_func, when set, evaluates a whole list of samples
+    at once (list of samples in, array of results out) for the default metric parameters.
+    """
+    name: str
+    func: Callable[..., Any]
+    batch_func: Callable[[list[LongResponseQASample]], np.ndarray] | None = None
+
+    def evaluate_batch(self, tasks: list[LongResponseQASample], **kwargs: Any) -> np.ndarray:
+        with span(f"metric.{self.name}", samples=len(tasks)):
+            if self.batch_func is not None and not kwargs:
+                return self.batch_func(tasks)
+            return np.array([self.func(task, **kwargs) for task in tasks], dtype=object)
+
+
+METRIC_REGISTRY: dict[str, Metric] = {}
+
+
+def register_metric(name: str | None = None) -> Callable:
+    """
+    Decorator registering a per-sample metric, under the function name by default.
+    Metrics defined outside this module are registered the same way.
+    """
+    def decorator(func: Callable) -> Callable:
+        metric_name = name or func.__name__
+        METRIC_REGISTRY[metric_name] = Metric(metric_name, func)
+        return func
+    return decorator
+
+
+def register_batch(name: str) -> Callable:
+    """
+    Decorator registering the batch implementation of an already registered metric
+    """
+    def decorator(batch_func: Callable) -> Callable:
+        METRIC_REGISTRY[name].batch_func = batch_func
+        return batch_func
+    return decorator
+
+
+def get_metric(metric: str | Callable) -> Metric:
+    # metrics can be looked up by name or by their per-sample function (as in EVALUATION_CRITERIA)
+    if isinstance(metric, str):
+        return METRIC_REGISTRY[metric]
+    for registered in METRIC_REGISTRY.values():
+        if registered.func is metric:
+            return registered
+    raise KeyError(f"Metric {metric} is not registered")
+
+
+def evaluate_batch(metric_names: list[str], tasks: list[LongResponseQASample]) -> dict[str, np.ndarray]:
+    """
+    Evaluate several metrics over a whole list of samples, dispatching once per metric.
+    Metrics are evaluated in order, as some (unordered_list_str_match) normalize the predicted answer in place.
+    """
+    return {name: get_metric(name).evaluate_batch(tasks) for name in metric_names}
+
+
+def _normalized_answers(tasks: list[LongResponseQASample]) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Stripped, lower-cased gold and predicted answers as numpy string arrays, whether the predicted answer
+    ends with "." and whether both answers are strings
+    """
+    valid = np.array([isinstance(task.gold_answer, str) and isinstance(task.pred_answer, str) for task in tasks], dtype=bool)
+    gold = np.array([task.gold_answer if is_valid else "" for task, is_valid in zip(tasks, valid)], dtype=str)
+    pred = np.array([task.pred_answer if is_valid else "" for task, is_valid in zip(tasks, valid)], dtype=str)
+    gold = np.char.lower(np.char.strip(gold))
+    pred = np.char.lower(np.char.strip(pred))
+    return gold, pred, np.char.endswith(pred, "."), valid
+
+
+@register_metric()
 def accuracy_string(task: LongResponseQASample, normalize: bool = True) -> bool:
     if not isinstance(task.gold_answer, str) or not isinstance(task.pred_answer, str):
         return False
@@ -25,6 +103,50 @@ def accuracy_string(task: LongResponseQASample, normalize: bool = True) -> bool:
     return (gold_ans == pred_ans)
 
 
+@register_batch("accuracy_string")
+def accuracy_string_batch(tasks: list[LongResponseQASample]) -> np.ndarray:
+    if not tasks:
+        return np.zeros(0, dtype=bool)
+    gold, pred, ends_with_dot, valid = _normalized_answers(tasks)
+    # the trailing "." of the predicted answer is ignored
+    return valid & ((gold == pred) & ~ends_with_dot | ends_with_dot & (np.char.add(gold, ".") == pred))
+
+
+# Numbers with thousands separators ("1,234.5") are tried first, as a whole; currency symbols and
+# units around a number are simply not matched. Group 1 is the unsigned value, as in the original
+# findall based matcher.
+_PRED_NUMBER_PATTERN = re.compile(
+    r"[-+]?(\d{1,3}(?:,\d{3})+(?:\.\d*)?|\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?"
+)
+_GOLD_NUMBER_PATTERN = re.compile(
+    r"[-+]?(?:\d{1,3}(?:,\d{3})+(?:\.\d*)?|\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?"
+)
+
+
+@lru_cache(maxsize=4096)
+def _parse_gold_number(gold_answer: str) -> tuple[str, float] | None:
+    match = _GOLD_NUMBER_PATTERN.search(gold_answer)
+    if match is None:
+        return None
+    gold_ans = match.group(0).replace(",", "")
+    return gold_ans, float(gold_ans)
+
+
+def _iter_pred_numbers(pred_answer: str):
+    """
+    Lazily yield the numbers of the predicted answer as strings. A number with thousands separators
+    is yielded as a whole and then as its comma separated parts, in case it was a list of numbers.
+    """
+    for match in _PRED_NUMBER_PATTERN.finditer(pred_answer):
+        pred_ans = match.group(1)
+        if "," in pred_ans:
+            yield pred_ans.replace(",", "")
+            yield from pred_ans.split(",")
+        else:
+            yield pred_ans
+
+
+@register_metric()
 def approx_number_match(task: LongResponseQASample, rounding: bool = True) -> bool:
     """We expect the gold answer to be a single number, but the model output can have multiple numbers.
     The match will return True if any of the numbers from the predicted answer matches the gold answer, with or without rounding.
@@ -44,18 +166,15 @@ def approx_number_match(task: LongResponseQASample, rounding: bool = True) -> bo
     if not isinstance(task.gold_answer, str) or not isinstance(task.pred_answer, str):
         return False
 
-    pred_answers = re.findall(
-        r"[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?", task.pred_answer
-    )
-    # if the task.pred_answer is "USD 1.8 is greater than 1.65", the pred_answers is [('1.8', '.8', ''), ('1.65', '.65', '')]
-    for pred_ans_matches in pred_answers:
-        pred_ans: str = pred_ans_matches[0]
-        gold_answer = task.gold_answer.strip()
-        gold_ans = (re.findall(
-            r"[-+]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?", task.gold_answer
-        ))[0]
+    gold = _parse_gold_number(task.gold_answer)
+    if gold is None:
+        return False  # no number in the gold answer
+    gold_ans, gold_value = gold
+
+    # if the task.pred_answer is "USD 1.8 is greater than 1.65", the numbers are '1.8' and '1.65'
+    for pred_ans in _iter_pred_numbers(task.pred_answer):
         if rounding:
-            if abs(float(pred_ans) - float(gold_ans)) < 1:
+            if abs(float(pred_ans) - gold_value) < 1:
                 return True
         else:
             return (pred_ans == gold_ans)
@@ -63,6 +182,7 @@ def approx_number_match(task: LongResponseQASample, rounding: bool = True) -> bo
     return False  # no number was found in the predicted answer
 
 
+@register_metric()
 def unordered_list_str_match(
         task: LongResponseQASample, normalize: bool = True, deduplicate: bool = True
 ) -> bool:
@@ -116,6 +236,7 @@ def unordered_list_str_match(
         return (sorted(gold_ans_elements) == sorted(pred_ans_elements))
 
 
+@register_metric()
 def contains(task: LongResponseQASample, normalize: bool = True) -> bool:
     if not isinstance(task.gold_answer, str) or not isinstance(task.pred_answer, str):
         return False
@@ -133,6 +254,17 @@ def contains(task: LongResponseQASample, normalize: bool = True) -> bool:
     return (gold_ans in pred_ans)
 
 
+@register_batch("contains")
+def contains_batch(tasks: list[LongResponseQASample]) -> np.ndarray:
+    if not tasks:
+        return np.zeros(0, dtype=bool)
+    gold, pred, ends_with_dot, valid = _normalized_answers(tasks)
+    # the first occurrence has to end before the trailing "." of the predicted answer, if any
+    found_at = np.char.find(pred, gold)
+    found_end = found_at + np.char.str_len(gold)
+    return valid & (found_at >= 0) & (found_end <= np.char.str_len(pred) - ends_with_dot)
+
+
 def response_length(task: LongResponseQASample, normalize: bool = True) -> tuple:
     if not isinstance(task.pred_answer, str):
         return (len(task.gold_answer), 0)
@@ -170,6 +302,7 @@ def check_data_type(task: LongResponseQASample, normalize: bool = True) -> bool:
     return True
 
 
+@register_metric()
 def code_exec_passed(task: LongResponseQASample, normalize: bool = True) -> bool or None:
     if task.code_exec_status == "Code execution error":
         return False
@@ -190,10 +323,19 @@ def normalize_text(text):
     return ' '.join(deduped)
 
 
+@lru_cache(maxsize=1)
+def get_unit_registry() -> UnitRegistry:
+    return UnitRegistry()
+
+
+@lru_cache(maxsize=1)
+def get_sentence_model() -> SentenceTransformer:
+    return SentenceTransformer('all-MiniLM-L6-v2')
+
+
 # Try to parse number + unit
 def try_parse_quantity(text):
-    ureg = UnitRegistry()
-    Q_ = ureg.Quantity
+    Q_ = get_unit_registry().Quantity
     try:
         match = re.search(r'([\d\.]+)\s*([a-zA-Z]+)', text)
         if match:
@@ -229,8 +371,6 @@ def get_all_json_values(json_obj):
 
 
 def check_direct_prompt_hallucination(task: LongResponseQASample, semantic_threshold=0.5, tolerance=0.01):
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-
     if task.pred_answer is not None:
         if task.gold_answer in task.pred_answer:
             return False
@@ -248,6 +388,7 @@ def check_direct_prompt_hallucination(task: LongResponseQASample, semantic_thres
         return False
 
     # Semantic similarity
+    model = get_sentence_model()
     emb_pred = model.encode(predicted, convert_to_tensor=True)
     emb_exp = model.encode(gold, convert_to_tensor=True)
     similarity = util.pytorch_cos_sim(emb_pred, emb_exp).item()
@@ -316,7 +457,7 @@ def check_codegen_hallucination(task: LongResponseQASample):
 def llm_as_a_judge(
         task: LongResponseQASample, eval_llm: Any, eval_model_name: str
 ) -> bool:
-    from codegen_scripts.code_generation_for_json_query import (
+    from codegen_scripts.general_code_generation import (
         EVAL_PROMPT_TEMPLATE,
     )
 
@@ -325,8 +466,11 @@ def llm_as_a_judge(
     )
 
     llm_as_a_judge_outputs = generate(
-        llm=eval_llm, model_name=eval_model_name, prompts=eval_prompt
+        llm=eval_llm, model_name=eval_model_name, prompts=[eval_prompt]
     )
+    if llm_as_a_judge_outputs[0] is None:
+        # not a verdict, so that it is not cached as False
+        raise RuntimeError("no output from the judge model")
     if llm_as_a_judge_outputs[0].strip().lower().startswith("true"):
         llm_as_a_judge_output = True
     else:
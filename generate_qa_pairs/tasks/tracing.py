@@ -0,0 +1,187 @@
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any
+
+# directory of the span files, set by enable_tracing; spawned processes inherit it from the environment
+TRACE_DIR_ENV = "QA_TRACE_DIR"
+# attributes a span is summarized by
+CELL_KEYS = ("model", "setup", "endpoint")
+
+_trace_dir: str | None = os.getenv(TRACE_DIR_ENV)
+# finished spans of this process not yet written: (name, start_ns, duration_ns, thread id, attributes)
+_spans: list[tuple[str, int, int, int, dict[str, Any]]] = []
+# attributes added to every span of this process, see trace_context
+_context: dict[str, Any] = {}
+_spans_lock = threading.Lock()
+# a forked child writes its own spans only
+os.register_at_fork(after_in_child=_spans.clear)
+
+
+class _NoopSpan:
+    # returned by span() when tracing is disabled, so that a disabled span costs a call and a global lookup
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        return None
+
+    def set(self, **attributes: Any) -> None:
+        return None
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("name", "attributes", "start")
+
+    def __init__(self, name: str, attributes: dict[str, Any]) -> None:
+        self.name = name
+        self.attributes = attributes
+        self.start = 0
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type: Any, *exc_info: Any) -> None:
+        duration = time.perf_counter_ns() - self.start
+        attributes = {**_context, **self.attributes}
+        if exc_type is not None:
+            attributes["error"] = exc_type.__name__
+        with _spans_lock:
+            _spans.append((self.name, self.start, duration, threading.get_ident(), attributes))
+
+    def set(self, **attributes: Any) -> None:
+        # attributes only known inside the span, e.g. the size of an output
+        self.attributes.update(attributes)
+
+
+def span(name: str, **attributes: Any) -> Span | _NoopSpan:
+    """
+    Context manager timing a stage of the pipeline:
+
+        with span("llm_call", model=model_name):
+            ...
+
+    Spans are buffered in the process and written to the trace directory by flush_spans.
+    """
+    if _trace_dir is None:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+
+class trace_context:
+    """
+    Attributes (model, setup, endpoint) added to the spans of this process while the context is open
+    """
+
+    def __init__(self, **attributes: Any) -> None:
+        self.attributes = attributes
+        self._previous: dict[str, Any] = {}
+
+    def __enter__(self) -> "trace_context":
+        self._previous = dict(_context)
+        _context.update(self.attributes)
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        _context.clear()
+        _context.update(self._previous)
+
+
+def enable_tracing(trace_dir: str) -> None:
+    """
+    Record spans in this process and in the processes started after this call, replacing the spans
+    of a previous run in trace_dir
+    """
+    global _trace_dir
+    os.makedirs(trace_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(trace_dir, "spans-*.jsonl")):
+        os.remove(path)
+    _trace_dir = os.path.abspath(trace_dir)
+    os.environ[TRACE_DIR_ENV] = _trace_dir
+
+
+def flush_spans() -> None:
+    # pool workers call this after every task, as they exit without running atexit handlers
+    if _trace_dir is None or not _spans:
+        return
+    with _spans_lock:
+        spans = list(_spans)
+        _spans.clear()
+    pid = os.getpid()
+    with open(os.path.join(_trace_dir, f"spans-{pid}.jsonl"), "a", encoding="utf-8") as f:
+        for name, start, duration, tid, attributes in spans:
+            f.write(json.dumps({"name": name, "ts": start / 1000, "dur": duration / 1000, "pid": pid, "tid": tid,
+                                "args": attributes}, default=str) + "\n")
+
+
+def read_spans(trace_dir: str) -> list[dict[str, Any]]:
+    """
+    Spans of every process, sorted by start time. Spans without model, setup or endpoint (those of the
+    inference workers do not know their endpoint) take them from the "cell" span they started in, as
+    the cells of a grid run one after the other.
+    """
+    spans = []
+    for path in glob.glob(os.path.join(trace_dir, "spans-*.jsonl")):
+        with open(path, encoding="utf-8") as f:
+            spans.extend(json.loads(line) for line in f)
+    spans.sort(key=lambda s: s["ts"])
+    cells = [s for s in spans if s["name"] == "cell"]
+    cell_starts = [cell["ts"] for cell in cells]
+    for s in spans:
+        if all(key in s["args"] for key in CELL_KEYS):
+            continue
+        i = bisect.bisect_right(cell_starts, s["ts"]) - 1
+        if i >= 0 and s["ts"] <= cells[i]["ts"] + cells[i]["dur"]:
+            s["args"] = {**{key: cells[i]["args"].get(key) for key in CELL_KEYS}, **s["args"]}
+    return spans
+
+
+def summarize_spans(spans: list[dict[str, Any]]) -> dict[tuple, dict[str, dict[str, float]]]:
+    """
+    Per (model, setup, endpoint) and span name: count, total, mean and max duration in milliseconds
+    """
+    durations: dict[tuple, dict[str, list[float]]] = defaultdict(lambda: defaultdict(list))
+    for s in spans:
+        cell = tuple(s["args"].get(key) for key in CELL_KEYS)
+        durations[cell][s["name"]].append(s["dur"] / 1000)
+    return {cell: {name: {"count": len(values), "total_ms": sum(values), "mean_ms": sum(values) / len(values),
+                          "max_ms": max(values)}
+                   for name, values in names.items()}
+            for cell, names in durations.items()}
+
+
+def format_summary(summary: dict[tuple, dict[str, dict[str, float]]]) -> str:
+    lines = []
+    for cell in sorted(summary, key=lambda cell: tuple(str(value) for value in cell)):
+        lines.append(" / ".join(str(value) for value in cell))
+        lines.append(f"    {'span':32s} {'count':>7s} {'total s':>10s} {'mean ms':>10s} {'max ms':>10s}")
+        for name, stats in sorted(summary[cell].items(), key=lambda item: -item[1]["total_ms"]):
+            lines.append(f"    {name:32s} {stats['count']:7d} {stats['total_ms'] / 1000:10.2f} "
+                         f"{stats['mean_ms']:10.2f} {stats['max_ms']:10.2f}")
+    return "\n".join(lines)
+
+
+def export_trace(trace_dir: str | None = None) -> str:
+    """
+    Merge the spans of all the processes into trace.jsonl and trace.json (Chrome trace format, to open
+    in chrome://tracing or Perfetto) in the trace directory, and return the summary table
+    """
+    flush_spans()
+    trace_dir = trace_dir or _trace_dir
+    spans = read_spans(trace_dir)
+    with open(os.path.join(trace_dir, "trace.jsonl"), "w", encoding="utf-8") as f:
+        for s in spans:
+            f.write(json.dumps(s, default=str) + "\n")
+    with open(os.path.join(trace_dir, "trace.json"), "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": [{**s, "ph": "X", "cat": "qa"} for s in spans], "displayTimeUnit": "ms"}, f,
+                  default=str)
+    return format_summary(summarize_spans(spans))
@@ -1,18 +1,109 @@
+import importlib.util
 import json
 import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from typing import Any, Dict, List, Tuple, Union
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Tuple, Union
 import ast
 
+import httpx
 from genai.extensions.langchain.chat_llm import LangChainChatInterface
-from langchain_core.language_models import BaseLLM
-from langchain_ollama import OllamaLLM
+from ollama import Client
 from pydantic import SecretStr
 from transformers import AutoTokenizer
 
-from openai import OpenAI, AzureOpenAI
+from openai import OpenAI, AzureOpenAI, DefaultHttpxClient
 
+from generate_qa_pairs.response_reader import get_response_ref
 from .data_structures import LongResponseQASample
+from .tracing import span
+
+# seconds to wait before retrying a failed completion in generate()
+RETRY_SLEEP_SECONDS = 200
+MAX_RETRIES = 10
+
+# connection pool of the HTTP clients shared by the LLM calls of a process; HTTP/2 when h2 is installed
+HTTP_MAX_CONNECTIONS = 100
+HTTP_KEEPALIVE_SECONDS = 120
+HTTP2 = importlib.util.find_spec("h2") is not None
+
+# Ollama options for the llm_parameters of the experiments (greedy decoding is temperature 0)
+OLLAMA_OPTION_NAMES = {
+    "max_new_tokens": "num_predict",
+    "temperature": "temperature",
+    "top_p": "top_p",
+    "random_seed": "seed",
+    "stop_sequences": "stop",
+}
+
+# token counts of the completions made by this process, as reported by the provider
+token_usage: Counter = Counter()
+
+
+def record_usage(usage: Any) -> None:
+    """
+    Add the usage of an OpenAI-compatible completion to token_usage. cached_tokens (prompt tokens
+    served from the provider's prompt cache) is only counted for providers that report it.
+    """
+    if usage is None:
+        return
+    token_usage["requests"] += 1
+    token_usage["prompt_tokens"] += usage.prompt_tokens or 0
+    token_usage["completion_tokens"] += usage.completion_tokens or 0
+    cached_tokens = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None)
+    if cached_tokens is not None:
+        token_usage["requests_with_cached_tokens"] += 1
+        token_usage["cached_tokens"] += cached_tokens
+
+
+# HTTP requests sent by the shared clients of this process, and the connections they had to open
+connection_stats: Counter = Counter()
+
+# one client per (provider, endpoint, api_version) in a process, dropped in forked children since
+# their connections belong to the parent
+_llm_clients: dict[tuple[str, str, str], Any] = {}
+_llm_clients_lock = threading.Lock()
+os.register_at_fork(after_in_child=_llm_clients.clear)
+
+
+def _trace_connection(event_name: str, info: dict[str, Any]) -> None:
+    if event_name == "connection.connect_tcp.complete":
+        connection_stats["connections_opened"] += 1
+    elif event_name == "connection.start_tls.complete":
+        connection_stats["tls_handshakes"] += 1
+
+
+def _count_request(request: httpx.Request) -> None:
+    connection_stats["http_requests"] += 1
+    request.extensions["trace"] = _trace_connection
+
+
+def http_client_kwargs(max_connections: int = HTTP_MAX_CONNECTIONS) -> dict[str, Any]:
+    """
+    Arguments of the httpx clients of the LLM providers: a keep-alive pool of max_connections and
+    the hooks counting requests and new connections in connection_stats
+    """
+    return {
+        "limits": httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                               keepalive_expiry=HTTP_KEEPALIVE_SECONDS),
+        "http2": HTTP2,
+        "event_hooks": {"request": [_count_request]},
+    }
+
+
+def get_shared_client(provider: str, endpoint: str | None, api_version: str | None, create: Callable[[], Any]) -> Any:
+    key = (provider, endpoint or "", api_version or "")
+    with _llm_clients_lock:
+        if key not in _llm_clients:
+            _llm_clients[key] = create()
+            connection_stats["clients_created"] += 1
+        return _llm_clients[key]
+
 
 class LLM_Options(Enum):
     AUTO = (1,)
@@ -34,9 +125,78 @@ def get_lm(
             return get_lm_azure(model_id)
 
 
-def get_lm_local(model_id: str, parameters: Any) -> BaseLLM:
-    llm = OllamaLLM(model=model_id, **parameters)
-    return llm
+def code_block_complete(text: str) -> bool:
+    # the code generation prompts only use the first ```python block, whatever follows it is discarded
+    start = text.find("```python")
+    return start != -1 and "```" in text[start + 9:]
+
+
+class OllamaLM:
+    """
+    Model served by a local Ollama server (OLLAMA_HOST), through the shared client of the server with
+    num_parallel connections; the server should run with OLLAMA_NUM_PARALLEL set to the same value.
+    The model stays loaded for keep_alive after each request. Completions are streamed, so that they
+    can be cut as soon as stop_when returns True for the text generated so far.
+    """
+
+    def __init__(self, model_id: str, client: Client, options: dict[str, Any] | None = None,
+                 keep_alive: str | float = "30m", num_parallel: int = 4) -> None:
+        self.model_id = model_id
+        self.client = client
+        self.options = options or {}
+        self.keep_alive = keep_alive
+        self.num_parallel = num_parallel
+
+    def complete(self, prompt: str, stop_when: Callable[[str], bool] | None = None, **options: Any) -> str:
+        with span("llm_call", model=self.model_id):
+            stream = self.client.generate(model=self.model_id, prompt=prompt, options={**self.options, **options},
+                                          keep_alive=self.keep_alive, stream=True)
+            text = ""
+            num_chunks = 0
+            try:
+                for part in stream:
+                    text += part.response
+                    num_chunks += 1
+                    if part.done:
+                        record_usage(SimpleNamespace(prompt_tokens=part.prompt_eval_count, completion_tokens=part.eval_count))
+                    elif stop_when is not None and stop_when(text):
+                        # closing the stream aborts the generation on the server (and drops the connection from the
+                        # pool, a local reconnect being cheaper than the rest of the generation); one token per chunk
+                        token_usage["early_stops"] += 1
+                        record_usage(SimpleNamespace(prompt_tokens=None, completion_tokens=num_chunks))
+                        break
+            finally:
+                stream.close()
+        return text
+
+    def complete_with_retries(self, prompt: str, stop_when: Callable[[str], bool] | None = None, **options: Any) -> str:
+        # same retry policy as the Azure completions of generate(), raising after the last attempt
+        for num_retries in range(MAX_RETRIES + 1):
+            try:
+                return self.complete(prompt, stop_when, **options)
+            except Exception:
+                if num_retries == MAX_RETRIES:
+                    raise
+                import traceback
+                print("!! inside exception, sleeping", num_retries)
+                print(traceback.format_exc())
+                time.sleep(RETRY_SLEEP_SECONDS)
+
+    def complete_all(self, prompts: list[str], **options: Any) -> list[str]:
+        # num_parallel requests in flight, results in the order of the prompts
+        with ThreadPoolExecutor(max_workers=self.num_parallel) as executor:
+            return list(executor.map(lambda prompt: self.complete_with_retries(prompt, **options), prompts))
+
+
+def get_lm_local(model_id: str, parameters: Any) -> OllamaLM:
+    options = {OLLAMA_OPTION_NAMES[name]: value for name, value in (parameters or {}).items()
+               if name in OLLAMA_OPTION_NAMES and value not in (None, [])}
+    host = os.getenv("OLLAMA_HOST")
+    num_parallel = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+    client = get_shared_client("local", host, None, lambda: Client(
+        host=host, timeout=3600, **http_client_kwargs(max_connections=num_parallel)))
+    return OllamaLM(model_id, client, options, keep_alive=os.getenv("OLLAMA_KEEP_ALIVE", "30m"),
+                    num_parallel=num_parallel)
 
 
 
@@ -45,47 +205,57 @@ def get_lm_azure(model_id:str) -> AzureOpenAI:
     if "gpt" in model_id:
         api_version = "2024-08-01-preview"
     endpoint_url = os.getenv("AZURE_ENDPOINT").format(model_id=model_id.split("/")[1], api_version = api_version)
-    return AzureOpenAI(
+    return get_shared_client("azure", endpoint_url, api_version, lambda: AzureOpenAI(
         azure_endpoint=endpoint_url,
         api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-        api_version=api_version
-        )
+        api_version=api_version,
+        http_client=DefaultHttpxClient(**http_client_kwargs()),
+        ))
 
 
 def invoke_llm(llm_object: Any, prompt: str, model_id: str) -> Any:
     if isinstance(llm_object, LangChainChatInterface):
         try:
-            response = llm_object.invoke(prompt)
+            with span("llm_call", model=model_id):
+                response = llm_object.invoke(prompt)
         except BaseException as e:
             raise e
         return response.content
     elif isinstance(llm_object, OpenAI):
         try:
-            response = llm_object.chat.completions.create(
-                model=model_id,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0,
-                max_tokens=1000,
-                stop=["\nObservation"],
-            )
+            with span("llm_call", model=model_id):
+                response = llm_object.chat.completions.create(
+                    model=model_id,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0,
+                    max_tokens=1000,
+                    stop=["\nObservation"],
+                )
         except BaseException as e:
             raise e
+        record_usage(response.usage)
         return response.choices[0].message.content
+    elif isinstance(llm_object, OllamaLM):
+        return llm_object.complete_with_retries(prompt, stop_when=code_block_complete, temperature=0,
+                                                num_predict=1000, stop=["\nObservation"])
+
+
+MODEL_NAME_HF_MAP = {
+    "meta-llama/llama-3-1-70b-instruct": "meta-llama/llama-3.1-70b-instruct",
+    "mistralai/mixtral-8x22B-instruct-v0.1": "mistralai/Mixtral-8x22B-Instruct-v0.1",
+    "ibm-granite/granite-3.1-8b-instruct": "ibm-granite/granite-3.1-8b-instruct",
+    "deepseek-ai/DeepSeek-V3": "deepseek-ai/DeepSeek-V3",
+}
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model_name: str) -> Any:
+    # loaded once per process
+    return AutoTokenizer.from_pretrained(MODEL_NAME_HF_MAP[model_name], token=os.getenv("HF_TOKEN"))
 
 
 def get_model_prompt(conversation: list[dict[str, str]], model_name: str) -> Any:
-    model_name_hf_map = {
-        "meta-llama/llama-3-1-70b-instruct": "meta-llama/llama-3.1-70b-instruct",
-        "mistralai/mixtral-8x22B-instruct-v0.1": "mistralai/Mixtral-8x22B-Instruct-v0.1",
-        "ibm-granite/granite-3.1-8b-instruct": "ibm-granite/granite-3.1-8b-instruct",
-        "deepseek-ai/DeepSeek-V3": "deepseek-ai/DeepSeek-V3",
-    }
-    try:
-        tokenizer = AutoTokenizer.from_pretrained(
-            model_name_hf_map[model_name], token=os.getenv("HF_TOKEN")
-        )
-    except BaseException as e:
-        raise e
+    tokenizer = get_tokenizer(model_name)
     return tokenizer.decode(tokenizer.apply_chat_template(conversation))
 
 
@@ -96,23 +266,28 @@ def generate(
     temperature: float = 0,
     max_tokens: int = 256,
     stop: Any = None,
-) -> list[str]:
-
+) -> list[str | None]:
+    """
+    One generation per prompt, in the order of the prompts; None for a prompt whose Azure request
+    still failed after its retries
+    """
     generations = []
     if isinstance(llm, AzureOpenAI):
         for prompt in prompts:
             num_retries = 0
             while num_retries <= 10:
                 try:
-                    completions = llm.chat.completions.create(
-                        model=model_name,
-                        messages=[{"role": "user", "content": prompt}],
-                        temperature=temperature,
-                        max_tokens=max_tokens,
-                        # stream=False,
-                        timeout = 3600,
-                        stop=stop
-                    )
+                    with span("llm_call", model=model_name):
+                        completions = llm.chat.completions.create(
+                            model=model_name,
+                            messages=[{"role": "user", "content": prompt}],
+                            temperature=temperature,
+                            max_tokens=max_tokens,
+                            # stream=False,
+                            timeout = 3600,
+                            stop=stop
+                        )
+                    record_usage(completions.usage)
                     generation = completions.choices[0].message.content
                     generations.append(generation)
                     break
@@ -120,32 +295,88 @@ def generate(
                     import traceback
                     print("!! inside exception, sleeping", num_retries)
                     print(traceback.format_exc())
-                    time.sleep(200)
+                    time.sleep(RETRY_SLEEP_SECONDS)
                     num_retries += 1
+            else:
+                print(f"!! no generation after {num_retries} attempts")
+                generations.append(None)
     elif isinstance(llm, OpenAI):
-        completions = llm.completions.create(
-            model=model_name,
-            prompt=prompts,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            # stream=False,
-            timeout = 3600,
-            stop=stop,
-        )
+        with span("llm_call", model=model_name, prompts=len(prompts)):
+            completions = llm.completions.create(
+                model=model_name,
+                prompt=prompts,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                # stream=False,
+                timeout = 3600,
+                stop=stop,
+            )
 
+        record_usage(completions.usage)
         generations = [choice.text for choice in completions.choices]
 
         print(generations)
         return generations  # .content
+    elif isinstance(llm, OllamaLM):
+        options = {"temperature": temperature, "num_predict": max_tokens}
+        if stop:
+            options["stop"] = stop
+        generations = llm.complete_all([prompts] if isinstance(prompts, str) else prompts, **options)
     return generations
 
-def convert_dict_to_list_of_objects(json_dict):
+def write_response_blob(blob_dir: str, payload: Any) -> str:
+    """
+    Store a payload once in a content-addressed blob directory and return its reference
+    """
+    ref = get_response_ref(payload)
+    blob_path = os.path.join(blob_dir, ref + ".json")
+    if not os.path.exists(blob_path):
+        os.makedirs(blob_dir, exist_ok=True)
+        tmp_path = blob_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, blob_path)
+    return ref
+
+
+@lru_cache(maxsize=256)
+def read_response_blob(blob_dir: str, ref: str) -> Any:
+    with open(os.path.join(blob_dir, ref + ".json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def dedup_response_records(records: list[dict], blob_dir: str) -> list[dict]:
+    """
+    Replace the embedded api_response and schema of each record by response_ref / schema_ref
+    pointing into the blob directory
+    """
+    refs = {}  # questions about the same query share the same response object
+    for record in records:
+        for key, ref_key in (("api_response", "response_ref"), ("schema", "schema_ref")):
+            if key in record:
+                payload = record.pop(key)
+                if id(payload) not in refs:
+                    refs[id(payload)] = (write_response_blob(blob_dir, payload), payload)
+                record[ref_key] = refs[id(payload)][0]
+    return records
+
+
+def convert_dict_to_list_of_objects(json_dict, blob_dir: str | None = None):
+    # records written with response references are resolved from blob_dir, each blob is read once
     return_list = []
     for record in json_dict:
-        qa_pair_obj = LongResponseQASample(api_response=record['api_response'],
+        if "api_response" in record:
+            api_response = record['api_response']
+        else:
+            api_response = read_response_blob(blob_dir, record['response_ref'])
+        if "schema" in record:
+            schema = record['schema']
+        else:
+            schema = read_response_blob(blob_dir, record['schema_ref'])
+        qa_pair_obj = LongResponseQASample(api_response=api_response,
                         question=record['question'],
                         gold_answer=record['gold_answer'],
-                        schema=record['schema'],
+                        schema=schema,
                         pred_answer=record['predicted_answer'],
                         model_output=record['model_output'],
                         code_exec_status=record['code_exec_status'],
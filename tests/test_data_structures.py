@@ -0,0 +1,59 @@
+import json
+import os
+import pickle
+
+from generate_qa_pairs.tasks import utils
+from generate_qa_pairs.tasks.data_structures import LongResponseQASample, QABatch
+
+
+def prediction_record(uid, **fields):
+    record = {"uid": uid, "question": f"question {uid}", "gold_answer": "gold", "predicted_answer": "pred",
+              "model_output": "output", "code_exec_status": None, "metrics": {"exact_match_metric": "contains"},
+              "task": "task", "task_type": ["EXTRACTIVE"]}
+    record.update(fields)
+    return record
+
+
+def write_blob(blob_dir, ref, payload):
+    with open(os.path.join(blob_dir, ref + ".json"), "w", encoding="utf-8") as f:
+        json.dump(payload, f)
+
+
+def test_from_records_reads_each_referenced_response_once(tmp_path, monkeypatch):
+    blob_dir = str(tmp_path)
+    write_blob(blob_dir, "r1", {"response": 1})
+    write_blob(blob_dir, "r2", {"response": 2})
+    write_blob(blob_dir, "s", "schema")
+    reads = []
+    read_response_blob = utils.read_response_blob
+    monkeypatch.setattr(utils, "read_response_blob", lambda *args: reads.append(args[1]) or read_response_blob(*args))
+    records = [prediction_record(str(i), response_ref=ref, schema_ref="s") for i, ref in enumerate(["r1", "r2", "r1", "r1"])]
+    batch = QABatch.from_records(records, blob_dir=blob_dir)
+    assert reads.count("r1") == 1 and reads.count("r2") == 1
+    assert batch.responses == [{"response": 1}, {"response": 2}] and batch.response_idx == [0, 1, 0, 0]
+    assert batch.schemas == ["schema"] and batch.schema_idx == [0, 0, 0, 0]
+    assert [row.api_response for row in batch] == [{"response": 1}, {"response": 2}, {"response": 1}, {"response": 1}]
+    assert batch.metrics == ["contains"] * 4 and batch.pred_answer == ["pred"] * 4
+
+
+def test_from_records_with_embedded_responses():
+    shared = {"response": "shared"}
+    records = [prediction_record("0", api_response=shared, schema="schema"),
+               prediction_record("1", api_response=shared, schema="schema"),
+               # equal but not the same object, without a ref: kept apart
+               prediction_record("2", api_response={"response": "shared"}, schema="schema")]
+    batch = QABatch.from_records(records)
+    assert batch.response_idx == [0, 0, 1]
+    assert batch[2].api_response == shared
+
+
+def test_rows_write_through_and_round_trip():
+    samples = [LongResponseQASample(api_response={"a": 1}, question=f"q{i}", gold_answer="g", uid=str(i),
+                                    response_ref="ref") for i in range(2)]
+    batch = QABatch.from_samples(samples)
+    batch[1].pred_answer = "answer"
+    assert batch.pred_answer == [None, "answer"] and len(batch.responses) == 1
+    row = pickle.loads(pickle.dumps(batch[1]))
+    assert isinstance(row, LongResponseQASample) and row.pred_answer == "answer" and row.api_response == {"a": 1}
+    records = batch.to_records(endpoint="endpoint", setup_type="setup", model="model")
+    assert records[1]["predicted_answer"] == "answer" and records[0]["api_response"] is records[1]["api_response"]
@@ -0,0 +1,29 @@
+from codegen_scripts.direct_prompting_code import get_prompt_batched, parse_batched_answers
+from generate_qa_pairs.tasks.data_structures import LongResponseQASample
+
+
+def test_parse_json_answers():
+    output = 'Here are the answers:\n```json\n{"1": "Paris", "2": ["a", "b"], "3": 4, "4": null}\n```'
+    assert parse_batched_answers(output, 4) == {1: "Paris", 2: "a, b", 3: "4"}
+
+
+def test_parse_numbered_lines_when_not_json():
+    output = "1. Paris\n2) {not json\n 3: 42 \nnot an answer"
+    assert parse_batched_answers(output, 3) == {1: "Paris", 2: "{not json", 3: "42"}
+
+
+def test_answers_outside_the_batch_dropped():
+    assert parse_batched_answers('{"0": "x", "2": "y", "3": "z", "answer": "w"}', 2) == {2: "y"}
+
+
+def test_unparseable_output():
+    assert parse_batched_answers("I cannot answer these questions.", 3) == {}
+    assert parse_batched_answers("", 3) == {}
+
+
+def test_batched_prompt_numbers_the_questions():
+    samples = [LongResponseQASample(api_response={"a": 1}, question=f"question {i}", gold_answer="")
+               for i in range(1, 4)]
+    prompt = get_prompt_batched(samples)
+    assert all(f"question {i}" in prompt for i in range(1, 4))
+    assert prompt.index("question 1") < prompt.index("question 2") < prompt.index("question 3")
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from generate_qa_pairs.tasks import evals
+from generate_qa_pairs.tasks.data_structures import LongResponseQASample
+
+# (gold_answer, pred_answer) pairs around the normalizations of the string metrics
+ANSWER_PAIRS = [
+    ("Paris", "paris"),
+    ("Paris", " Paris. "),
+    ("Paris", "Paris.."),
+    ("Paris.", "paris."),
+    ("Paris.", "Paris"),
+    ("paris", "The capital is Paris."),
+    ("paris", "Paris is the capital"),
+    ("paris.", "paris"),
+    ("", ""),
+    ("", "."),
+    ("a", "."),
+    ("12", "1234"),
+    ("Ünïcode", "ünïcode"),
+    ("x", None),
+    (None, "x"),
+    (3, "3"),
+    (["a"], "a"),
+]
+
+
+def make_tasks():
+    return [LongResponseQASample(api_response={}, question="", gold_answer=gold, pred_answer=pred)
+            for gold, pred in ANSWER_PAIRS]
+
+
+@pytest.mark.parametrize("metric_name", ["accuracy_string", "contains"])
+def test_batch_metric_matches_per_sample_metric(metric_name):
+    metric = evals.get_metric(metric_name)
+    assert metric.batch_func is not None
+    batch = metric.evaluate_batch(make_tasks())
+    scalar = [bool(metric.func(task)) for task in make_tasks()]
+    assert [bool(value) for value in batch] == scalar
+
+
+def test_batch_metric_of_no_samples():
+    assert len(evals.get_metric("contains").evaluate_batch([])) == 0
+
+
+def test_metric_with_parameters_evaluated_per_sample():
+    results = evals.get_metric("accuracy_string").evaluate_batch(make_tasks()[:2], normalize=False)
+    assert results.dtype == np.dtype(object) and list(results) == [False, False]
+
+
+def test_get_metric_by_function():
+    assert evals.get_metric(evals.contains).name == "contains"
+    with pytest.raises(KeyError):
+        evals.get_metric(lambda task: True)
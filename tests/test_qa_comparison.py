@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "experimental_scripts"))
+
+import qa_comparison  # noqa: E402
+
+
+def eval_record(uid, task_type, **metrics):
+    return {"uid": uid, "question": f"question {uid}", "task_type": task_type, "metrics": metrics}
+
+
+@pytest.fixture
+def eval_records(monkeypatch):
+    records = {}
+    monkeypatch.setattr(qa_comparison, "load_eval_records",
+                        lambda file_prefix, setup, model, result_store=None: records[setup])
+    return records
+
+
+def test_compare_setups_counts_patterns(eval_records):
+    eval_records["a"] = [eval_record("1", "EXTRACTIVE", exact_match=True), eval_record("2", "EXTRACTIVE", exact_match=False)]
+    eval_records["b"] = [eval_record("1", "EXTRACTIVE", exact_match=False), eval_record("2", "EXTRACTIVE", exact_match=False)]
+    counts = qa_comparison.compare_setups("endpoint", ["a", "b"], "model", ["exact_match"], ["EXTRACTIVE"]).iloc[0]
+    assert (counts["count_TT"], counts["count_TF"], counts["count_FT"], counts["count_FF"]) == (0, 1, 0, 1)
+
+
+def test_compare_setups_without_common_samples(eval_records):
+    eval_records["a"] = [eval_record("1", "EXTRACTIVE", exact_match=True)]
+    eval_records["b"] = [eval_record("2", "EXTRACTIVE", exact_match=True)]
+    counts = qa_comparison.compare_setups("endpoint", ["a", "b"], "model", ["exact_match"], ["EXTRACTIVE"])
+    assert counts.filter(like="count_").to_numpy().sum() == 0
+
+
+def test_compare_setups_metric_never_computed(eval_records):
+    eval_records["a"] = [eval_record("1", "EXTRACTIVE", exact_match=True, llm_as_a_judge=None)]
+    eval_records["b"] = [eval_record("1", "EXTRACTIVE", exact_match=True, llm_as_a_judge=None)]
+    counts = qa_comparison.compare_setups("endpoint", ["a", "b"], "model", ["exact_match", "llm_as_a_judge"],
+                                          ["EXTRACTIVE"]).set_index("metric")
+    assert counts.loc["exact_match", "count_TT"] == 1
+    assert counts.loc["llm_as_a_judge"].filter(like="count_").sum() == 0
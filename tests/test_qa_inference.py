@@ -0,0 +1,124 @@
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+from openai import AzureOpenAI
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "experimental_scripts"))
+
+import qa_inference  # noqa: E402
+from generate_qa_pairs.tasks import utils  # noqa: E402
+from generate_qa_pairs.tasks.data_structures import LongResponseQASample, QABatch  # noqa: E402
+
+
+def make_samples(count, response_ref="response"):
+    api_response = {"items": list(range(count))}
+    return [LongResponseQASample(api_response=api_response, question=f"question {i}", gold_answer=str(i),
+                                 uid=str(i), response_ref=response_ref)
+            for i in range(count)]
+
+
+def fake_azure(answer):
+    # AzureOpenAI client whose completion is answer(prompt), raising when it returns an exception
+    def create(messages, **kwargs):
+        result = answer(messages[0]["content"])
+        if isinstance(result, Exception):
+            raise result
+        return SimpleNamespace(usage=None, choices=[SimpleNamespace(message=SimpleNamespace(content=result))])
+
+    llm = AzureOpenAI.__new__(AzureOpenAI)
+    llm.chat = SimpleNamespace(completions=SimpleNamespace(create=create))
+    return llm
+
+
+@pytest.fixture(autouse=True)
+def no_retry_sleep(monkeypatch):
+    monkeypatch.setattr(utils, "RETRY_SLEEP_SECONDS", 0)
+
+
+def test_grouped_dispatch_keeps_answers_on_their_uid(monkeypatch):
+    # the prompt of question 1 runs out of retries, the answers of the other questions keep their uid
+    samples = make_samples(4)
+    prompts = {qa_inference.get_prompt(sample, "direct_prompting"): sample.uid for sample in samples}
+    llm = fake_azure(lambda prompt: RuntimeError("rate limited") if prompts[prompt] == "1"
+                     else f"answer {prompts[prompt]}")
+    monkeypatch.setattr(qa_inference, "get_lm", lambda model_name, parameters: llm)
+    output = qa_inference.run_inference(samples, "direct_prompting", "Azure/gpt-4o", {})
+    assert [(sample.uid, sample.pred_answer) for sample in output] == [("0", "answer 0"), ("2", "answer 2"),
+                                                                       ("3", "answer 3")]
+
+
+def test_generate_returns_one_entry_per_prompt():
+    llm = fake_azure(lambda prompt: RuntimeError("down") if prompt == "b" else prompt.upper())
+    assert utils.generate(llm, "Azure/gpt-4o", ["a", "b", "c"]) == ["A", None, "C"]
+
+
+def test_run_inference_rejects_missing_generations(monkeypatch):
+    monkeypatch.setattr(qa_inference, "get_lm", lambda model_name, parameters: None)
+    monkeypatch.setattr(qa_inference, "generate", lambda **kwargs: ["only one"])
+    with pytest.raises(ValueError):
+        qa_inference.run_inference(make_samples(2), "direct_prompting", "Azure/gpt-4o", {})
+
+
+def test_batched_prompt_without_output_falls_back_to_single_questions(monkeypatch):
+    calls = []
+
+    def generate_or_error(llm, model_name, prompts):
+        calls.append(len(prompts))
+        # no output at all for the batched prompt, then the single questions one by one
+        return [] if len(calls) == 1 else [f"single {i}" for i in range(len(prompts))]
+
+    monkeypatch.setattr(qa_inference, "generate_or_error", generate_or_error)
+    output = qa_inference.run_inference_batched(make_samples(3), None, "Azure/gpt-4o")
+    assert calls == [1, 3]
+    assert [sample.pred_answer for sample in output] == ["single 0", "single 1", "single 2"]
+
+
+def test_batched_answers_and_fallback(monkeypatch):
+    def generate_or_error(llm, model_name, prompts):
+        if len(prompts) == 1 and "1." in prompts[0]:
+            return ['{"1": "a", "3": "c"}']
+        return [None]
+
+    monkeypatch.setattr(qa_inference, "generate_or_error", generate_or_error)
+    output = qa_inference.run_inference_batched(make_samples(3), None, "Azure/gpt-4o")
+    # question 2 is asked again alone, gets no output and stays pending
+    assert [(sample.uid, sample.pred_answer) for sample in output] == [("0", "a"), ("2", "c")]
+
+
+def test_read_checkpoint_drops_truncated_line(tmp_path):
+    checkpoint_path = str(tmp_path / "cell.jsonl")
+    samples = make_samples(2)
+    samples[0].pred_answer = "answer 0"
+    with open(checkpoint_path, "w", encoding="utf-8") as f:
+        qa_inference.append_checkpoint(f, samples[0])
+        f.write('{"uid": "1", "predicted_ans')
+    completed = qa_inference.read_checkpoint(checkpoint_path)
+    assert list(completed) == ["0"] and completed["0"]["predicted_answer"] == "answer 0"
+    with open(checkpoint_path, encoding="utf-8") as f:
+        assert [json.loads(line)["uid"] for line in f] == ["0"]
+
+
+def test_merge_checkpoint_leaves_missing_samples_pending(tmp_path):
+    checkpoint_path = str(tmp_path / "cell.jsonl")
+    qa_batch = QABatch.from_samples(make_samples(3))
+    with open(checkpoint_path, "w", encoding="utf-8") as f:
+        for row in (qa_batch[2], qa_batch[0]):
+            row.pred_answer = f"answer {row.uid}"
+            qa_inference.append_checkpoint(f, row.to_sample())
+    qa_batch = QABatch.from_samples(make_samples(3))
+    missing = qa_inference.merge_checkpoint(qa_batch, qa_inference.read_checkpoint(checkpoint_path))
+    assert missing == ["1"]
+    assert qa_batch.pred_answer == ["answer 0", None, "answer 2"]
+    # the resumed run only dispatches the missing sample
+    completed = qa_inference.read_checkpoint(checkpoint_path)
+    assert [sample.uid for sample in qa_batch if sample.uid not in completed] == ["1"]
+
+
+def test_group_samples_by_response():
+    samples = make_samples(5, response_ref="a") + make_samples(2, response_ref="b")
+    groups = qa_inference.group_samples_by_response(samples, max_group_size=2)
+    assert [[sample.response_ref for sample in group] for group in groups] == [["a", "a"], ["a", "a"], ["a"],
+                                                                              ["b", "b"]]
@@ -0,0 +1,98 @@
+import json
+import os
+
+import pytest
+
+from generate_qa_pairs import response_reader
+
+RESPONSES = {
+    "app": {
+        "endpoint": {
+            "query {1}": {"items": [{"name": "a \"quoted\" {brace}", "price": 1.5}], "next": None},
+            "query 2": [1, 2, [3, "]"]],
+            "query 3": "a string response",
+            "query 4": 42,
+            "query 5": None,
+        },
+        "other endpoint": {"query": {"escaped": "back\\slash\\"}},
+    }
+}
+
+
+@pytest.fixture
+def response_file(tmp_path):
+    path = str(tmp_path / "responses.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(RESPONSES, f, indent=2)
+    response_reader._OFFSET_INDEXES.clear()
+    yield path
+    response_reader._OFFSET_INDEXES.clear()
+
+
+def expected_responses():
+    return [(app, endpoint, api_query, api_response)
+            for app, endpoints in RESPONSES.items()
+            for endpoint, queries in endpoints.items()
+            for api_query, api_response in queries.items()]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 1 << 20])
+def test_iter_response_spans_across_chunks(response_file, chunk_size):
+    with open(response_file, "rb") as f:
+        spans = list(response_reader.iter_response_spans(f, chunk_size=chunk_size, capture=True))
+    assert [(app, endpoint, api_query, json.loads(raw)) for app, endpoint, api_query, _, _, raw in spans] \
+        == expected_responses()
+    with open(response_file, "rb") as f:
+        data = f.read()
+    for _, _, _, offset, length, raw in spans:
+        assert data[offset:offset + length] == raw
+
+
+def test_load_api_response_from_offset_index(response_file):
+    for app, endpoint, api_query, api_response in expected_responses():
+        assert response_reader.load_api_response(response_file, app, endpoint, api_query, verify=True) == api_response
+    index = response_reader.read_offset_index(response_file)
+    assert index["app", "endpoint", "query 2"][2] == response_reader.get_response_ref([1, 2, [3, "]"]])
+
+
+def test_sidecar_written_and_reused(response_file, monkeypatch):
+    response_reader.read_offset_index(response_file)
+    with open(response_reader.index_path(response_file), encoding="utf-8") as f:
+        assert json.load(f)["version"] == response_reader.INDEX_VERSION
+    response_reader._OFFSET_INDEXES.clear()
+    monkeypatch.setattr(response_reader, "build_offset_index", lambda path: pytest.fail("sidecar not reused"))
+    assert ("app", "endpoint", "query 4") in response_reader.read_offset_index(response_file)
+
+
+def test_sidecar_regenerated_when_source_changes(response_file):
+    response_reader.read_offset_index(response_file)
+    changed = {"app": {"endpoint": {"new query": {"value": 1}}}}
+    with open(response_file, "w", encoding="utf-8") as f:
+        json.dump(changed, f)
+    index = response_reader.read_offset_index(response_file)
+    assert list(index) == [("app", "endpoint", "new query")]
+    assert response_reader.load_api_response(response_file, "app", "endpoint", "new query") == {"value": 1}
+
+
+def test_sidecar_of_another_version_regenerated(response_file):
+    response_reader.read_offset_index(response_file)
+    sidecar_path = response_reader.index_path(response_file)
+    with open(sidecar_path, encoding="utf-8") as f:
+        sidecar = json.load(f)
+    # an older sidecar, with a hash of the raw bytes instead of the response ref
+    sidecar["version"] = response_reader.INDEX_VERSION - 1
+    sidecar["responses"]["app"]["endpoint"]["query 4"][2] = "stale"
+    with open(sidecar_path, "w", encoding="utf-8") as f:
+        json.dump(sidecar, f)
+    response_reader._OFFSET_INDEXES.clear()
+    index = response_reader.read_offset_index(response_file)
+    assert index["app", "endpoint", "query 4"][2] == response_reader.get_response_ref(42)
+
+
+def test_truncated_sidecar_regenerated(response_file):
+    response_reader.read_offset_index(response_file)
+    with open(response_reader.index_path(response_file), "w", encoding="utf-8") as f:
+        f.write('{"version": 2, "source_mt')
+    response_reader._OFFSET_INDEXES.clear()
+    assert len(response_reader.read_offset_index(response_file)) == len(expected_responses())
+    assert not [name for name in os.listdir(os.path.dirname(response_file)) if name.endswith(".tmp")]